@@ -0,0 +1,68 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class AggregateTable:
+    """
+    Every user's best value per (workout type, metric) as NumPy columns
+
+    Mirrors the "current_progress" part of the progress records: one row per user,
+    one float64 column per (type, metric) such as ("running", "distance_7d"), NaN
+    where a user never recorded that metric. GameEngine updates a row whenever it
+    saves a record, so a new requirement can be checked against all users with
+    one vectorized comparison instead of a pass over the records.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.rows = {}  # type: Dict[str, int]  # user_id -> row
+        self.user_ids = []  # type: List[str]  # row -> user_id
+        self.columns = {}  # type: Dict[Tuple[str, str], np.ndarray]
+        self.complete = True  # False while some stored records were never seen (e.g. after a restart)
+        self.lock = threading.Lock()
+
+    def _row(self, user_id: str) -> int:
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            if row >= self.capacity:
+                self.capacity *= 2
+                for key, column in self.columns.items():
+                    grown = np.full(self.capacity, np.nan)
+                    grown[:len(column)] = column
+                    self.columns[key] = grown
+        return row
+
+    def update(self, user_id: str, current_progress: Dict[str, Dict[str, float]]):
+        """Copy a record's best values into the user's row (call with the user's shard lock held)"""
+        with self.lock:
+            row = self._row(user_id)
+            for workout_type, best in current_progress.items():
+                for metric, value in best.items():
+                    column = self.columns.get((workout_type, metric))
+                    if column is None:
+                        column = self.columns[(workout_type, metric)] = np.full(self.capacity, np.nan)
+                    column[row] = value
+
+    def clear(self, user_id: str): # progress reset: the row keeps its slot but holds no values
+        with self.lock:
+            row = self.rows.get(user_id)
+            if row is not None:
+                for column in self.columns.values():
+                    column[row] = np.nan
+
+    def matching(self, workout_type: str, metric: str, threshold: float) -> np.ndarray:
+        """Rows whose best value reaches `threshold` (NaN never does)"""
+        with self.lock:
+            column = self.columns.get((workout_type, metric))
+            if column is None:
+                return np.empty(0, dtype=np.int64)
+            return np.flatnonzero(column[:len(self.user_ids)] >= threshold)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"users": len(self.user_ids), "columns": len(self.columns), "complete": self.complete,
+                    "bytes": sum(column.nbytes for column in self.columns.values())}
@@ -1,12 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from game_engine import GameEngine
+from job_queue import PRIORITY_INTERACTIVE
+from metrics import (CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_LATENCY, PROFILER, REGISTRY, current_trace, end_trace,
+                     should_trace, start_trace)
+from services import (ENDPOINTS, game_engine, jobs, sessions, available_content_response, etag_matches,
+                      profiler_control, profiler_report, requirements_response, status_report, reset_user,
+                      resolve_session, resolve_user_id, sse_event, workout_audit)
+from session_registry import InvalidIdError, UnknownCharacterError
 import json
+import logging
+import os
+import time
 
 app = Flask(__name__)
 CORS(app)
+log = logging.getLogger("lovefit.api")
 
-game_engine = GameEngine()
+@app.before_request
+def start_request(): # latency clock and, for X-Trace requests, a trace collecting spans
+    g.started = time.perf_counter()
+    g.trace_token = None
+    HTTP_IN_FLIGHT.inc()
+    if should_trace(request.headers.get('X-Trace')):
+        _, g.trace_token = start_trace(f"{request.method} {request.path}", request.headers.get('X-Trace-Id'))
+
+@app.after_request
+def finish_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"  # templates keep label cardinality low
+    method, status = request.method, response.status_code
+    started, token = g.get('started', time.perf_counter()), g.get('trace_token')
+    trace = current_trace()
+    if trace is not None:
+        response.headers['X-Trace-Id'] = trace.id
+        timing = trace.server_timing()
+        if timing and not response.is_streamed:
+            response.headers['Server-Timing'] = timing
+
+    def done(): # after the last byte, so streams are measured in full
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=route, method=method, status=status)
+        HTTP_IN_FLIGHT.dec()
+        if token is not None:
+            end_trace(token, status)
+
+    response.call_on_close(done)
+    return response
+
+def request_user_id(payload=None) -> str: # caller identity: body/query "user_id", then X-User-Id header
+    payload = payload if payload is not None else (request.get_json(silent=True) or request.args)
+    return resolve_user_id(payload, request.headers.get('X-User-Id'))
+
+@app.errorhandler(InvalidIdError)
+def bad_identifier(e): # invalid user/character ids
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+def sse_response(events) -> Response:
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route('/api/test', methods=['GET'])
 def test_connection(): # test connection API 测试连接用的接口
@@ -14,47 +66,175 @@ def test_connection(): # test connection API 测试连接用的接口
         "status": "success", 
         "message": "Python Server is Running!",
         "timestamp": "2024-10-17 00:30:00",
-        "endpoints": {
-            "test": "/api/test",
-            "submit_workout": "/api/user-progress",
-            "get_content": "/api/available-content/<user_id>"
-        }
+        "endpoints": ENDPOINTS
     })
 
 @app.route('/api/user-progress', methods=['POST'])
 def update_progress(): # update game with receiving sports data 接收运动数据，更新游戏进度
-    data = request.json
-    print(f"🎯 Received workouts data: {data}")
-    
-    user_id = "test_user"
-    workout_type = data.get('type')
-    distance = data.get('distance', 0)
-    duration = data.get('duration', 0)
-    
-    result = game_engine.process_workout(user_id, workout_type, distance, duration)
-    print(f"📦 Return result: {result}")
+    data = request.get_json(silent=True)
+    log.debug("workout received", extra={"fields": {"workout": data}})
+
+    user_id = request_user_id(data if isinstance(data, dict) else None)
+    try:
+        # type, distance, duration, id (HealthKit sample UUID, makes retries idempotent), timestamp (unix seconds)
+        workout = game_engine.parse_workout(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    result = game_engine.process_workout(user_id, workout["type"], workout["distance"], workout["duration"],
+                                         workout["id"], workout["timestamp"])
+    log.debug("workout processed", extra={"fields": {"user_id": user_id, "result": result}})
+    if result["newly_unlocked"]:
+        log.info("stories unlocked", extra={"fields": {"user_id": user_id, "stories": result["newly_unlocked"]}})
     
     return jsonify(result)
 
+@app.route('/api/user-progress/batch', methods=['POST'])
+def update_progress_batch(): # HealthKit backfill: JSON array or NDJSON stream of workouts 批量同步运动数据
+    if request.mimetype == 'application/x-ndjson':
+        user_id = request_user_id(request.args)
+        workouts = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                workouts.append(json.loads(line))
+            except ValueError:
+                workouts.append(None)  # reported as a per-item error by the engine
+    else:
+        data = request.get_json(silent=True)
+        user_id = request_user_id(data if isinstance(data, dict) else request.args)
+        workouts = data.get('workouts') if isinstance(data, dict) else data
+        if not isinstance(workouts, list):
+            return jsonify({"status": "error", "message": "Expected a list of workouts."}), 400
+
+    result = game_engine.process_workouts(user_id, workouts)
+    log.info("workout batch processed", extra={"fields": {
+        "user_id": user_id, "workouts": len(workouts), "accepted": result["accepted"],
+        "newly_unlocked": result["newly_unlocked"]}})
+
+    return jsonify(result)
+
+def cached_json(etag: str, body: bytes, cache_control: str) -> Response: # 200 with the body, or 304 when the client has it
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
 @app.route('/api/available-content/<user_id>', methods=['GET'])
 def get_available_content(user_id): # 获取用户当前可解锁的剧情内容
-    content = game_engine.get_available_content(user_id)
-    return jsonify(content)
+    etag, body = available_content_response(user_id)
+    return cached_json(etag, body, "no-cache")  # revalidate every poll; unchanged progress costs a 304
+
+@app.route('/api/requirements', methods=['GET'])
+def get_requirements(): # unlock requirements catalogue (hot-reloaded from requirements.json, hence the short max-age)
+    etag, body = requirements_response()
+    return cached_json(etag, body, "public, max-age=60")
+
+def request_session(payload): # (user_id, character_id) of a character request
+    return resolve_session(payload, request.headers.get('X-User-Id'))
+
+@app.errorhandler(UnknownCharacterError)
+def unknown_character(e):
+    return jsonify({"status": "error", "message": str(e)}), 404
+
+@app.route('/api/character/chat/stream', methods=['GET', 'POST'])
+def chat_stream(): # SSE: 逐 token 推送角色聊天回复
+    payload = request.get_json(silent=True) or request.args
+    message = payload.get('message')
+    if not message:
+        return jsonify({"status": "error", "message": "Missing message."}), 400
+    user_id, character_id = request_session(payload)
+
+    def events():
+        try:
+            with sessions.session(user_id, character_id) as character:
+                for token in character.chat_stream(message):
+                    yield sse_event("token", {"content": token})
+        except Exception as e:  # the model failed: an error event, so clients can tell it from a reply
+            log.error("chat stream failed", extra={"fields": {"user_id": user_id, "error": str(e)}})
+            yield sse_event("error", {"error": f"对话出错: {str(e)}"})
+            return
+        yield sse_event("done", {})
+
+    return sse_response(events())
+
+@app.route('/api/character/story/stream', methods=['GET', 'POST'])
+def story_stream(): # SSE: 逐 token 推送剧情推进，最后推送章节状态
+    payload = request.get_json(silent=True) or request.args
+    action = payload.get('action')
+    if not action:
+        return jsonify({"status": "error", "message": "Missing action."}), 400
+    user_id, character_id = request_session(payload)
+
+    def events():
+        with sessions.session(user_id, character_id) as character:
+            for item in character.advance_story_stream(action):
+                if isinstance(item, str):
+                    yield sse_event("token", {"content": item})
+                elif "error" in item:
+                    yield sse_event("error", item)
+                else:
+                    yield sse_event("done", item)
+
+    return sse_response(events())
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job(): # 排队一次聊天/剧情生成，立即返回任务 ID，之后轮询结果
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object."}), 400
+    kind = payload.get('kind')
+    field = {"chat": "message", "story": "action"}.get(kind)
+    if field is None:
+        return jsonify({"status": "error", "message": "kind must be 'chat' or 'story'."}), 400
+    if not payload.get(field):
+        return jsonify({"status": "error", "message": f"Missing {field}."}), 400
+    user_id, character_id = request_session(payload)
+
+    job_id = jobs.submit(kind, {"user_id": user_id, "character": character_id, field: payload[field]},
+                         PRIORITY_INTERACTIVE, user_id)
+    return jsonify({"status": "queued", "job_id": job_id, "status_url": f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id): # GET ?wait=秒数 长轮询直到任务结束；DELETE 取消任务
+    job = jobs.get(job_id)
+    if job is None or job["owner"] != request_user_id():
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    if request.method == 'DELETE':
+        return jsonify({"cancelled": jobs.cancel(job_id), "job": jobs.get(job_id)})
+
+    wait = min(request.args.get('wait', 0, type=float), 60.0)
+    if wait > 0:
+        job = jobs.wait(job_id, wait)
+    return jsonify(job)
 
 @app.route('/api/debug/reset', methods=['POST'])
 def debug_reset(): # 调试用：重置用户进度
-    user_id = "test_user"
-    if user_id in game_engine.user_progress:
-        del game_engine.user_progress[user_id]
+    reset_user(request_user_id())
     return jsonify({"status": "success", "message": "User progress reset."})
 
 @app.route('/api/debug/status', methods=['GET'])
 def debug_status(): # 调试用：查看当前状态
-    user_id = "test_user"
-    return jsonify({
-        "user_progress": game_engine.user_progress.get(user_id, "User not available."),
-        "requirements": game_engine.requirements
-    })
+    return jsonify(status_report(request_user_id()))
+
+@app.route('/api/debug/workout-log', methods=['GET'])
+def debug_workout_log(): # 调试用：查看用户的运动事件日志，核对进度
+    return jsonify(workout_audit(request_user_id()))
+
+@app.route('/metrics', methods=['GET'])
+def metrics(): # Prometheus scrape endpoint
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/debug/profiler', methods=['GET', 'POST'])
+def debug_profiler(): # 调试用：开关采样分析器；GET ?format=folded 导出火焰图输入
+    if request.method == 'POST':
+        return jsonify(profiler_control(request.get_json(silent=True) or {}))
+    if request.args.get('format') == 'folded':
+        return Response(PROFILER.folded(), mimetype='text/plain')
+    return jsonify(profiler_report())
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # LOVEFIT_DEBUG=1 turns on Flask's debugger and reloader (local development only: the debugger runs arbitrary code)
+    app.run(host='0.0.0.0', port=5001, debug=bool(os.environ.get("LOVEFIT_DEBUG")))
\ No newline at end of file
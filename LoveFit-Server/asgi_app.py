@@ -0,0 +1,477 @@
+# ASGI entry point serving the same API as app.py, for production use.
+#
+#   single process:  uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+#   multi-worker:    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:5001 --graceful-timeout 30
+#
+# Workers are separate processes. Set LOVEFIT_PROGRESS_DB and LOVEFIT_JOBS_DB so they share
+# progress and the job queue, and route each user to one worker (e.g. hash X-User-Id at the
+# proxy) because character sessions and chat logs are cached per process. On shutdown (SIGTERM)
+# the lifespan handler stops the job workers and flushes sessions, progress and pending writes.
+# GET /metrics reports the worker that answers it, so scrape each worker (or run one per port).
+#
+# No web framework is needed: routing, JSON and SSE are handled here on plain ASGI.
+# GameEngine calls run off the event loop on a small pool (LOVEFIT_ENGINE_THREADS, default 4),
+# each user serialized by the engine's per-user shard lock;
+# LLM streams run on a thread pool and are bridged to the loop token by token.
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from job_queue import PRIORITY_INTERACTIVE
+from metrics import (CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_LATENCY, PROFILER, REGISTRY, current_trace, end_trace,
+                     should_trace, start_trace)
+from services import (ENDPOINTS, game_engine, jobs, sessions, available_content_response, etag_matches,
+                      profiler_control, profiler_report, requirements_response, status_report, reset_user,
+                      resolve_session, resolve_user_id, shutdown, sse_event, workout_audit)
+from session_registry import InvalidIdError, UnknownCharacterError
+
+# GameEngine serializes each user on its shard lock, so a few threads keep the event loop free without reordering a user's calls
+_engine_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("LOVEFIT_ENGINE_THREADS", "4")), thread_name_prefix="engine")
+_stream_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-stream")  # threads mostly wait on the model
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+log = logging.getLogger("lovefit.api")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, scope: Dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        self.body = body
+        self.route = "unmatched"  # path template of the matched route, set by dispatch()
+
+    @property
+    def mimetype(self) -> str:
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    def json(self): # like Flask's get_json(silent=True)
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+    def payload(self): # JSON object body, else the query string
+        data = self.json()
+        return data if isinstance(data, dict) and data else self.query
+
+    @property
+    def user_header(self) -> Optional[str]:
+        return self.headers.get("x-user-id")
+
+
+class JSONResponse:
+    content_type = b"application/json"
+    extra_headers = ()  # e.g. Server-Timing of a traced request
+
+    def __init__(self, data, status: int = 200):
+        self.status = status
+        self.body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    async def send(self, send, receive):
+        await send({"type": "http.response.start", "status": self.status, "headers": [
+            (b"content-type", self.content_type), (b"content-length", str(len(self.body)).encode())
+        ] + CORS_HEADERS + list(self.extra_headers)})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class TextResponse(JSONResponse):
+    def __init__(self, text: str, content_type: str = "text/plain; charset=utf-8", status: int = 200):
+        self.status = status
+        self.body = text.encode("utf-8")
+        self.content_type = content_type.encode("latin-1")
+
+
+class CachedJSONResponse: # pre-serialized JSON with an ETag; 304 without a body when the client's copy is current
+    extra_headers = ()
+
+    def __init__(self, request: Request, etag: str, body: bytes, cache_control: str):
+        self.not_modified = etag_matches(request.headers.get("if-none-match"), etag)
+        self.status = 304 if self.not_modified else 200
+        self.body = b"" if self.not_modified else body
+        self.headers = [(b"etag", etag.encode("latin-1")), (b"cache-control", cache_control.encode("latin-1"))]
+
+    async def send(self, send, receive):
+        headers = self.headers + CORS_HEADERS + list(self.extra_headers)
+        if not self.not_modified:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(self.body)).encode())]
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class EventStreamResponse:
+    status = 200
+    extra_headers = ()
+
+    def __init__(self, events):
+        self.events = events  # async iterator of SSE frames
+
+    async def send(self, send, receive):
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")
+        ] + CORS_HEADERS + list(self.extra_headers)})
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            async for frame in self.events:
+                if disconnected.is_set():
+                    break  # client went away: stop generating
+                await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            await self.events.aclose()
+
+
+async def iterate_in_thread(make_iterator: Callable[[], Iterator]):
+    """Run a blocking iterator on the stream pool and yield its items on the event loop"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            stop.set()  # event loop already closed
+
+    def produce():
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                put((item, None))
+        except Exception as e:
+            put((end, e))
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        put((end, None))
+
+    loop.run_in_executor(_stream_executor, contextvars.copy_context().run, produce)  # keeps the request's trace
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+async def in_engine(fn, *args): # GameEngine work on the engine pool (per-user locking happens inside the engine)
+    return await asyncio.get_running_loop().run_in_executor(_engine_executor, contextvars.copy_context().run, fn, *args)
+
+
+async def in_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+
+ROUTES = []  # type: List[Tuple[str, re.Pattern, Callable, str]]
+
+
+def route(path: str, methods=("GET",)):
+    pattern = re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", path) + "$")
+
+    def register(handler):
+        for method in methods:
+            ROUTES.append((method, pattern, handler, path))
+        return handler
+    return register
+
+
+@route('/api/test')
+async def test_connection(request: Request):
+    return JSONResponse({
+        "status": "success",
+        "message": "Python Server is Running!",
+        "timestamp": "2024-10-17 00:30:00",
+        "endpoints": ENDPOINTS
+    })
+
+
+@route('/api/user-progress', methods=("POST",))
+async def update_progress(request: Request):
+    data = request.json()
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Expected a workout object.")
+    user_id = resolve_user_id(data, request.user_header)
+    try:
+        workout = game_engine.parse_workout(data)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    result = await in_engine(
+        game_engine.process_workout, user_id, workout["type"], workout["distance"], workout["duration"],
+        workout["id"], workout["timestamp"]
+    )
+    return JSONResponse(result)
+
+
+@route('/api/user-progress/batch', methods=("POST",))
+async def update_progress_batch(request: Request):
+    if request.mimetype == 'application/x-ndjson':
+        user_id = resolve_user_id(request.query, request.user_header)
+        workouts = []
+        for line in request.body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                workouts.append(json.loads(line))
+            except ValueError:
+                workouts.append(None)  # reported as a per-item error by the engine
+    else:
+        data = request.json()
+        user_id = resolve_user_id(data if isinstance(data, dict) else request.query, request.user_header)
+        workouts = data.get('workouts') if isinstance(data, dict) else data
+        if not isinstance(workouts, list):
+            raise HTTPError(400, "Expected a list of workouts.")
+    return JSONResponse(await in_engine(game_engine.process_workouts, user_id, workouts))
+
+
+@route('/api/available-content/<user_id>')
+async def get_available_content(request: Request, user_id: str):
+    etag, body = await in_engine(available_content_response, user_id)
+    return CachedJSONResponse(request, etag, body, "no-cache")
+
+
+@route('/api/requirements')
+async def get_requirements(request: Request):
+    etag, body = requirements_response()
+    return CachedJSONResponse(request, etag, body, "public, max-age=60")
+
+
+@route('/api/character/chat/stream', methods=("GET", "POST"))
+async def chat_stream(request: Request):
+    payload = request.payload()
+    message = payload.get('message')
+    if not message:
+        raise HTTPError(400, "Missing message.")
+    user_id, character_id = resolve_session(payload, request.user_header)
+
+    def tokens():
+        with sessions.session(user_id, character_id) as character:
+            yield from character.chat_stream(message)
+
+    async def events():
+        try:
+            async for token in iterate_in_thread(tokens):
+                yield sse_event("token", {"content": token})
+        except Exception as e:  # the model failed: an error event, so clients can tell it from a reply
+            log.error("chat stream failed", extra={"fields": {"user_id": user_id, "error": str(e)}})
+            yield sse_event("error", {"error": f"对话出错: {str(e)}"})
+            return
+        yield sse_event("done", {})
+
+    return EventStreamResponse(events())
+
+
+@route('/api/character/story/stream', methods=("GET", "POST"))
+async def story_stream(request: Request):
+    payload = request.payload()
+    action = payload.get('action')
+    if not action:
+        raise HTTPError(400, "Missing action.")
+    user_id, character_id = resolve_session(payload, request.user_header)
+
+    def items():
+        with sessions.session(user_id, character_id) as character:
+            yield from character.advance_story_stream(action)
+
+    async def events():
+        async for item in iterate_in_thread(items):
+            if isinstance(item, str):
+                yield sse_event("token", {"content": item})
+            elif "error" in item:
+                yield sse_event("error", item)
+            else:
+                yield sse_event("done", item)
+
+    return EventStreamResponse(events())
+
+
+@route('/api/jobs', methods=("POST",))
+async def submit_job(request: Request):
+    payload = request.json() or {}
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "Expected a JSON object.")
+    kind = payload.get('kind')
+    field = {"chat": "message", "story": "action"}.get(kind)
+    if field is None:
+        raise HTTPError(400, "kind must be 'chat' or 'story'.")
+    if not payload.get(field):
+        raise HTTPError(400, f"Missing {field}.")
+    user_id, character_id = resolve_session(payload, request.user_header)
+
+    job_id = await in_thread(jobs.submit, kind, {"user_id": user_id, "character": character_id, field: payload[field]},
+                             PRIORITY_INTERACTIVE, user_id)
+    return JSONResponse({"status": "queued", "job_id": job_id, "status_url": f"/api/jobs/{job_id}"}, 202)
+
+
+@route('/api/jobs/<job_id>', methods=("GET", "DELETE"))
+async def job_status(request: Request, job_id: str):
+    job = await in_thread(jobs.get, job_id)
+    if job is None or job["owner"] != resolve_user_id(request.payload(), request.user_header):
+        raise HTTPError(404, "Job not found.")
+    if request.method == "DELETE":
+        cancelled = await in_thread(jobs.cancel, job_id)
+        return JSONResponse({"cancelled": cancelled, "job": await in_thread(jobs.get, job_id)})
+
+    try:
+        wait = min(float(request.query.get('wait', 0)), 60.0)
+    except ValueError:
+        wait = 0.0
+    if wait > 0:
+        job = await in_thread(jobs.wait, job_id, wait)
+    return JSONResponse(job)
+
+
+@route('/api/debug/reset', methods=("POST",))
+async def debug_reset(request: Request):
+    await in_engine(reset_user, resolve_user_id(request.payload(), request.user_header))
+    return JSONResponse({"status": "success", "message": "User progress reset."})
+
+
+@route('/metrics')
+async def metrics(request: Request):
+    return TextResponse(REGISTRY.render(), CONTENT_TYPE)
+
+
+@route('/api/debug/profiler', methods=("GET", "POST"))
+async def debug_profiler(request: Request):
+    if request.method == "POST":
+        return JSONResponse(profiler_control(request.json() or {}))
+    if request.query.get('format') == 'folded':
+        return TextResponse(PROFILER.folded())
+    return JSONResponse(profiler_report())
+
+
+@route('/api/debug/status')
+async def debug_status(request: Request):
+    user_id = resolve_user_id(request.payload(), request.user_header)
+    return JSONResponse(await in_engine(status_report, user_id))
+
+
+@route('/api/debug/workout-log')
+async def debug_workout_log(request: Request):
+    user_id = resolve_user_id(request.payload(), request.user_header)
+    return JSONResponse(await in_engine(workout_audit, user_id))
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("client disconnected")
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def dispatch(request: Request):
+    allowed = False
+    for method, pattern, handler, path in ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if method != request.method:
+            allowed = True
+            continue
+        request.route = path
+        return await handler(request, **match.groupdict())
+    if allowed:
+        raise HTTPError(405, "Method not allowed.")
+    raise HTTPError(404, "Not found.")
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)  # flush before the worker exits
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "OPTIONS":  # CORS preflight
+        await send({"type": "http.response.start", "status": 204, "headers": CORS_HEADERS + [
+            (b"access-control-allow-methods", b"GET, POST, DELETE, OPTIONS"),
+            (b"access-control-allow-headers", b"content-type, x-user-id"),
+        ]})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    try:
+        request = Request(scope, await read_body(receive))
+    except ConnectionError:
+        return
+    started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    token = None
+    if should_trace(request.headers.get("x-trace")):
+        _, token = start_trace(f"{request.method} {request.path}", request.headers.get("x-trace-id"))
+    response = None
+    try:
+        try:
+            response = await dispatch(request)
+        except HTTPError as e:
+            response = JSONResponse({"status": "error", "message": str(e)}, e.status)
+        except InvalidIdError as e:
+            response = JSONResponse({"status": "error", "message": str(e)}, 400)
+        except UnknownCharacterError as e:
+            response = JSONResponse({"status": "error", "message": str(e)}, 404)
+        except Exception:
+            log.exception("request failed", extra={"fields": {"method": request.method, "path": request.path}})
+            response = JSONResponse({"status": "error", "message": "Internal server error."}, 500)
+        trace = current_trace()
+        if trace is not None:
+            headers = [(b"x-trace-id", trace.id.encode("latin-1"))]
+            timing = trace.server_timing()
+            if timing and not isinstance(response, EventStreamResponse):
+                headers.append((b"server-timing", timing.encode("latin-1")))
+            response.extra_headers = headers
+        await response.send(send, receive)
+    finally:
+        status = response.status if response is not None else 500
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=request.route, method=request.method, status=status)
+        HTTP_IN_FLIGHT.dec()
+        if token is not None:
+            end_trace(token, status)
@@ -0,0 +1,199 @@
+# Benchmark of the unlock backfill that runs when the requirements catalogue changes.
+#
+#   python bench/backfill.py                  # 100k users, 50 new stories
+#   python bench/backfill.py --users 1000000  # slow to set up: every user goes through process_workout
+#
+# Loads users with a few workouts each, then edits the catalogue file and reloads it twice:
+#   - cold: aggregate columns must first be filled from the records (as after a restart)
+#   - warm: columns already up to date (the normal hot-reload case)
+# Each run is compared with a plain per-user evaluation of the same stories (the unlocked sets
+# must match), and request latency is sampled while the backfill runs.
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from common import summarize, write_results
+
+from aggregates import AggregateTable
+from catalogue import DEFAULT_REQUIREMENTS_FILE
+from game_engine import GameEngine, requirement_metrics
+
+WORKOUT_TYPES = ("running", "walking", "cycling", "swimming")
+DAY = 86400
+
+
+def new_stories(count: int, prefix: str, seed: int) -> Dict[str, Dict]:
+    rng = random.Random(seed)
+    stories = {}
+    for i in range(count):
+        requirement = {"type": rng.choice(WORKOUT_TYPES)}
+        kind = rng.choice(("distance", "duration", "streak_days", "window"))
+        if kind == "distance":
+            requirement["distance"] = rng.randint(2, 40) * 500
+        elif kind == "duration":
+            requirement["duration"] = rng.randint(10, 180) * 60
+        elif kind == "streak_days":
+            requirement["streak_days"] = rng.randint(2, 5)
+        else:
+            requirement["distance"] = rng.randint(5, 60) * 1000
+            requirement["window_days"] = 7
+        stories[f"{prefix}_{i}"] = requirement
+    return stories
+
+
+def naive_candidates(engine: GameEngine, stories: Dict[str, Dict]) -> Dict[str, set]: # story -> qualifying users, record by record
+    result = {story_id: set() for story_id in stories}
+    for user_id in engine.store.user_ids():
+        progress = engine.store.get(user_id)["current_progress"]
+        for story_id, req in stories.items():
+            best = progress.get(req["type"], {})
+            if any(best.get(metric, -1) >= threshold for metric, threshold in requirement_metrics(req)):
+                result[story_id].add(user_id)
+    return result
+
+
+def unlocked_by(engine: GameEngine, stories: Dict[str, Dict]) -> Dict[str, set]:
+    result = {story_id: set() for story_id in stories}
+    for user_id in engine.store.user_ids():
+        for story_id in engine.store.get(user_id)["unlocked_stories"]:
+            if story_id in result:
+                result[story_id].add(user_id)
+    return result
+
+
+class Prober(threading.Thread): # samples request latency (content reads and workouts) until stopped
+    def __init__(self, engine: GameEngine, users: int, seed: int):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.users = users
+        self.rng = random.Random(seed)
+        self.samples = []  # type: List[float]
+        self.stop = threading.Event()
+
+    def run(self):
+        sequence = 0
+        while not self.stop.is_set():
+            user_id = f"user_{self.rng.randrange(self.users)}"
+            started = time.perf_counter()
+            if sequence % 4 == 0:
+                self.engine.process_workout(user_id, "running", 1000, 600, f"probe-{self.ident}-{sequence}")
+            else:
+                self.engine.get_available_content(user_id)
+            self.samples.append(time.perf_counter() - started)
+            sequence += 1
+            time.sleep(0.001)
+
+
+def probe(engine: GameEngine, users: int, seconds: float, seed: int) -> Dict:
+    prober = Prober(engine, users, seed)
+    prober.start()
+    time.sleep(seconds)
+    prober.stop.set()
+    prober.join()
+    return summarize(prober.samples)
+
+
+def reload_and_backfill(engine: GameEngine, catalogue_path: Path, catalogue: Dict, added: Dict[str, Dict],
+                        users: int, seed: int) -> Dict:
+    catalogue["stories"].update(added)
+    catalogue["version"] += 1
+    with open(catalogue_path, 'w', encoding='utf-8') as f:
+        json.dump(catalogue, f)
+    engine.last_backfill = None
+    prober = Prober(engine, users, seed)
+    prober.start()
+    started = time.perf_counter()
+    reloaded = engine.reload_requirements()
+    reload_seconds = time.perf_counter() - started
+    while engine.last_backfill is None:
+        time.sleep(0.005)
+    total = time.perf_counter() - started
+    prober.stop.set()
+    prober.join()
+    return dict(engine.last_backfill, changed=len(reloaded), reload_seconds=round(reload_seconds, 4),
+                total_seconds=round(total, 3), latency_during=summarize(prober.samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoveFit unlock backfill benchmark")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--workouts-per-user", type=int, default=3)
+    parser.add_argument("--stories", type=int, default=50, help="stories added by each catalogue change")
+    parser.add_argument("--projected-users", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: bench/results/)")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k != "output"}
+    workdir = Path(tempfile.mkdtemp(prefix="lovefit-backfill-"))
+    failed = False
+    try:
+        catalogue_path = workdir / "requirements.json"
+        with open(DEFAULT_REQUIREMENTS_FILE, 'r', encoding='utf-8') as f:
+            catalogue = json.load(f)
+        with open(catalogue_path, 'w', encoding='utf-8') as f:
+            json.dump(catalogue, f)
+        engine = GameEngine(near_fraction=0, requirements_file=str(catalogue_path))
+
+        rng = random.Random(args.seed)
+        now = time.time()
+        started = time.perf_counter()
+        for u in range(args.users):
+            for w in range(args.workouts_per_user):
+                engine.process_workout(f"user_{u}", rng.choice(WORKOUT_TYPES), rng.randint(500, 15000),
+                                       rng.randint(600, 7200), f"w{u}-{w}", now - rng.randrange(10) * DAY)
+        print(f"👥 {args.users} users loaded in {time.perf_counter() - started:.1f}s")
+        results = {"idle_latency": probe(engine, args.users, 1.0, args.seed)}
+
+        for name, cold in (("cold", True), ("warm", False)):
+            added = new_stories(args.stories, name, args.seed + cold)
+            if cold:  # as after a restart: columns are rebuilt from the records first
+                engine.aggregates = AggregateTable()
+                engine.aggregates.complete = False
+            result = reload_and_backfill(engine, catalogue_path, catalogue, added, args.users, args.seed)
+            # afterwards: the prober's workouts may have unlocked new stories too, and best values only grow
+            started = time.perf_counter()
+            expected = naive_candidates(engine, added)
+            naive_seconds = time.perf_counter() - started
+            result["naive_evaluate_seconds"] = round(naive_seconds, 3)
+            result["matches"] = unlocked_by(engine, added) == expected
+            failed = failed or not result["matches"]
+            results[name] = result
+
+        warm = results["warm"]
+        per_user = (warm["evaluate_seconds"] + warm["grant_seconds"]) / args.users
+        results["projected"] = {
+            "warm_backfill_seconds": round(per_user * args.projected_users, 1),
+            "cold_scan_seconds": round(results["cold"]["scan_seconds"] / args.users * args.projected_users, 1),
+            "naive_evaluate_seconds": round(warm["naive_evaluate_seconds"] / args.users * args.projected_users, 1),
+            "aggregate_bytes": int(engine.aggregates.stats()["bytes"] / args.users * args.projected_users),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    idle = results["idle_latency"]
+    for name in ("cold", "warm"):
+        r = results[name]
+        during = r["latency_during"]
+        print(f"🔁 {name}: scan {r['scan_seconds']:.2f}s  evaluate {r['evaluate_seconds']:.3f}s "
+              f"(per-user loop {r['naive_evaluate_seconds']:.2f}s)  grant {r['grant_seconds']:.2f}s  "
+              f"{r['granted']} unlocks to {r['users']} users  {'✅' if r['matches'] else '❌ differs from per-user check'}")
+        print(f"   request p50/p99 {idle.get('p50', 0):.2f}/{idle.get('p99', 0):.2f} ms idle → "
+              f"{during.get('p50', 0):.2f}/{during.get('p99', 0):.2f} ms during backfill, reload returned in "
+              f"{r['reload_seconds'] * 1e3:.1f} ms")
+    p = results["projected"]
+    print(f"🔮 {args.projected_users} users: warm backfill ≈ {p['warm_backfill_seconds']}s, cold column scan ≈ "
+          f"{p['cold_scan_seconds']}s, columns ≈ {p['aggregate_bytes'] / 2 ** 20:.0f} MiB")
+    write_results("backfill", config, results, args.output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
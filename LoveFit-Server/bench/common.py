@@ -0,0 +1,88 @@
+# Shared helpers for the benchmark scripts: run metadata, latency statistics and result files.
+#
+# Every result file records the git commit, interpreter and machine it was measured on, so two
+# runs can be compared with compare.py. Workloads are generated from fixed seeds.
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+SERVER_DIR = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+
+if str(SERVER_DIR) not in sys.path:  # benchmarks import the server modules directly
+    sys.path.insert(0, str(SERVER_DIR))
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["git", *args], cwd=SERVER_DIR, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def environment() -> Dict: # what a result was measured on
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,  # uncommitted changes make a run hard to reproduce
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def percentile(sorted_values: List[float], q: float) -> float: # linear interpolation, q in [0, 100]
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def summarize(samples: List[float], scale: float = 1e3) -> Dict:
+    """
+    Latency statistics of raw samples in seconds
+
+    Args:
+        samples: one duration per operation, in seconds
+        scale: unit of the reported values (1e3 = milliseconds, 1e6 = microseconds)
+    """
+    values = sorted(samples)
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values) * scale, 4),
+        "min": round(values[0] * scale, 4),
+        "p50": round(percentile(values, 50) * scale, 4),
+        "p90": round(percentile(values, 90) * scale, 4),
+        "p99": round(percentile(values, 99) * scale, 4),
+        "max": round(values[-1] * scale, 4),
+    }
+
+
+def write_results(kind: str, config: Dict, results: Dict, output: Optional[str] = None) -> Path:
+    """Write one run as JSON (default: bench/results/<kind>-<commit>-<time>.json) and return the path"""
+    env = environment()
+    if output:
+        path = Path(output)
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        commit = (env["commit"] or "nogit")[:10] + ("-dirty" if env["dirty"] else "")
+        path = RESULTS_DIR / f"{kind}-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"kind": kind, "environment": env, "config": config, "results": results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"💾 结果已写入 {path}")
+    return path
@@ -0,0 +1,59 @@
+# Compare two benchmark result files (e.g. the same benchmark on two commits).
+#
+#   python bench/compare.py bench/results/micro-<old>.json bench/results/micro-<new>.json
+#
+# Prints p50/p99 of every benchmark or route present in both runs with the relative change;
+# negative changes are faster. Load runs also compare throughput.
+import argparse
+import json
+from typing import Dict, Tuple
+
+
+def entries(run: Dict) -> Dict[str, Dict]: # benchmark/route name -> statistics
+    results = run["results"]
+    return results["routes"] if "routes" in results else results
+
+
+def change(old, new) -> str:
+    if not old or new is None:
+        return "      n/a"
+    return f"{(new - old) / old * 100:+8.1f}%"
+
+
+def describe(run: Dict) -> str:
+    env = run["environment"]
+    return f"{run['kind']} @ {(env.get('commit') or 'nogit')[:10]}{' (dirty)' if env.get('dirty') else ''}"
+
+
+def compare(old: Dict, new: Dict) -> Tuple[str, ...]:
+    lines = [f"old: {describe(old)}", f"new: {describe(new)}"]
+    if old["config"] != new["config"]:
+        lines.append("⚠️  configs differ, numbers may not be comparable")
+    old_entries, new_entries = entries(old), entries(new)
+    unit = "ms" if "routes" in new["results"] else "µs"
+    for name in new_entries:
+        if name not in old_entries:
+            continue
+        a, b = old_entries[name], new_entries[name]
+        line = (f"{name:<40} p50 {a.get('p50', 0):>10.2f} → {b.get('p50', 0):>10.2f} {unit} {change(a.get('p50'), b.get('p50'))}"
+                f"   p99 {change(a.get('p99'), b.get('p99'))}")
+        if "rps" in b:
+            line += f"   rps {a.get('rps', 0):.1f} → {b['rps']:.1f} {change(a.get('rps'), b.get('rps'))}"
+        lines.append(line)
+    return tuple(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    print("\n".join(compare(old, new)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Concurrency stress test of GameEngine: many threads submit workouts for a few users at once and
+# the final records must match a single-threaded replay exactly.
+#
+#   python bench/engine_stress.py                          # 16 threads, 32 users, shard counts 1,8,64
+#   python bench/engine_stress.py --users 1 --threads 32   # every thread hits the same user
+#   python bench/engine_stress.py --store sqlite
+#
+# Every workout has a unique id and integer distance/duration (so sums are exact whatever the order).
+# Threads mix single submissions, batches and resubmissions of ids other threads already own, while
+# reader threads poll available content. Checks, per user:
+#   - total distance/duration and unlocked stories equal the sequential replay
+#   - every workout was accepted exactly once (duplicates rejected, none lost), as counted by the replay
+#   - every unlock was reported to exactly one caller
+# Exits 1 on any mismatch; throughput per shard count is written to bench/results/.
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from common import write_results
+
+from game_engine import GameEngine
+from progress_store import MemoryProgressStore, SQLiteProgressStore
+from workout_dedup import WorkoutDedupIndex
+
+WORKOUT_TYPES = ("running", "walking", "cycling")
+# every workout here is "today", so all ids stay in the dedup index's exact set up to its cap; beyond it
+# the oldest move to Bloom filters, which reject a new id at a small error rate and make the counts inexact
+MAX_PER_USER = WorkoutDedupIndex().max_exact
+
+
+def plan_workouts(users: int, per_user: int, seed: int) -> List[Dict]: # unique workouts, timestamp left to "today"
+    rng = random.Random(seed)
+    return [
+        {"user_id": f"stress_{u}", "type": rng.choice(WORKOUT_TYPES), "distance": rng.randint(100, 3000),
+         "duration": rng.randint(60, 1800), "id": f"w{u}-{i}"}
+        for u in range(users) for i in range(per_user)
+    ]
+
+
+def make_store(kind: str, workdir: Path, name: str):
+    return SQLiteProgressStore(str(workdir / f"{name}.db")) if kind == "sqlite" else MemoryProgressStore()
+
+
+def expected_records(plan: List[Dict]) -> Dict[str, Dict]: # sequential replay on a fresh engine, plus accepted counts
+    engine = GameEngine(near_fraction=0, shards=1)
+    accepted = {}
+    for w in plan:
+        result = engine.process_workout(w["user_id"], w["type"], w["distance"], w["duration"], w["id"])
+        if not result.get("duplicate"):  # a Bloom filter false positive is rejected here too
+            accepted[w["user_id"]] = accepted.get(w["user_id"], 0) + 1
+    expected = {}
+    for user_id in sorted(accepted):
+        expected[user_id] = engine.get_progress(user_id)
+        expected[user_id]["accepted"] = accepted[user_id]
+    return expected
+
+
+class Tally: # what the callers were told, merged across threads
+    def __init__(self):
+        self.accepted = {}  # type: Dict[str, int]
+        self.unlocks = {}  # type: Dict[str, List[str]]
+        self.errors = []  # type: List[str]
+        self.lock = threading.Lock()
+
+    def add(self, user_id: str, accepted: int, unlocked: List[str]):
+        with self.lock:
+            self.accepted[user_id] = self.accepted.get(user_id, 0) + accepted
+            self.unlocks.setdefault(user_id, []).extend(unlocked)
+
+
+def writer(engine: GameEngine, plan: List[Dict], own: List[int], seed: int, batch: int, duplicate_rate: float,
+           tally: Tally, start: threading.Barrier):
+    rng = random.Random(seed)
+    queue = list(own)
+    rng.shuffle(queue)
+    start.wait()
+    try:
+        while queue:
+            if rng.random() < duplicate_rate:  # resubmit a workout some thread owns; must be a no-op if already applied
+                w = plan[rng.randrange(len(plan))]
+                result = engine.process_workout(w["user_id"], w["type"], w["distance"], w["duration"], w["id"])
+                if not result.get("duplicate"):  # we won the race against the owner
+                    tally.add(w["user_id"], 1, result["newly_unlocked"])
+                continue
+            if rng.random() < 0.5:
+                w = plan[queue.pop()]
+                result = engine.process_workout(w["user_id"], w["type"], w["distance"], w["duration"], w["id"])
+                tally.add(w["user_id"], 0 if result.get("duplicate") else 1, result["newly_unlocked"])
+                continue
+            user_id = plan[queue[-1]]["user_id"]
+            chunk = []
+            while queue and len(chunk) < batch and plan[queue[-1]]["user_id"] == user_id:
+                chunk.append(plan[queue.pop()])
+            result = engine.process_workouts(user_id, [{k: w[k] for k in ("type", "distance", "duration", "id")}
+                                                       for w in chunk])
+            tally.add(user_id, result["accepted"], result["newly_unlocked"])
+    except Exception as e:  # reported as a failure instead of a silently dead thread
+        with tally.lock:
+            tally.errors.append(f"writer: {type(e).__name__}: {e}")
+
+
+def reader(engine: GameEngine, users: List[str], stop: threading.Event, tally: Tally, start: threading.Barrier):
+    rng = random.Random(0)
+    start.wait()
+    try:
+        while not stop.is_set():
+            user_id = rng.choice(users)
+            content = engine.get_available_content(user_id)
+            engine.content_version(user_id)
+            if len(set(content["unlocked_stories"])) != len(content["unlocked_stories"]):
+                raise AssertionError(f"{user_id} has a story unlocked twice")
+    except Exception as e:
+        with tally.lock:
+            tally.errors.append(f"reader: {type(e).__name__}: {e}")
+
+
+def verify(engine: GameEngine, expected: Dict[str, Dict], tally: Tally) -> List[str]:
+    problems = list(tally.errors)
+    for user_id, want in expected.items():
+        got = engine.get_progress(user_id) or {}
+        for key in ("total_distance", "total_duration"):
+            if got.get(key) != want[key]:
+                problems.append(f"{user_id} {key}: {got.get(key)} != {want[key]}")
+        if sorted(got.get("unlocked_stories", [])) != sorted(want["unlocked_stories"]):
+            problems.append(f"{user_id} unlocked {got.get('unlocked_stories')} != {want['unlocked_stories']}")
+        if tally.accepted.get(user_id, 0) != want["accepted"]:
+            problems.append(f"{user_id} accepted {tally.accepted.get(user_id, 0)} workouts, expected {want['accepted']}")
+        if sorted(tally.unlocks.get(user_id, [])) != sorted(want["unlocked_stories"]):
+            problems.append(f"{user_id} reported unlocks {sorted(tally.unlocks.get(user_id, []))}")
+    return problems
+
+
+def run(shards: int, args, plan: List[Dict], expected: Dict[str, Dict], workdir: Path) -> Tuple[Dict, List[str]]:
+    store = make_store(args.store, workdir, f"shards{shards}")
+    engine = GameEngine(store, near_fraction=0, shards=shards)
+    tally = Tally()
+    rng = random.Random(args.seed)
+    owners = [[] for _ in range(args.threads)]  # type: List[List[int]]
+    for index in range(len(plan)):
+        owners[rng.randrange(args.threads)].append(index)
+
+    start = threading.Barrier(args.threads + args.readers + 1)
+    stop = threading.Event()
+    threads = [threading.Thread(target=writer, args=(engine, plan, owners[t], args.seed * 1000 + t, args.batch,
+                                                     args.duplicate_rate, tally, start)) for t in range(args.threads)]
+    readers = [threading.Thread(target=reader, args=(engine, sorted(expected), stop, tally, start))
+               for _ in range(args.readers)]
+    for thread in threads + readers:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    problems = verify(engine, expected, tally)
+    store.close()
+    return {"elapsed": round(elapsed, 4), "workouts_per_second": round(len(plan) / elapsed, 1),
+            "problems": len(problems)}, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GameEngine concurrency stress test")
+    parser.add_argument("--threads", type=int, default=16, help="writer threads")
+    parser.add_argument("--readers", type=int, default=2, help="threads polling available content meanwhile")
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--per-user", type=int, default=500, help="unique workouts per user")
+    parser.add_argument("--batch", type=int, default=8, help="max workouts per process_workouts call")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="share of calls resubmitting an existing id")
+    parser.add_argument("--shards", default="1,8,64", help="comma-separated shard counts to run")
+    parser.add_argument("--store", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--switch-interval", type=float, default=1e-5, help="sys.setswitchinterval, small = more interleaving")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: bench/results/)")
+    args = parser.parse_args()
+    if args.per_user > MAX_PER_USER:
+        parser.error(f"--per-user must be at most {MAX_PER_USER}")
+
+    plan = plan_workouts(args.users, args.per_user, args.seed)
+    expected = expected_records(plan)
+    config = {k: v for k, v in vars(args).items() if k != "output"}
+    results = {}
+    failed = False
+    sys.setswitchinterval(args.switch_interval)
+    workdir = Path(tempfile.mkdtemp(prefix="lovefit-stress-"))
+    try:
+        for shards in (int(s) for s in args.shards.split(",") if s.strip()):
+            result, problems = run(shards, args, plan, expected, workdir)
+            results[f"shards={shards}"] = result
+            status = "✅" if not problems else f"❌ {len(problems)} mismatches"
+            print(f"🏋️  shards={shards:<4} {result['workouts_per_second']:>10.1f} workouts/s   {status}")
+            for problem in problems[:10]:
+                print(f"   {problem}")
+            failed = failed or bool(problems)
+    finally:
+        sys.setswitchinterval(0.005)
+        shutil.rmtree(workdir, ignore_errors=True)
+    write_results("engine-stress", config, results, args.output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
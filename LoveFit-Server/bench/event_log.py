@@ -0,0 +1,141 @@
+# Benchmark of the workout event log: append overhead, snapshot cost and restart (recovery) time.
+#
+#   python bench/event_log.py                                # 10k users, 200k events
+#   python bench/event_log.py --users 100000 --events 2000000
+#
+# Writes the events through GameEngine with the log enabled, snapshots once the first
+# (1 - tail) share is in, then measures on fresh engines:
+#   - recover(): load the snapshot + replay the tail (a normal restart)
+#   - recover(rebuild=True): replay the whole log (catalogue change)
+# and checks both reproduce every user's progress exactly. Measured rates are projected to
+# --projected-users / --projected-events, with the tail bounded by the snapshot cadence; the
+# projected restart is reported against --restart-target with the gap still to close.
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from common import write_results
+
+from game_engine import GameEngine
+from workout_log import WorkoutEventLog
+
+WORKOUT_TYPES = ("running", "walking", "cycling")
+DAY = 86400
+
+
+def synthetic_events(users: int, events: int, seed: int) -> List[tuple]: # (user_id, type, distance, duration, id, timestamp)
+    rng = random.Random(seed)
+    start = time.time() - 90 * DAY
+    return [(f"user_{rng.randrange(users)}", rng.choice(WORKOUT_TYPES), rng.randint(500, 12000), rng.randint(600, 5400),
+             f"w{i}", start + i * (90 * DAY / events)) for i in range(events)]
+
+
+def apply(engine: GameEngine, events: List[tuple]) -> float: # seconds spent in process_workout
+    started = time.perf_counter()
+    for e in events:
+        engine.process_workout(*e)
+    return time.perf_counter() - started
+
+
+def progress(engine: GameEngine, users: int) -> Dict[str, Dict]:
+    return {f"user_{u}": engine.get_progress(f"user_{u}") for u in range(users)}
+
+
+def recovered(directory: str, rebuild: bool) -> Tuple[GameEngine, Dict]:
+    engine = GameEngine(near_fraction=0, event_log=WorkoutEventLog(directory))
+    return engine, engine.recover(rebuild=rebuild)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoveFit workout event log benchmark")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--tail", type=float, default=0.1, help="share of events written after the snapshot")
+    parser.add_argument("--snapshot-every", type=int, default=100000, help="server snapshot cadence used for projections")
+    parser.add_argument("--projected-users", type=int, default=1000000)
+    parser.add_argument("--projected-events", type=int, default=50000000)
+    parser.add_argument("--restart-target", type=float, default=10.0, help="projected restart time aimed for (seconds)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: bench/results/)")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k != "output"}
+    events = synthetic_events(args.users, args.events, args.seed)
+    split = int(len(events) * (1 - args.tail))
+    workdir = Path(tempfile.mkdtemp(prefix="lovefit-eventlog-"))
+    failed = False
+    try:
+        baseline = GameEngine(near_fraction=0)
+        sample = events[:min(len(events), 50000)]
+        without_log = apply(baseline, sample) / len(sample)
+
+        directory = str(workdir / "log")
+        engine = GameEngine(near_fraction=0, event_log=WorkoutEventLog(directory, snapshot_every=10 ** 12))
+        with_log = apply(engine, events[:split])
+        started = time.perf_counter()
+        header = engine.snapshot()
+        snapshot_seconds = time.perf_counter() - started
+        with_log = (with_log + apply(engine, events[split:])) / len(events)
+        expected = progress(engine, args.users)
+        engine.event_log.close()
+
+        results = {
+            "process_workout_us": {"without_log": round(without_log * 1e6, 2), "with_log": round(with_log * 1e6, 2)},
+            "log_bytes_per_event": round(os.path.getsize(engine.event_log.path) / len(events), 1),
+            "snapshot": {"users": header["users"], "seconds": round(snapshot_seconds, 3),
+                         "bytes_per_user": round(os.path.getsize(engine.event_log.snapshot_path) / max(header["users"], 1), 1)},
+        }
+        for name, rebuild in (("restart", False), ("full_replay", True)):
+            fresh, stats = recovered(directory, rebuild)
+            ok = progress(fresh, args.users) == expected
+            failed = failed or not ok
+            stats["matches"] = ok
+            results[name] = stats
+            fresh.event_log.close()
+
+        # projections from the measured rates: snapshot load per user, tail replay per event (mostly users
+        # not touched since the snapshot, so each pays for decoding its record), full replay per event
+        restart, full = results["restart"], results["full_replay"]
+        replay_rate = full["replayed"] / max(full["seconds"], 1e-9)
+        load_rate = restart["snapshot_users"] / max(restart["snapshot_seconds"], 1e-9)
+        tail_rate = restart["replayed"] / max(restart["seconds"] - restart["snapshot_seconds"], 1e-9)
+        results["projected"] = {
+            "replay_events_per_second": round(replay_rate, 1),
+            "tail_events_per_second": round(tail_rate, 1),
+            "snapshot_users_per_second": round(load_rate, 1),
+            "restart_seconds": round(args.projected_users / load_rate + args.snapshot_every / tail_rate, 1),
+            "full_replay_seconds": round(args.projected_events / replay_rate, 1),
+            "snapshot_write_seconds": round(args.projected_users * snapshot_seconds / max(header["users"], 1), 1),
+        }
+        results["projected"]["restart_target_seconds"] = args.restart_target
+        results["projected"]["restart_gap_seconds"] = round(max(results["projected"]["restart_seconds"] - args.restart_target, 0), 1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    p = results["projected"]
+    print(f"📝 process_workout {results['process_workout_us']['without_log']:.1f} µs → "
+          f"{results['process_workout_us']['with_log']:.1f} µs with the log ({results['log_bytes_per_event']} B/event)")
+    print(f"📸 snapshot of {results['snapshot']['users']} users in {results['snapshot']['seconds']:.2f}s "
+          f"({results['snapshot']['bytes_per_user']:.0f} B/user)")
+    for name in ("restart", "full_replay"):
+        r = results[name]
+        print(f"♻️  {name:<12} {r['seconds']:>8.2f}s  snapshot users {r['snapshot_users']:>8}  replayed {r['replayed']:>9}  "
+              f"{'✅' if r['matches'] else '❌ progress differs'}")
+    print(f"🔮 {args.projected_users} users / {args.projected_events} events: restart ≈ {p['restart_seconds']}s, "
+          f"full replay ≈ {p['full_replay_seconds']}s, snapshot write ≈ {p['snapshot_write_seconds']}s")
+    gap = p["restart_gap_seconds"]
+    print(f"🎯 restart target {p['restart_target_seconds']}s: " + ("✅ met" if not gap else
+          f"⚠️  {gap}s over (snapshot load {args.projected_users / p['snapshot_users_per_second']:.1f}s + "
+          f"tail replay {args.snapshot_every / p['tail_events_per_second']:.1f}s)"))
+    write_results("event-log", config, results, args.output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# Deterministic stand-in for an Ollama server, so benchmarks and load tests need no model.
+#
+#   python bench/fake_ollama.py --port 11435 --tokens-per-second 40 --ttft 0.3 --tokens 80
+#   OLLAMA_HOST=http://127.0.0.1:11435 python app.py
+#
+# Implements /api/chat (streamed NDJSON and single response), /api/embed, /api/embeddings,
+# /api/tags and /api/version. Replies are derived from a hash of the request, so the same prompt
+# always gets the same text and token count. Latency is simulated: `ttft` seconds before the
+# first token, then `tokens_per_second`. A seeded failure injector can answer with HTTP 500 or
+# drop the connection mid-stream.
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+VOCABULARY = ("嗯", "今天", "的", "星空", "很", "安静", "呢", "书", "我们", "一起", "跑步", "吧", "啊",
+              "the", "quiet", "library", "rain", "story", "page", "star", "warm", "cocoa", "and", "you")
+FAILURE_MODES = ("error", "disconnect")
+
+
+class FakeOllamaConfig:
+    def __init__(self, ttft: float = 0.2, tokens_per_second: float = 50.0, tokens: int = 60,
+                 failure_rate: float = 0.0, failure_mode: str = "error", seed: int = 0, embed_dim: int = 768,
+                 model: str = "gemma3"):
+        """
+        Args:
+            ttft: seconds before the first token (prompt evaluation)
+            tokens_per_second: generation speed after the first token (0 = no delay)
+            tokens: tokens per reply
+            failure_rate: share of chat requests that fail
+            failure_mode: "error" (HTTP 500) or "disconnect" (connection dropped halfway through a stream)
+            seed: makes replies and injected failures reproducible
+            embed_dim: length of returned embedding vectors
+            model: name reported by /api/tags
+        """
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError(f"failure_mode must be one of {FAILURE_MODES}")
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.seed = seed
+        self.embed_dim = embed_dim
+        self.model = model
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: FakeOllamaConfig):
+        super().__init__(address, FakeOllamaHandler)
+        self.config = config
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_request(self) -> int: # sequence number of a chat request (drives failure injection)
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def should_fail(self, number: int) -> bool:
+        if self.config.failure_rate <= 0:
+            return False
+        failed = random.Random(f"{self.config.seed}:{number}").random() < self.config.failure_rate
+        if failed:
+            with self._lock:
+                self.failures += 1
+        return failed
+
+    def reply_tokens(self, messages: List[Dict]) -> List[str]:
+        digest = hashlib.sha256(json.dumps([self.config.seed, messages], ensure_ascii=False, sort_keys=True)
+                                .encode('utf-8')).digest()
+        rng = random.Random(digest)
+        return [rng.choice(VOCABULARY) + ("" if i + 1 == self.config.tokens else " ") for i in range(self.config.tokens)]
+
+    def embedding(self, text: str) -> List[float]:
+        values = []
+        block = hashlib.sha512(text.encode('utf-8')).digest()
+        while len(values) < self.config.embed_dim:
+            values.extend((b - 128) / 128.0 for b in block)
+            block = hashlib.sha512(block).digest()
+        return values[:self.config.embed_dim]
+
+    def stats(self) -> Dict:
+        return {"requests": self.requests, "failures": self.failures, "config": self.config.to_dict()}
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server (the client pools connections)
+    server = None  # type: FakeOllamaServer
+
+    def log_message(self, format, *args): # quiet: a load test makes thousands of requests
+        pass
+
+    def handle(self): # a client closing mid-request (e.g. the load test shutting down) is not a server error
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def _send_json(self, data, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.config.model, "model": self.server.config.model}]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/_stats":
+            self._send_json(self.server.stats())
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/api/chat":
+            self._chat(payload)
+        elif self.path == "/api/embed":
+            texts = payload.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json({"model": payload.get("model"), "embeddings": [self.server.embedding(t) for t in texts]})
+        elif self.path == "/api/embeddings":
+            self._send_json({"embedding": self.server.embedding(payload.get("prompt", ""))})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _chat(self, payload: Dict):
+        config = self.server.config
+        number = self.server.next_request()
+        failing = self.server.should_fail(number)
+        if failing and config.failure_mode == "error":
+            self._send_json({"error": "injected failure"}, 500)
+            return
+
+        messages = payload.get("messages") or []
+        tokens = self.server.reply_tokens(messages)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        started = time.monotonic()
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        model = payload.get("model") or config.model
+
+        def final(content: str) -> Dict:
+            elapsed = int((time.monotonic() - started) * 1e9)
+            return {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": {"role": "assistant", "content": content}, "done": True, "done_reason": "stop",
+                    "total_duration": elapsed, "load_duration": 0, "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(config.ttft * 1e9), "eval_count": len(tokens),
+                    "eval_duration": max(elapsed - int(config.ttft * 1e9), 0)}
+
+        if not payload.get("stream", True):
+            time.sleep(config.ttft + interval * max(len(tokens) - 1, 0))
+            self._send_json(final("".join(tokens)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(config.ttft)
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(interval)
+                if failing and i == len(tokens) // 2:  # "disconnect": stop halfway without finishing the stream
+                    self.close_connection = True
+                    return
+                chunk = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                         "message": {"role": "assistant", "content": token}, "done": False}
+                self._write_chunk(json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b"\n")
+            self._write_chunk(json.dumps(final("")).encode('utf-8') + b"\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):  # client cancelled the generation
+            self.close_connection = True
+
+
+def start_fake_ollama(config: Optional[FakeOllamaConfig] = None, host: str = "127.0.0.1",
+                      port: int = 0) -> FakeOllamaServer:
+    """Serve in a daemon thread (port 0 picks a free port); stop with server.shutdown()"""
+    server = FakeOllamaServer((host, port), config or FakeOllamaConfig())
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser): # fake model options shared with load.py
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per reply")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-mode", choices=FAILURE_MODES, default="error")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args) -> FakeOllamaConfig:
+    return FakeOllamaConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                            failure_rate=args.failure_rate, failure_mode=args.failure_mode, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer((args.host, args.port), config_from_args(args))
+    print(f"🤖 Fake Ollama listening on {server.url} ({server.config.to_dict()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# Concurrent HTTP load generator reporting latency percentiles and throughput per route.
+#
+#   python bench/load.py --spawn flask --duration 30 --concurrency 32
+#   python bench/load.py --spawn asgi --duration 30 --concurrency 32      # needs uvicorn
+#   python bench/load.py --url http://127.0.0.1:5001 --routes content,progress
+#
+# --spawn starts the fake model server (fake_ollama.py) in this process and the API server as a
+# subprocess with fresh temporary data directories, so Flask and ASGI runs see identical setups.
+# Each worker thread keeps one keep-alive connection and picks routes from a seeded weighted mix.
+# Streaming routes also report time to first SSE event ("ttfb").
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from common import SERVER_DIR, summarize, write_results
+from fake_ollama import add_arguments, config_from_args, start_fake_ollama
+
+SERVERS = {
+    "flask": [sys.executable, "-c",
+              "import sys; from app import app; app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--log-level", "warning",
+             "--port"],
+}
+
+
+class Route:
+    def __init__(self, name: str, weight: float, stream: bool = False):
+        self.name = name
+        self.weight = weight
+        self.stream = stream
+
+    def request(self, rng: random.Random, user_id: str, sequence: int) -> Tuple[str, str, Optional[Dict]]:
+        """(method, path, JSON body) of one call"""
+        if self.name == "test":
+            return "GET", "/api/test", None
+        if self.name == "content":
+            return "GET", f"/api/available-content/{user_id}", None
+        if self.name == "requirements":
+            return "GET", "/api/requirements", None
+        if self.name == "progress":
+            return "POST", "/api/user-progress", {
+                "user_id": user_id, "type": "running", "distance": round(rng.uniform(500, 8000), 1),
+                "duration": rng.randint(600, 3600), "id": f"{user_id}-{sequence}", "timestamp": time.time()}
+        if self.name == "batch":
+            return "POST", "/api/user-progress/batch", {"user_id": user_id, "workouts": [
+                {"type": "running", "distance": round(rng.uniform(500, 8000), 1), "duration": rng.randint(600, 3600),
+                 "id": f"{user_id}-{sequence}-{i}", "timestamp": time.time() - i * 86400} for i in range(20)]}
+        if self.name == "chat":
+            return "POST", "/api/character/chat/stream", {"user_id": user_id, "message": f"今天跑步了吗？{sequence}"}
+        if self.name == "story":
+            return "POST", "/api/character/story/stream", {"user_id": user_id, "action": f"我翻开了书页 {sequence}"}
+        raise ValueError(f"Unknown route: {self.name}")
+
+
+ROUTES = {
+    "test": Route("test", 1),
+    "content": Route("content", 10),  # the app polls this
+    "requirements": Route("requirements", 1),
+    "progress": Route("progress", 4),
+    "batch": Route("batch", 1),
+    "chat": Route("chat", 2, stream=True),
+    "story": Route("story", 1, stream=True),  # only succeeds for users with a started storyline
+}
+MODEL_ERROR = '"content": "❌'.encode('utf-8')
+DEFAULT_ROUTES = ("test", "content", "requirements", "progress", "batch", "chat")
+
+
+class Recorder: # per-route samples shared by the worker threads
+    def __init__(self):
+        self.latency = {}  # type: Dict[str, List[float]]
+        self.ttfb = {}  # type: Dict[str, List[float]]
+        self.errors = {}  # type: Dict[str, Dict[str, int]]
+        self._lock = threading.Lock()
+
+    def ok(self, route: str, latency: float, ttfb: Optional[float]):
+        with self._lock:
+            self.latency.setdefault(route, []).append(latency)
+            if ttfb is not None:
+                self.ttfb.setdefault(route, []).append(ttfb)
+
+    def error(self, route: str, kind: str):
+        with self._lock:
+            counts = self.errors.setdefault(route, {})
+            counts[kind] = counts.get(kind, 0) + 1
+
+
+class Worker(threading.Thread):
+    def __init__(self, index: int, base_url: str, routes: List[Route], users: int, seed: int,
+                 deadline: float, recorder: Recorder, timeout: float):
+        super().__init__(name=f"load-{index}", daemon=True)
+        self.url = urlsplit(base_url)
+        self.routes = routes
+        self.weights = [r.weight for r in routes]
+        self.users = users
+        self.rng = random.Random(f"{seed}:{index}")
+        self.deadline = deadline
+        self.recorder = recorder
+        self.timeout = timeout
+        self.index = index
+        self.conn = None  # type: Optional[http.client.HTTPConnection]
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+        return self.conn
+
+    def _drop(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def run(self):
+        sequence = 0
+        while time.monotonic() < self.deadline:
+            route = self.rng.choices(self.routes, self.weights)[0]
+            user_id = f"load_{self.rng.randrange(self.users)}"
+            sequence += 1
+            method, path, body = route.request(self.rng, user_id, self.index * 10 ** 7 + sequence)
+            self.call(route, method, path, body)
+        self._drop()
+
+    def call(self, route: Route, method: str, path: str, body: Optional[Dict]):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            if route.stream and response.status == 200:
+                ttfb, failed = self._read_stream(response, started)
+            else:
+                response.read()
+                failed = None
+            if response.will_close:
+                self._drop()
+        except (OSError, http.client.HTTPException) as e:
+            self._drop()
+            self.recorder.error(route.name, type(e).__name__)
+            return
+        elapsed = time.perf_counter() - started
+        if response.status >= 400:
+            self.recorder.error(route.name, f"http_{response.status}")
+        elif failed:
+            self.recorder.error(route.name, failed)
+        else:
+            self.recorder.ok(route.name, elapsed, ttfb)
+
+    @staticmethod
+    def _read_stream(response, started: float) -> Tuple[Optional[float], Optional[str]]:
+        ttfb = None
+        failed = None
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+            if line.startswith(b"event: error"):
+                failed = "sse_error"
+            elif line.startswith(b"data:") and MODEL_ERROR in line:  # chat reports model failures in-band as a "❌ ..." token
+                failed = "model_error"
+        return ttfb, failed
+
+
+def run_load(base_url: str, routes: List[Route], concurrency: int, duration: float, users: int, seed: int,
+             timeout: float) -> Dict:
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + duration
+    workers = [Worker(i, base_url, routes, users, seed, deadline, recorder, timeout) for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    report = {"routes": {}, "elapsed": round(elapsed, 3)}
+    total = 0
+    for route in routes:
+        samples = recorder.latency.get(route.name, [])
+        errors = recorder.errors.get(route.name, {})
+        total += len(samples)
+        entry = summarize(samples)
+        entry["rps"] = round(len(samples) / elapsed, 2)
+        entry["errors"] = errors
+        if route.name in recorder.ttfb:
+            entry["ttfb"] = summarize(recorder.ttfb[route.name])
+        report["routes"][route.name] = entry
+    report["rps"] = round(total / elapsed, 2)
+    return report
+
+
+def wait_until_up(base_url: str, process: subprocess.Popen, timeout: float = 60.0):
+    url = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=2)
+            conn.request("GET", "/api/test")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+
+def spawn_server(kind: str, port: int, ollama_url: str, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OLLAMA_HOST": ollama_url,
+        "LOVEFIT_CHARACTER_FILE": str(SERVER_DIR / "luna_character.json"),
+        "LOVEFIT_SESSIONS_DIR": os.path.join(workdir, "sessions"),
+        "LOVEFIT_PROGRESS_DB": os.path.join(workdir, "progress.db"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    log = open(os.path.join(workdir, "server.log"), 'w')  # the Flask app prints every request
+    return subprocess.Popen(SERVERS[kind] + [str(port)], cwd=SERVER_DIR, env=env, stdout=log,
+                            stderr=subprocess.STDOUT)
+
+
+def free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoveFit HTTP load generator")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="server to load (already running)")
+    target.add_argument("--spawn", choices=sorted(SERVERS), help="start this server with a fake model")
+    parser.add_argument("--routes", default=",".join(DEFAULT_ROUTES), help=f"comma-separated subset of {','.join(ROUTES)}")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--users", type=int, default=200, help="distinct user ids")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout")
+    parser.add_argument("--output", help="result file (default: bench/results/)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.routes.split(",") if n.strip()]
+    unknown = [n for n in names if n not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {unknown}")
+    routes = [ROUTES[n] for n in names]
+
+    config = {"target": args.url or args.spawn, "routes": names, "weights": {n: ROUTES[n].weight for n in names},
+              "concurrency": args.concurrency, "duration": args.duration, "users": args.users, "seed": args.seed}
+    fake = process = workdir = None
+    try:
+        if args.spawn:
+            fake = start_fake_ollama(config_from_args(args))
+            config["fake_ollama"] = fake.config.to_dict()
+            workdir = tempfile.mkdtemp(prefix="lovefit-load-")
+            base_url = f"http://127.0.0.1:{free_port()}"
+            process = spawn_server(args.spawn, urlsplit(base_url).port, fake.url, workdir)
+            wait_until_up(base_url, process)
+        else:
+            base_url = args.url.rstrip("/")
+
+        print(f"🚀 {args.concurrency} workers → {base_url} for {args.duration:.0f}s ({', '.join(names)})")
+        report = run_load(base_url, routes, args.concurrency, args.duration, args.users, args.seed, args.timeout)
+        if fake is not None:
+            report["fake_ollama"] = {"requests": fake.requests, "failures": fake.failures}
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake is not None:
+            fake.shutdown()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, entry in report["routes"].items():
+        errors = sum(entry["errors"].values())
+        print(f"📊 {name:<13} {entry['rps']:>9.1f} req/s   p50 {entry.get('p50', 0):>9.2f} ms   "
+              f"p99 {entry.get('p99', 0):>9.2f} ms   errors {errors}")
+    print(f"📊 total         {report['rps']:>9.1f} req/s")
+    write_results(f"load-{args.spawn or 'url'}", config, report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# Micro-benchmarks of the server's hot paths at realistic data sizes (no model or HTTP involved).
+#
+#   python bench/micro.py                 # full run, writes bench/results/micro-<commit>-<time>.json
+#   python bench/micro.py --quick         # fewer iterations, for a smoke check
+#   python bench/micro.py --only engine   # benchmarks whose name contains "engine"
+#
+# Workloads come from fixed seeds and sizes (recorded in the result file), so runs on different
+# commits measure the same work.
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from common import SERVER_DIR, summarize, write_results
+
+from character_agent import AICharacter
+from chat_log import ChatLog
+from game_engine import GameEngine, RequirementIndex
+from llm_client import LLMBackend
+from persistence import WriteBehindWriter
+from progress_store import MemoryProgressStore, SQLiteProgressStore
+
+WORKOUT_TYPES = ("running", "walking", "cycling", "swimming")
+DAY = 86400
+
+
+def synthetic_catalogue(size: int, seed: int) -> Dict[str, Dict]: # a requirements catalogue mixing every rule kind
+    rng = random.Random(seed)
+    catalogue = {}
+    for i in range(size):
+        requirement = {"type": WORKOUT_TYPES[i % len(WORKOUT_TYPES)]}
+        kind = rng.choice(("distance", "duration", "window", "streak"))
+        if kind == "distance":
+            requirement["distance"] = round(rng.uniform(1, 500), 1) * 1e3
+        elif kind == "duration":
+            requirement["duration"] = rng.randint(10, 3000) * 60
+        elif kind == "window":
+            requirement["distance"] = round(rng.uniform(1, 80), 1) * 1e3
+            requirement["window_days"] = rng.choice((7, 30))
+        else:
+            requirement["streak_days"] = rng.randint(2, 30)
+        catalogue[f"story_{i + 1}"] = requirement
+    return catalogue
+
+
+def make_engine(store, catalogue: Dict[str, Dict]) -> GameEngine:
+    engine = GameEngine(store, near_fraction=0)
+    engine.requirements = catalogue
+    engine.requirement_index = RequirementIndex(catalogue)
+    return engine
+
+
+def synthetic_workouts(count: int, users: int, seed: int) -> List[tuple]: # (user_id, type, distance, duration, id, timestamp)
+    rng = random.Random(seed)
+    start = time.time() - 60 * DAY
+    return [
+        (f"user_{rng.randrange(users)}", rng.choice(WORKOUT_TYPES), round(rng.uniform(500, 12000), 1),
+         rng.randint(600, 5400), f"w{i}", start + i * (60 * DAY / count))
+        for i in range(count)
+    ]
+
+
+def synthetic_character(path: Path, storylines: int, chapters: int) -> Path: # luna plus generated storylines
+    with open(SERVER_DIR / "luna_character.json", 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for s in range(storylines):
+        data.setdefault("storylines", []).append({
+            "id": f"bench_{s}",
+            "title": f"Storyline {s}",
+            "description": "A generated storyline used for benchmarking. " * 3,
+            "chapters": [
+                {"title": f"Chapter {c}", "objective": f"Reach checkpoint {c} of storyline {s}",
+                 "completion_keywords": ["完成", "done", f"checkpoint {c}"]}
+                for c in range(chapters)
+            ],
+        })
+    data["current_storyline"] = data["storylines"][0]["id"]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def synthetic_history(count: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    words = ("今天", "跑了", "五公里", "好累", "星空", "真美", "the", "library", "was", "quiet", "again")
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": " ".join(rng.choice(words) for _ in range(rng.randint(5, 60))),
+         "timestamp": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}"}
+        for i in range(count)
+    ]
+
+
+def measure(fn: Callable[[int], object], iterations: int, warmup: int) -> Dict:
+    """Call fn(i) `iterations` times after `warmup` calls and summarize per-call latency in microseconds"""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    clock = time.perf_counter
+    for i in range(iterations):
+        started = clock()
+        fn(warmup + i)
+        samples.append(clock() - started)
+    result = summarize(samples, scale=1e6)
+    result["ops_per_second"] = round(iterations / sum(samples), 1) if sum(samples) else None
+    return result
+
+
+class MicroBenchmarks:
+    def __init__(self, workdir: Path, config: Dict):
+        self.workdir = workdir
+        self.config = config
+        self.benchmarks = {}  # type: Dict[str, Callable[[], Dict]]
+        self.catalogue = synthetic_catalogue(config["catalogue_size"], config["seed"])
+        self.workouts = synthetic_workouts(config["workouts"], config["users"], config["seed"])
+
+    def register(self, name: str): # decorator adding a benchmark
+        def add(fn):
+            self.benchmarks[name] = fn
+            return fn
+        return add
+
+    def run(self, only: str = "") -> Dict[str, Dict]:
+        results = {}
+        for name, fn in self.benchmarks.items():
+            if only and only not in name:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):  # the code under test prints status lines
+                results[name] = fn()
+            print(f"⏱️  {name:<44} p50 {results[name]['p50']:>10.2f} µs   p99 {results[name]['p99']:>10.2f} µs")
+        return results
+
+
+def build(workdir: Path, config: Dict) -> MicroBenchmarks:
+    bench = MicroBenchmarks(workdir, config)
+    iterations, warmup = config["iterations"], config["warmup"]
+
+    def loaded_engine(store) -> GameEngine: # engine whose users already have two months of workouts
+        engine = make_engine(store, bench.catalogue)
+        for user_id, workouts in _by_user(bench.workouts).items():
+            engine.process_workouts(user_id, workouts)
+        return engine
+
+    @bench.register("engine.process_workout[memory]")
+    def _():
+        engine = loaded_engine(MemoryProgressStore())
+        extra = synthetic_workouts(iterations + warmup, config["users"], config["seed"] + 1)
+        return measure(lambda i: engine.process_workout(*extra[i][:4], f"x{i}", extra[i][5]), iterations, warmup)
+
+    @bench.register("engine.process_workout[sqlite]")
+    def _():
+        store = SQLiteProgressStore(str(workdir / "progress.db"))
+        engine = loaded_engine(store)
+        extra = synthetic_workouts(iterations + warmup, config["users"], config["seed"] + 1)
+        try:
+            return measure(lambda i: engine.process_workout(*extra[i][:4], f"x{i}", extra[i][5]), iterations, warmup)
+        finally:
+            store.close()
+
+    @bench.register("engine.process_workouts[backfill-500]")
+    def _():
+        backfill = [
+            {"type": w[1], "distance": w[2], "duration": w[3], "id": w[4], "timestamp": w[5]}
+            for w in synthetic_workouts(500, 1, config["seed"] + 2)
+        ]
+        return measure(lambda i: make_engine(MemoryProgressStore(), bench.catalogue).process_workouts("u", backfill),
+                       max(iterations // 50, 5), 1)
+
+    @bench.register("engine.get_available_content")
+    def _():
+        engine = loaded_engine(MemoryProgressStore())
+        users = [f"user_{i}" for i in range(config["users"])]
+        return measure(lambda i: engine.get_available_content(users[i % len(users)]), iterations, warmup)
+
+    character_file = synthetic_character(workdir / "bench_character.json", config["storylines"], config["chapters"])
+    writer = WriteBehindWriter(delay=3600)  # flushed explicitly where a benchmark measures disk writes
+
+    def character() -> AICharacter:
+        return AICharacter(str(character_file), llm=LLMBackend(), writer=writer)
+
+    @bench.register("character._build_system_prompt[chat]")
+    def _():
+        c = character()
+        return measure(lambda i: c._build_system_prompt("chat"), iterations, warmup)
+
+    @bench.register("character._build_system_prompt[story]")
+    def _():
+        c = character()
+        return measure(lambda i: c._build_system_prompt("story"), iterations, warmup)
+
+    @bench.register("character.load_character")
+    def _():
+        c = character()
+        return measure(lambda i: c.load_character(), max(iterations // 10, 10), warmup)
+
+    @bench.register("character.save_state+flush")
+    def _():
+        c = character()
+        c.reset_story_progress()
+
+        def save(i):
+            c.save_state()
+            writer.flush([c.state_file])
+        return measure(save, max(iterations // 10, 10), warmup)
+
+    history = synthetic_history(config["history"], config["seed"])
+    log_path = workdir / "history.chat.jsonl"
+    log = ChatLog(str(log_path))
+    for message in history:
+        log.append(message)
+    log.close()
+
+    @bench.register("chat_log.append")
+    def _():
+        append_log = ChatLog(str(workdir / "append.chat.jsonl"))
+        try:
+            return measure(lambda i: append_log.append(history[i % len(history)]), iterations, warmup)
+        finally:
+            append_log.close()
+
+    @bench.register(f"character.attach_chat_log[{config['history']}]")
+    def _():
+        c = character()
+
+        def attach(i):
+            c.chat_history = []
+            c.attach_chat_log(str(log_path))
+        try:
+            return measure(attach, max(iterations // 10, 10), warmup)
+        finally:
+            c.close()
+
+    @bench.register(f"character.save_chat_history[json,{config['history']}]")
+    def _():
+        c = character()
+        c.chat_history = [{"role": m["role"], "content": m["content"]} for m in history]
+        path = str(workdir / "history.json")
+        return measure(lambda i: c.save_chat_history(path), max(iterations // 100, 5), 1)
+
+    @bench.register(f"character.load_chat_history[json,{config['history']}]")
+    def _():
+        c = character()
+        path = str(workdir / "history.json")
+        if not Path(path).exists():
+            c.chat_history = [{"role": m["role"], "content": m["content"]} for m in history]
+            c.save_chat_history(path)
+        return measure(lambda i: c.load_chat_history(path), max(iterations // 100, 5), 1)
+
+    return bench
+
+
+def _by_user(workouts: List[tuple]) -> Dict[str, List[Dict]]:
+    grouped = {}
+    for user_id, workout_type, distance, duration, workout_id, timestamp in workouts:
+        grouped.setdefault(user_id, []).append(
+            {"type": workout_type, "distance": distance, "duration": duration, "id": workout_id, "timestamp": timestamp})
+    return grouped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoveFit micro-benchmarks")
+    parser.add_argument("--only", default="", help="run benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="10x fewer iterations")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--catalogue-size", type=int, default=200, help="stories in the requirements catalogue")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workouts", type=int, default=20000, help="workouts preloaded across all users")
+    parser.add_argument("--history", type=int, default=10000, help="messages in the benchmark transcript")
+    parser.add_argument("--storylines", type=int, default=50)
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: bench/results/)")
+    args = parser.parse_args()
+
+    config = {
+        "iterations": args.iterations // 10 if args.quick else args.iterations,
+        "warmup": 50,
+        "catalogue_size": args.catalogue_size,
+        "users": args.users,
+        "workouts": args.workouts // 10 if args.quick else args.workouts,
+        "history": args.history,
+        "storylines": args.storylines,
+        "chapters": args.chapters,
+        "seed": args.seed,
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="lovefit-bench-"))
+    try:
+        results = build(workdir, config).run(args.only)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    write_results("micro", config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
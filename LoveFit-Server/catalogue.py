@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("lovefit.catalogue")
+
+DEFAULT_REQUIREMENTS_FILE = Path(__file__).with_name("requirements.json")
+
+
+def validate_requirements(stories) -> Dict[str, Dict]:
+    """
+    Check a requirements catalogue and return it
+
+    Each story needs a workout "type" and at least one threshold: "distance" (m),
+    "duration" (s) or "streak_days". "window_days" turns distance/duration into a
+    rolling-window total; "storyline" names the character storyline it opens.
+    Raises ValueError on the first problem.
+    """
+    if not isinstance(stories, dict) or not stories:
+        raise ValueError("catalogue needs a non-empty \"stories\" object")
+    for story_id, req in stories.items():
+        if not isinstance(req, dict) or not isinstance(req.get("type"), str):
+            raise ValueError(f"{story_id}: needs a workout \"type\"")
+        thresholds = [key for key in ("distance", "duration", "streak_days") if key in req]
+        if not thresholds:
+            raise ValueError(f"{story_id}: needs distance, duration or streak_days")
+        for key in thresholds:
+            if isinstance(req[key], bool) or not isinstance(req[key], (int, float)) or req[key] <= 0:
+                raise ValueError(f"{story_id}: {key} must be a positive number")
+        window = req.get("window_days")
+        if window is not None and (isinstance(window, bool) or not isinstance(window, int) or window <= 0):
+            raise ValueError(f"{story_id}: window_days must be a positive integer")
+    return stories
+
+
+def load_catalogue(path) -> Tuple[Optional[object], Dict[str, Dict]]:
+    """(catalogue "version" label, validated story id -> requirement) from a catalogue file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get("version"), validate_requirements(data.get("stories"))
+
+
+class CatalogueWatcher:
+    """Polls the catalogue file and calls `on_change` from a background thread when it is modified"""
+
+    def __init__(self, path, on_change: Callable[[], object], interval: float = 5.0):
+        self.path = str(path)
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="catalogue-watcher", daemon=True)
+        self._thread.start()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                self.on_change()
+            except Exception as e:  # a bad edit keeps the current catalogue
+                log.error("catalogue reload failed", extra={"fields": {"path": self.path, "error": str(e)}})
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=5)
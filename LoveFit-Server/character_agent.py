@@ -1,25 +1,60 @@
 import json
-import ollama
+import logging
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, Iterator, List, Dict, Optional, Union
 from pathlib import Path
 
+from chat_log import ChatLog
+from completion import AMBIGUOUS, COMPLETE, VERDICT_INSTRUCTION, CompletionJudge, VerdictStreamFilter, strip_verdict
+from conversation_memory import ConversationMemory
+from llm_client import LLMBackend, default_backend
+from persistence import WriteBehindWriter, default_writer
+from response_cache import ResponseCache, cache_key
+
+if TYPE_CHECKING:
+    from vector_memory import LongTermMemory
+
+log = logging.getLogger("lovefit.character")
+
 
 class AICharacter: # Now: chat+plot
     
-    def __init__(self, character_file: str = "character.json", model: str = "gemma3"):
+    def __init__(self, character_file: str = "character.json", model: str = "gemma3", llm: Optional[LLMBackend] = None,
+                 context_tokens: int = 3000, long_term_memory: Optional["LongTermMemory"] = None,
+                 state_file: Optional[str] = None, writer: Optional[WriteBehindWriter] = None,
+                 response_cache: Optional[ResponseCache] = None):
         """
         Character initialization
         
         Args:
             character_file: character configuration path
             model: llm model choice
+            llm: shared LLM backend (defaults to the process-wide pooled Ollama client)
+            context_tokens: token budget for one chat prompt; older turns are summarized
+            long_term_memory: optional vector store of past exchanges recalled into prompts
+            state_file: where story progress is kept (default: <character_file stem>.state.json)
+            writer: write-behind persister (defaults to the process-wide one)
+            response_cache: optional cache of replies to identical prompts (off by default)
         """
         self.character_file = character_file
+        self.state_file = state_file or str(Path(character_file).with_suffix("")) + ".state.json"
+        self.writer = writer or default_writer()
         self.model = model
+        self.llm = llm or default_backend()
         self.character_data = {}
-        self.chat_history = []
+        self.chat_history = []  # loaded tail of the transcript
+        self.history_offset = 0  # absolute position of chat_history[0] in the transcript
+        self.chat_log = None  # type: Optional[ChatLog]
+        self.history_tail = 200  # messages kept in memory when a chat log is attached
         self.story_progress = {}
+        self._persona_prompt_cache = None  # stable system-prompt prefix, see _persona_prompt()
+        self._storylines = {}  # storyline id -> storyline definition
+        self._chapters = {}  # storyline id -> chapter list
+        self._storyline_summaries = {}  # storyline id -> get_available_storylines() entry, kept current
+        self._judges = {}  # storyline id -> CompletionJudge with per-chapter keyword automata
+        self.memory = ConversationMemory(self.llm, model, token_budget=context_tokens)
+        self.long_term_memory = long_term_memory
+        self.response_cache = response_cache
         
         # load or create user data
         if Path(character_file).exists():
@@ -40,20 +75,12 @@ class AICharacter: # Now: chat+plot
                 raise ValueError(f"lacking field: {field}")
         
         self.character_data = character_data
+        self._persona_prompt_cache = None
         self.character_data["created_at"] = datetime.now().isoformat()
         self.character_data["updated_at"] = datetime.now().isoformat()
         
         # plot initialization
-        if "storylines" in character_data:
-            self.story_progress = {
-                storyline["id"]: {
-                    "current_chapter": 0,
-                    "completed_chapters": [],
-                    "unlocked": storyline.get("unlocked", False)
-                }
-                for storyline in character_data["storylines"]
-            }
-            self.character_data["story_progress"] = self.story_progress
+        self.reset_story_progress()
         
         self.save_character()
         print(f"✅ character '{self.character_data['name']}'successfully set up")
@@ -67,10 +94,68 @@ class AICharacter: # Now: chat+plot
         """
         self.character_data.update(updates)
         self.character_data["updated_at"] = datetime.now().isoformat()
+        self._persona_prompt_cache = None
+        self._compile_storylines()
         self.save_character()
         print(f"✅ character updated")
     
-    def _build_system_prompt(self, mode: str = "chat") -> str: # build system prompt for character
+    def reset_story_progress(self):
+        """把所有故事线进度重置为初始状态（按定义中的 unlocked 决定是否解锁）"""
+        self.story_progress = {
+            storyline["id"]: {
+                "current_chapter": 0,
+                "completed_chapters": [],
+                "unlocked": storyline.get("unlocked", False)
+            }
+            for storyline in self.character_data.get("storylines", [])
+        }
+        self.character_data["story_progress"] = self.story_progress
+        self.character_data.pop("current_storyline", None)
+        self._compile_storylines()
+    
+    def _compile_storylines(self):
+        """Index storylines by id and precompute their progress summaries (on load/setup/update)"""
+        storylines = self.character_data.get("storylines", [])
+        self._storylines = {s["id"]: s for s in storylines}
+        self._chapters = {s["id"]: s["chapters"] for s in storylines}
+        self._storyline_summaries = {s["id"]: self._summarize_storyline(s) for s in storylines}
+        self._judges = {s["id"]: CompletionJudge(s["chapters"]) for s in storylines}
+    
+    def _summarize_storyline(self, storyline: Dict) -> Dict:
+        progress = self.story_progress.get(storyline["id"], {})
+        return {
+            "id": storyline["id"],
+            "title": storyline["title"],
+            "description": storyline["description"],
+            "unlocked": progress.get("unlocked", False),
+            "progress": f"{len(progress.get('completed_chapters', []))}/{len(storyline['chapters'])}"
+        }
+    
+    def unlock_storyline(self, storyline_id: str) -> bool:
+        """解锁故事线（例如运动目标达成后）；故事线不存在时返回 False"""
+        storyline = self._storylines.get(storyline_id)
+        if storyline is None:
+            return False
+        progress = self.story_progress.setdefault(
+            storyline_id, {"current_chapter": 0, "completed_chapters": [], "unlocked": False}
+        )
+        if not progress["unlocked"]:
+            progress["unlocked"] = True
+            self._storyline_summaries[storyline_id] = self._summarize_storyline(storyline)
+            self.save_state()
+        return True
+    
+    def _persona_prompt(self) -> str:
+        """
+        Persona part of the system prompt (name, personality, background, traits)
+        
+        It only changes through setup_character/update_character/load_character, so it
+        is built once and kept byte-identical across turns. Every system prompt starts
+        with it, which lets the model server reuse its KV cache for the persona.
+        """
+        if self._persona_prompt_cache is not None:
+            return self._persona_prompt_cache
+        
         base_prompt = f"""You name is {self.character_data['name']}。
 
 [[[personality]]]
@@ -89,6 +174,12 @@ class AICharacter: # Now: chat+plot
         if "traits" in self.character_data:
             base_prompt += "\n".join(f"- {trait}" for trait in self.character_data['traits'])
         
+        self._persona_prompt_cache = base_prompt
+        return base_prompt
+    
+    def _build_system_prompt(self, mode: str = "chat") -> str: # build system prompt for character: cached persona prefix + mode suffix
+        base_prompt = self._persona_prompt()
+        
         if mode == "chat":
             base_prompt += """
 Now you are having a casual chat with the user. Please maintain the character Settings and respond naturally to the user's topics.
@@ -97,16 +188,14 @@ Don't reveal that you are an AI. Immerse yourself completely in the character.""
         elif mode == "story":
             current_storyline = self.character_data.get("current_storyline")
             if current_storyline:
-                storyline = next(
-                    (s for s in self.character_data["storylines"] if s["id"] == current_storyline),
-                    None
-                )
+                storyline = self._storylines.get(current_storyline)
                 if storyline:
                     progress = self.story_progress.get(current_storyline, {})
                     chapter_idx = progress.get("current_chapter", 0)
+                    chapters = self._chapters[current_storyline]
                     
-                    if chapter_idx < len(storyline["chapters"]):
-                        chapter = storyline["chapters"][chapter_idx]
+                    if chapter_idx < len(chapters):
+                        chapter = chapters[chapter_idx]
                         base_prompt += f"""
 
 [[[current plot]]]
@@ -132,33 +221,111 @@ Please advance the story based on the current plot progress. Maintain character
         if not self.character_data:
             return "❌ please set up the character first"
         
-        # 构建对话消息
-        messages = [
-            {"role": "system", "content": self._build_system_prompt("chat")}
-        ]
-        
-        # 添加历史对话（最近10轮）
-        if remember_history:
-            messages.extend(self.chat_history[-20:])
-        
-        messages.append({"role": "user", "content": user_message})
-        # TODO: 添加历史重要事件概述
+        messages = self._build_chat_messages(user_message, remember_history)
 
         # 调用模型
         try:
-            response = ollama.chat(model=self.model, messages=messages)
-            assistant_message = response['message']['content']
-            
-            # 保存对话历史
-            if remember_history:
-                self.chat_history.append({"role": "user", "content": user_message})
-                self.chat_history.append({"role": "assistant", "content": assistant_message})
-            
+            assistant_message = self._complete(messages)
+            self._remember_chat(user_message, assistant_message, remember_history)
             return assistant_message
             
         except Exception as e:
             return f"❌ 对话出错: {str(e)}"
     
+    def chat_stream(self, user_message: str, remember_history: bool = True) -> Iterator[str]:
+        """
+        Streaming variant of chat(): yields reply tokens as the model produces them
+        
+        The assembled reply is added to chat_history once the stream finishes. A
+        failed model call raises to the caller, and nothing is added then.
+        """
+        if not self.character_data:
+            yield "❌ please set up the character first"
+            return
+        
+        messages = self._build_chat_messages(user_message, remember_history)
+        parts = []
+        for token in self._complete_stream(messages):
+            parts.append(token)
+            yield token
+        
+        self._remember_chat(user_message, "".join(parts), remember_history)
+    
+    def _cache_key(self, messages: List[Dict]) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return cache_key(self.model, messages, getattr(self.llm, "options", None))
+    
+    def _complete(self, messages: List[Dict]) -> str:
+        """一次完整生成；开启响应缓存时相同提示直接复用已有回复"""
+        key = self._cache_key(messages)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        content = self.llm.chat(model=self.model, messages=messages)['message']['content']
+        if key is not None:
+            self.response_cache.put(key, content)
+        return content
+    
+    def _complete_stream(self, messages: List[Dict]) -> Iterator[str]:
+        """流式生成；缓存命中时一次性返回整段回复"""
+        key = self._cache_key(messages)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        parts = []
+        for chunk in self.llm.chat(model=self.model, messages=messages, stream=True):
+            token = chunk['message']['content']
+            if token:
+                parts.append(token)
+                yield token
+        if key is not None:
+            self.response_cache.put(key, "".join(parts))
+    
+    def _build_chat_messages(self, user_message: str, remember_history: bool) -> List[Dict]:
+        # 构建对话消息：近期对话原文 + 更早对话的滚动摘要，总长度受 token 预算限制
+        system_prompt = self._build_system_prompt("chat")
+        if remember_history:
+            self.memory.character_name = self.character_data.get("name", "")
+            return self.memory.assemble(system_prompt, self.chat_history, user_message,
+                                        self._recall(user_message), offset=self.history_offset)
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _remember_chat(self, user_message: str, assistant_message: str, remember_history: bool):
+        # 保存对话历史
+        if remember_history:
+            self.chat_history.append({"role": "user", "content": user_message})
+            self.chat_history.append({"role": "assistant", "content": assistant_message})
+            if self.chat_log is not None:
+                now = datetime.now().isoformat()
+                self.chat_log.append({"role": "user", "content": user_message, "ts": now})
+                self.chat_log.append({"role": "assistant", "content": assistant_message, "ts": now})
+                self.writer.submit(self.chat_log.path + ".memory.json", self.memory.to_dict())
+                self._trim_history()
+            if self.long_term_memory is not None:
+                name = self.character_data.get("name", "assistant")
+                self.long_term_memory.remember_async(f"User: {user_message}\n{name}: {assistant_message}", kind="chat")
+    
+    def _recall(self, query: str) -> Optional[str]:
+        """从长期记忆中检索与当前输入最相关的过往对话/剧情事件"""
+        if self.long_term_memory is None:
+            return None
+        try:
+            memories = self.long_term_memory.recall(query)
+        except Exception as e:
+            log.error("long-term memory recall failed", extra={"fields": {"error": str(e)}})
+            return None
+        if not memories:
+            return None
+        return "[[[related memories]]]\n" + "\n".join(f"- {m['text']}" for m in memories)
+    
     def advance_story(self, user_action: str) -> Dict:
         """
         推进主线剧情
@@ -169,6 +336,49 @@ Please advance the story based on the current plot progress. Maintain character
         Returns:
             包含剧情回复和状态的字典
         """
+        turn = self._prepare_story_turn(user_action)
+        if "error" in turn or "completed" in turn:
+            return turn
+        
+        try:
+            story_response = self._complete(turn["messages"])
+            return self._finish_story_turn(user_action, turn, story_response)
+            
+        except Exception as e:
+            return {"error": f"剧情推进出错: {str(e)}"}
+    
+    def advance_story_stream(self, user_action: str) -> Iterator[Union[str, Dict]]:
+        """
+        Streaming variant of advance_story()
+        
+        Yields story text tokens as they are generated, then a final dict with the
+        same fields advance_story() returns (or an {"error": ...} dict).
+        """
+        turn = self._prepare_story_turn(user_action)
+        if "error" in turn or "completed" in turn:
+            yield turn
+            return
+        
+        parts = []
+        verdict_filter = VerdictStreamFilter() if turn["verdict"] == AMBIGUOUS else None  # hide the judge marker
+        try:
+            for token in self._complete_stream(turn["messages"]):
+                parts.append(token)
+                if verdict_filter is not None:
+                    token = verdict_filter.feed(token)
+                if token:
+                    yield token
+            tail = verdict_filter.finish() if verdict_filter is not None else ""
+            if tail:
+                yield tail
+        except Exception as e:
+            yield {"error": f"剧情推进出错: {str(e)}"}
+            return
+        
+        yield self._finish_story_turn(user_action, turn, "".join(parts))
+    
+    def _prepare_story_turn(self, user_action: str) -> Dict:
+        """定位当前章节并构建剧情推进消息；出错或故事线已完成时直接返回结果"""
         if not self.character_data or "storylines" not in self.character_data:
             return {"error": "未设置剧情"}
         
@@ -177,76 +387,91 @@ Please advance the story based on the current plot progress. Maintain character
             return {"error": "未选择剧情线"}
         
         # 获取当前剧情
-        storyline = next(
-            (s for s in self.character_data["storylines"] if s["id"] == current_storyline_id),
-            None
-        )
+        storyline = self._storylines.get(current_storyline_id)
         
         if not storyline:
             return {"error": "剧情线不存在"}
         
         progress = self.story_progress.get(current_storyline_id, {})
         chapter_idx = progress.get("current_chapter", 0)
+        chapters = self._chapters[current_storyline_id]
         
-        if chapter_idx >= len(storyline["chapters"]):
+        if chapter_idx >= len(chapters):
             return {
                 "message": f"🎉 恭喜！你已完成 '{storyline['title']}' 故事线！",
                 "completed": True
             }
         
-        chapter = storyline["chapters"][chapter_idx]
+        # 第一层：关键词自动机判断章节是否完成；拿不准时让本次剧情生成顺带给出判定标记
+        verdict = self._judges[current_storyline_id].classify(chapter_idx, user_action)
+        system_prompt = self._build_system_prompt("story")
+        if verdict == AMBIGUOUS:
+            system_prompt += VERDICT_INSTRUCTION
         
         # 构建剧情推进消息
         messages = [
-            {"role": "system", "content": self._build_system_prompt("story")},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_action}
         ]
+        recalled = self._recall(user_action)
+        if recalled:
+            messages.insert(1, {"role": "system", "content": recalled})
         
-        try:
-            response = ollama.chat(model=self.model, messages=messages)
-            story_response = response['message']['content']
-            
-            # 检查是否完成当前章节（简单示例：可以改进为更智能的判断）
-            chapter_complete = self._check_chapter_completion(user_action, chapter)
-            
-            result = {
-                "response": story_response,
-                "storyline": storyline["title"],
-                "chapter": chapter["title"],
-                "chapter_index": chapter_idx,
-                "total_chapters": len(storyline["chapters"]),
-                "completed": False
-            }
-            
-            if chapter_complete:
-                # 完成当前章节
-                progress["completed_chapters"].append(chapter_idx)
-                progress["current_chapter"] = chapter_idx + 1
-                self.story_progress[current_storyline_id] = progress
-                self.character_data["story_progress"] = self.story_progress
-                self.save_character()
-                
-                result["chapter_completed"] = True
-                result["message"] = f"✅ 章节 '{chapter['title']}' 完成！"
-                
-                if chapter_idx + 1 >= len(storyline["chapters"]):
-                    result["storyline_completed"] = True
-                    result["message"] += f"\n🎉 故事线 '{storyline['title']}' 全部完成！"
+        return {
+            "storyline_id": current_storyline_id,
+            "storyline": storyline,
+            "progress": progress,
+            "chapter_idx": chapter_idx,
+            "chapter": chapters[chapter_idx],
+            "verdict": verdict,
+            "messages": messages
+        }
+    
+    def _finish_story_turn(self, user_action: str, turn: Dict, story_response: str) -> Dict:
+        """根据生成的剧情回复判断章节完成情况并更新进度"""
+        storyline, chapter, chapter_idx = turn["storyline"], turn["chapter"], turn["chapter_idx"]
+        progress = turn["progress"]
+        
+        # 检查是否完成当前章节：关键词判定，或模型在回复末尾给出的判定标记
+        story_response, model_verdict = strip_verdict(story_response)
+        if turn["verdict"] == AMBIGUOUS:
+            chapter_complete = bool(model_verdict)
+        else:
+            chapter_complete = turn["verdict"] == COMPLETE
+        
+        if self.long_term_memory is not None:
+            self.long_term_memory.remember_async(
+                f"[{storyline['title']} / {chapter['title']}] User: {user_action}\n{story_response}",
+                kind="story",
+                meta={"storyline": turn["storyline_id"], "chapter": chapter_idx}
+            )
+        
+        result = {
+            "response": story_response,
+            "storyline": storyline["title"],
+            "chapter": chapter["title"],
+            "chapter_index": chapter_idx,
+            "total_chapters": len(storyline["chapters"]),
+            "completed": False
+        }
+        
+        if chapter_complete:
+            # 完成当前章节
+            progress["completed_chapters"].append(chapter_idx)
+            progress["current_chapter"] = chapter_idx + 1
+            self.story_progress[turn["storyline_id"]] = progress
+            self.character_data["story_progress"] = self.story_progress
+            self._storyline_summaries[turn["storyline_id"]] = self._summarize_storyline(storyline)
+            self.save_state()
             
-            return result
+            result["chapter_completed"] = True
+            result["message"] = f"✅ 章节 '{chapter['title']}' 完成！"
             
-        except Exception as e:
-            return {"error": f"剧情推进出错: {str(e)}"}
-    
-    def _check_chapter_completion(self, user_action: str, chapter: Dict) -> bool:
-        """
-        检查章节是否完成（简化版本）
-        实际使用中可以用更复杂的逻辑判断
-        """
-        # 这里可以根据关键词、AI判断或特定条件来决定
-        # 简单示例：检查是否包含完成关键词
-        completion_keywords = ["完成", "done", "finish", "解决", "成功"]
-        return any(keyword in user_action.lower() for keyword in completion_keywords)
+            if chapter_idx + 1 >= len(storyline["chapters"]):
+                result["storyline_completed"] = True
+                result["message"] += f"\n🎉 故事线 '{storyline['title']}' 全部完成！"
+        
+        return result
     
     def start_storyline(self, storyline_id: str) -> str:
         """
@@ -261,10 +486,7 @@ Please advance the story based on the current plot progress. Maintain character
         if "storylines" not in self.character_data:
             return "❌ 没有可用的故事线"
         
-        storyline = next(
-            (s for s in self.character_data["storylines"] if s["id"] == storyline_id),
-            None
-        )
+        storyline = self._storylines.get(storyline_id)
         
         if not storyline:
             return "❌ 故事线不存在"
@@ -273,9 +495,9 @@ Please advance the story based on the current plot progress. Maintain character
             return "❌ 该故事线尚未解锁"
         
         self.character_data["current_storyline"] = storyline_id
-        self.save_character()
+        self.save_state()
         
-        first_chapter = storyline["chapters"][0]
+        first_chapter = self._chapters[storyline_id][0]
         return f"""📖 开始故事线: {storyline['title']}
 
 {storyline['description']}
@@ -286,51 +508,166 @@ Please advance the story based on the current plot progress. Maintain character
 目标: {first_chapter['objective']}
 """
     
+    def generate_story_opening(self, storyline_id: str) -> Optional[str]:
+        """
+        生成故事线第一章的开场剧情，不改变任何进度（用于解锁前的预生成）
+        
+        只依赖角色设定和故事线定义，同一角色的所有用户得到相同提示，可被响应缓存复用
+        """
+        storyline = self._storylines.get(storyline_id)
+        if not storyline or not self._chapters[storyline_id]:
+            return None
+        chapter = self._chapters[storyline_id][0]
+        system_prompt = self._persona_prompt() + f"""
+
+[[[story opening]]]
+story line: {storyline['title']}
+{storyline['description']}
+chapter: {chapter['title']}
+{chapter['description']}
+chapter goal: {chapter['objective']}
+
+Write the opening scene of this chapter in character, and end by inviting the user to take their first action."""
+        return self._complete([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "开始吧"}
+        ])
+    
     def get_available_storylines(self) -> List[Dict]:
         """获取可用的故事线列表"""
-        if "storylines" not in self.character_data:
-            return []
-        
-        return [
-            {
-                "id": s["id"],
-                "title": s["title"],
-                "description": s["description"],
-                "unlocked": self.story_progress.get(s["id"], {}).get("unlocked", False),
-                "progress": f"{len(self.story_progress.get(s['id'], {}).get('completed_chapters', []))}/{len(s['chapters'])}"
-            }
-            for s in self.character_data["storylines"]
-        ]
+        return [dict(summary) for summary in self._storyline_summaries.values()]
+    
+    # 运行时状态（剧情进度、当前故事线）与静态角色设定/故事线定义分开存储
+    STATE_FIELDS = ("story_progress", "current_storyline")
     
     def save_character(self):
-        """保存角色数据到JSON文件"""
-        with open(self.character_file, 'w', encoding='utf-8') as f:
-            json.dump(self.character_data, f, ensure_ascii=False, indent=2)
+        """保存角色数据：设定写入角色文件，进度写入状态文件（后台合并写入，原子替换）"""
+        definition = {k: v for k, v in self.character_data.items() if k not in self.STATE_FIELDS}
+        self.writer.submit(self.character_file, definition, indent=2)
+        self.save_state()
+    
+    def save_state(self):
+        """只保存剧情进度等运行时状态（热路径调用，体积小）"""
+        state = {k: self.character_data[k] for k in self.STATE_FIELDS if k in self.character_data}
+        self.writer.submit(self.state_file, state)
+    
+    def flush(self):
+        """立即写出尚未落盘的角色数据"""
+        paths = [self.character_file, self.state_file]
+        if self.chat_log is not None:
+            self.writer.submit(self.chat_log.path + ".memory.json", self.memory.to_dict())
+            paths.append(self.chat_log.path + ".memory.json")
+        self.writer.flush(paths)
+    
+    def close(self):
+        """写出全部状态并释放对话日志文件（会话被换出内存时调用）"""
+        self.flush()
+        if self.chat_log is not None:
+            self.chat_log.close()
+            self.chat_log = None
     
     def load_character(self):
-        """从JSON文件加载角色数据"""
+        """从JSON文件加载角色数据（状态文件存在时覆盖旧格式中内嵌的进度）"""
         with open(self.character_file, 'r', encoding='utf-8') as f:
             self.character_data = json.load(f)
-            self.story_progress = self.character_data.get("story_progress", {})
+        if Path(self.state_file).exists():
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.character_data.update(json.load(f))
+        self.story_progress = self.character_data.get("story_progress", {})
+        self.character_data["story_progress"] = self.story_progress
+        self._persona_prompt_cache = None
+        self._compile_storylines()
         print(f"✅ 已加载角色: {self.character_data.get('name', '未命名')}")
     
-    def save_chat_history(self, filename: str = "chat_history.json"):
-        """保存对话历史"""
+    def attach_chat_log(self, filename: str):
+        """
+        Use an append-only JSONL transcript for this conversation
+        
+        New turns are appended as they happen; only the last `history_tail` messages
+        (plus any not yet folded into the synopsis) are loaded into memory.
+        """
+        if self.chat_log is not None:
+            self.chat_log.close()
+        self.chat_log = ChatLog(filename)
+        memory_file = Path(filename + ".memory.json")
+        
+        if len(self.chat_log) == 0 and self.chat_history:
+            for message in self.chat_history:  # start the log from the current in-memory history
+                self.chat_log.append(message)
+            self.writer.submit(str(memory_file), self.memory.to_dict())
+            return
+        
+        if memory_file.exists():
+            with open(memory_file, 'r', encoding='utf-8') as f:
+                self.memory.load(json.load(f))
+        else:
+            self.memory.reset()
+        total = len(self.chat_log)
+        start = max(0, min(total - self.history_tail, self.memory.summarized_upto))
+        start = max(start, total - 5 * self.history_tail)  # never load an unbounded backlog
+        self.history_offset = start
+        self.chat_history = [
+            {"role": m["role"], "content": m["content"]} for m in self.chat_log.read(start, total - start)
+        ]
+    
+    def _trim_history(self):
+        """丢弃内存中已摘要且超出尾部窗口的旧消息（仍保留在日志文件中）"""
+        if len(self.chat_history) <= 2 * self.history_tail:
+            return
+        keep_from = len(self.chat_history) - self.history_tail
+        keep_from = min(keep_from, max(self.memory.summarized_upto - self.history_offset, 0))
+        if keep_from > 0:
+            del self.chat_history[:keep_from]
+            self.history_offset += keep_from
+    
+    def get_history_page(self, page: int = 0, page_size: int = 20) -> List[Dict]:
+        """按页读取对话记录，page 0 为最新一页；较早的页从日志文件按偏移读取"""
+        total = self.history_offset + len(self.chat_history)
+        end = total - page * page_size
+        start = max(0, end - page_size)
+        if start >= self.history_offset:
+            return self.chat_history[start - self.history_offset:end - self.history_offset]
+        if self.chat_log is not None:
+            return self.chat_log.read(start, end - start)
+        return []
+    
+    def save_chat_history(self, filename: str = "chat_history.jsonl"):
+        """保存对话历史（.jsonl：挂载为追加写入的对话日志；.json：旧格式整体导出）"""
+        if filename.endswith(".jsonl"):
+            if self.chat_log is None or self.chat_log.path != filename:
+                self.attach_chat_log(filename)
+            self.writer.flush([filename + ".memory.json"])
+            print(f"✅ 对话历史已保存到 {filename}")
+            return
+        
         history_data = {
             "character": self.character_data.get("name"),
             "timestamp": datetime.now().isoformat(),
-            "messages": self.chat_history
+            "messages": self.chat_history,
+            "memory": self.memory.to_dict()
         }
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(history_data, f, ensure_ascii=False, indent=2)
         print(f"✅ 对话历史已保存到 {filename}")
     
-    def load_chat_history(self, filename: str = "chat_history.json"):
-        """加载对话历史"""
+    def load_chat_history(self, filename: str = "chat_history.jsonl"):
+        """加载对话历史（.jsonl 只加载尾部，较早记录用 get_history_page 按需读取）"""
+        if filename.endswith(".jsonl"):
+            if not Path(filename).exists():
+                print(f"❌ 文件 {filename} 不存在")
+                return
+            self.chat_history = []
+            self.history_offset = 0
+            self.attach_chat_log(filename)
+            print(f"✅ 已加载 {len(self.chat_history)} 条对话记录（共 {len(self.chat_log)} 条）")
+            return
+        
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 history_data = json.load(f)
                 self.chat_history = history_data.get("messages", [])
+                self.history_offset = 0
+                self.memory.load(history_data.get("memory"))
             print(f"✅ 已加载 {len(self.chat_history)} 条对话记录")
         except FileNotFoundError:
             print(f"❌ 文件 {filename} 不存在")
@@ -338,6 +675,11 @@ Please advance the story based on the current plot progress. Maintain character
     def clear_chat_history(self):
         """清空对话历史"""
         self.chat_history = []
+        self.history_offset = 0
+        self.memory.reset()
+        if self.chat_log is not None:
+            self.chat_log.clear()
+            self.writer.submit(self.chat_log.path + ".memory.json", self.memory.to_dict())
         print("✅ 对话历史已清空")
     
     def get_character_info(self) -> Dict:
@@ -348,7 +690,7 @@ Please advance the story based on the current plot progress. Maintain character
         return {
             "name": self.character_data.get("name"),
             "personality": self.character_data.get("personality"),
-            "chat_count": len(self.chat_history) // 2,
+            "chat_count": (self.history_offset + len(self.chat_history)) // 2,
             "current_storyline": self.character_data.get("current_storyline"),
             "available_storylines": len(self.character_data.get("storylines", []))
         }
@@ -361,22 +703,17 @@ Please advance the story based on the current plot progress. Maintain character
             storyline_id: 故事线ID
             filename: 导出文件名（可选）
         """
-        storyline = next(
-            (s for s in self.character_data.get("storylines", []) if s["id"] == storyline_id),
-            None
-        )
+        storyline = self._storylines.get(storyline_id)
         
         if not storyline:
             print("❌ 故事线不存在")
             return
         
-        progress = self.story_progress.get(storyline_id, {})
-        
         transcript = {
             "storyline": storyline["title"],
             "description": storyline["description"],
-            "progress": f"{len(progress.get('completed_chapters', []))}/{len(storyline['chapters'])}",
-            "chapters": storyline["chapters"],
+            "progress": self._storyline_summaries[storyline_id]["progress"],
+            "chapters": self._chapters[storyline_id],
             "exported_at": datetime.now().isoformat()
         }
         
@@ -0,0 +1,117 @@
+import json
+import os
+import struct
+import threading
+import time
+from typing import Dict, List
+
+from metrics import PERSIST_WRITE
+
+_OFFSET = struct.Struct("<Q")
+
+
+class ChatLog:
+    """
+    Append-only JSONL chat transcript with a sidecar offset index
+
+    Each message is one line of `path`; `path + ".idx"` holds the byte offset of
+    every line as a little-endian uint64. Appending costs one line, and any range
+    of messages (the tail at startup, older pages on demand) is read with a single
+    seek instead of parsing the whole transcript.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._lock = threading.Lock()
+        self._recover()
+        self._log = open(self.path, 'ab')
+        self._index = open(self.index_path, 'ab')
+
+    def _recover(self):
+        """Make the index match the transcript after a crash between the two appends"""
+        for p in (self.path, self.index_path):
+            if not os.path.exists(p):
+                open(p, 'ab').close()
+        log_size = os.path.getsize(self.path)
+        index_size = os.path.getsize(self.index_path)
+        count = index_size // _OFFSET.size
+
+        with open(self.index_path, 'rb') as f:
+            # drop a partial entry and offsets pointing past the transcript
+            while count:
+                f.seek((count - 1) * _OFFSET.size)
+                if _OFFSET.unpack(f.read(_OFFSET.size))[0] < log_size:
+                    break
+                count -= 1
+            last = 0
+            if count:
+                f.seek((count - 1) * _OFFSET.size)
+                last = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+        os.truncate(self.index_path, count * _OFFSET.size)
+
+        # re-index complete lines written after the last indexed one; cut a torn final line
+        with open(self.path, 'rb') as f:
+            f.seek(last)
+            if count:
+                f.readline()  # the last indexed line itself
+            offsets = []
+            position = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offsets.append(position)
+                position += len(line)
+        if position < log_size:
+            os.truncate(self.path, position)
+        if offsets:
+            with open(self.index_path, 'ab') as f:
+                f.write(b"".join(_OFFSET.pack(o) for o in offsets))
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.index_path) // _OFFSET.size
+
+    def append(self, message: Dict):
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8')
+        with self._lock:
+            started = time.perf_counter()
+            offset = self._log.tell()
+            self._log.write(line)
+            self._log.flush()
+            self._index.write(_OFFSET.pack(offset))
+            self._index.flush()
+        PERSIST_WRITE.observe(time.perf_counter() - started, target="chat_log")
+
+    def read(self, start: int, count: int) -> List[Dict]:
+        """Messages [start, start + count), clamped to the log"""
+        with self._lock:
+            total = len(self)
+            start = max(0, start)
+            end = min(total, start + count)
+            if start >= end:
+                return []
+            with open(self.index_path, 'rb') as f:
+                f.seek(start * _OFFSET.size)
+                first = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+                f.seek((end - 1) * _OFFSET.size)
+                last = _OFFSET.unpack(f.read(_OFFSET.size))[0]
+            with open(self.path, 'rb') as f:
+                f.seek(first)
+                data = f.read(last - first)
+                data += f.readline()
+        return [json.loads(line) for line in data.splitlines()]
+
+    def tail(self, count: int) -> List[Dict]:
+        return self.read(len(self) - count, count)
+
+    def clear(self):
+        with self._lock:
+            self._log.truncate(0)
+            self._index.truncate(0)
+            self._log.seek(0)
+            self._index.seek(0)
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+            self._index.close()
@@ -0,0 +1,198 @@
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+COMPLETE = "complete"
+INCOMPLETE = "incomplete"
+AMBIGUOUS = "ambiguous"
+
+DEFAULT_COMPLETION_KEYWORDS = ("完成", "done", "finish", "解决", "成功")
+DEFAULT_AMBIGUOUS_KEYWORDS = ("差不多", "快要", "almost", "try", "尝试")
+NEGATION_CUES = ("没有", "没能", "没法", "还没", "未能", "尚未", "并未", "不能", "不会", "不想", "无法",
+                 "not", "no", "never", "cannot", "can't", "don't", "didn't", "doesn't", "haven't", "hasn't",
+                 "won't", "wasn't", "isn't", "couldn't")
+NEGATION_WINDOW = 6  # characters before a keyword that a negation cue may end in
+NEGATION_PREFIXES = ("没", "未")  # negate only directly before a keyword ("没完成"), unlike in "没想到…完成了"
+INFLECTIONS = ("s", "es", "d", "ed", "ing")  # English endings a completion/ambiguous keyword may carry ("finished")
+
+VERDICT_INSTRUCTION = """
+
+[[[chapter judge]]]
+After your reply, add one final line with exactly [[CHAPTER_COMPLETE: yes]] if the user's action achieves the chapter goal, otherwise [[CHAPTER_COMPLETE: no]]."""
+VERDICT_MARKER = "[[CHAPTER_COMPLETE"
+_VERDICT = re.compile(r"\s*\[\[CHAPTER_COMPLETE:\s*(yes|no)\s*\]\]\s*$", re.IGNORECASE)
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton: finds every occurrence of a fixed keyword set in one pass
+
+    Matching is case-insensitive and costs O(len(text) + matches) no matter how
+    many keywords a chapter defines. An ASCII keyword only matches whole words
+    ("try" not in "entry", "done" not in "abandoned"), except that keywords in
+    `inflected` may end in an English inflection ("finish" in "finished").
+    Other scripts have no word spacing and match anywhere.
+    """
+
+    def __init__(self, keywords, inflected=()):
+        self.keywords = sorted({k.lower() for k in keywords if k})
+        self.inflected = {k.lower() for k in inflected}
+        self.goto = [{}]  # type: List[Dict[str, int]]
+        self.fail = [0]
+        self.output = [[]]  # type: List[List[str]]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append(keyword)
+        self.bounded = {k: (_is_word_char(k[0]), _is_word_char(k[-1])) for k in self.keywords}  # sides needing a word boundary
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, str]]:
+        """(start index, keyword) of every match, in order of their end position"""
+        matches = []
+        state = 0
+        goto, fail, output, bounded = self.goto, self.fail, self.output, self.bounded
+        text = text.lower()
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for keyword in output[state]:
+                start = i + 1 - len(keyword)
+                left, right = bounded[keyword]
+                if left and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if right and i + 1 < len(text) and _is_word_char(text[i + 1]) and not self._inflection(keyword, text, i + 1):
+                    continue
+                matches.append((start, keyword))
+        return matches
+
+    def _inflection(self, keyword: str, text: str, end: int) -> bool: # the rest of the word at text[end:] inflects keyword
+        if keyword not in self.inflected:
+            return False
+        stop = end
+        while stop < len(text) and _is_word_char(text[stop]):
+            stop += 1
+        rest = text[end:stop]
+        return rest in INFLECTIONS or (rest[:1] == keyword[-1] and rest[1:] in ("ed", "ing"))  # "stopped", "winning"
+
+
+def _is_word_char(ch: str) -> bool: # ASCII letter or digit
+    return ch.isascii() and ch.isalnum()
+
+
+@lru_cache(maxsize=1024)
+def compile_keywords(keywords: Tuple[str, ...], inflected: Tuple[str, ...] = ()) -> KeywordAutomaton: # shared by every session using the same keyword set
+    return KeywordAutomaton(keywords, inflected)
+
+
+class CompletionJudge:
+    """
+    Tiered chapter-completion check for one storyline
+
+    Tier 1 scans the user's action with a keyword automaton built from each
+    chapter's "completion_keywords" (default list otherwise) plus negation cues
+    and "ambiguous_keywords". Clear hits and misses are decided there. Negated or
+    hedged actions are AMBIGUOUS: the caller asks the story generation itself to
+    end with a verdict marker, so the model check costs no extra call.
+    """
+
+    def __init__(self, chapters: List[Dict]):
+        self.chapters = []
+        for chapter in chapters:
+            completion = tuple(chapter.get("completion_keywords") or DEFAULT_COMPLETION_KEYWORDS)
+            ambiguous = tuple(chapter.get("ambiguous_keywords", DEFAULT_AMBIGUOUS_KEYWORDS))
+            kinds = {}
+            for keyword in NEGATION_PREFIXES:
+                kinds[keyword] = "prefix"
+            for keyword in NEGATION_CUES:
+                kinds[keyword.lower()] = "negation"
+            for keyword in ambiguous:
+                kinds[keyword.lower()] = "ambiguous"
+            for keyword in completion:
+                kinds[keyword.lower()] = "completion"
+            inflected = tuple(sorted(k for k, kind in kinds.items() if kind in ("ambiguous", "completion")))
+            self.chapters.append((compile_keywords(tuple(sorted(kinds)), inflected), kinds))
+
+    def classify(self, chapter_idx: int, user_action: str) -> str:
+        automaton, kinds = self.chapters[chapter_idx]
+        negations = []
+        completion_hits = []
+        hedged = False
+        for start, keyword in automaton.find(user_action):
+            kind = kinds[keyword]
+            if kind == "negation":
+                negations.append((start + len(keyword), NEGATION_WINDOW))
+            elif kind == "prefix":
+                negations.append((start + len(keyword), 0))
+            elif kind == "ambiguous":
+                hedged = True
+            else:
+                completion_hits.append(start)
+
+        if not completion_hits:
+            return AMBIGUOUS if hedged else INCOMPLETE
+        negated = all(
+            any(start - window <= end <= start for end, window in negations) for start in completion_hits
+        )
+        return AMBIGUOUS if negated or hedged else COMPLETE
+
+
+def strip_verdict(text: str) -> Tuple[str, Optional[bool]]:
+    """Remove a trailing verdict marker; returns (reply, True/False, or None if absent)"""
+    match = _VERDICT.search(text)
+    if match:
+        return text[:match.start()].rstrip(), match.group(1).lower() == "yes"
+    cut = text.find(VERDICT_MARKER)
+    if cut >= 0:  # malformed marker: hide it, no verdict
+        return text[:cut].rstrip(), None
+    return text, None
+
+
+class VerdictStreamFilter:
+    """Pass streamed tokens through while holding back anything that may be the start of the verdict marker"""
+
+    def __init__(self):
+        self.pending = ""
+        self.stopped = False
+
+    def feed(self, token: str) -> str:
+        if self.stopped:
+            return ""
+        self.pending += token
+        cut = self.pending.find(VERDICT_MARKER)
+        if cut >= 0:
+            self.stopped = True
+            out, self.pending = self.pending[:cut], ""
+            return out.rstrip()
+        keep = 0  # longest suffix that is a prefix of the marker
+        for n in range(min(len(VERDICT_MARKER) - 1, len(self.pending)), 0, -1):
+            if VERDICT_MARKER.startswith(self.pending[-n:]):
+                keep = n
+                break
+        out = self.pending[:len(self.pending) - keep].rstrip()  # whitespace before the marker is held back too
+        self.pending = self.pending[len(out):]
+        return out
+
+    def finish(self) -> str:
+        out, self.pending = ("" if self.stopped else self.pending), ""
+        return out
@@ -0,0 +1,155 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llm_client import LLMBackend
+
+log = logging.getLogger("lovefit.memory")
+
+
+def estimate_tokens(text: str) -> int: # rough count: one token per CJK character, ~4 characters per token otherwise
+    cjk = sum(1 for ch in text if ch >= "⺀")
+    return cjk + (len(text) - cjk + 3) // 4 + 4  # +4 for per-message chat-template overhead
+
+
+class ConversationMemory:
+    """
+    Token-budgeted chat context with a rolling synopsis of older turns
+
+    assemble() packs the newest messages that fit the budget after the system
+    prompt. Messages that fall out of that window are folded into a running
+    synopsis by a background summarization call, so old turns are compressed
+    rather than forgotten and prompt size stays flat in long sessions.
+    """
+
+    SUMMARY_PROMPT = """You maintain the long-term memory of {name}, a character chatting with the user.
+Merge the new messages into the existing synopsis. Keep facts about the user, promises, shared events,
+relationship changes and unresolved topics; drop small talk. Write in the conversation's language,
+as a concise third-person summary of at most {words} words. Output only the updated synopsis."""
+
+    def __init__(self, llm: LLMBackend, model: str, token_budget: int = 3000, summary_words: int = 200,
+                 min_recent: int = 2):
+        """
+        Args:
+            llm: backend used for summarization calls
+            model: model used for summarization
+            token_budget: max estimated tokens for system prompt + synopsis + history + new message
+            summary_words: target length of the synopsis
+            min_recent: newest messages always kept verbatim, even over budget
+        """
+        self.llm = llm
+        self.model = model
+        self.token_budget = token_budget
+        self.summary_words = summary_words
+        self.min_recent = min_recent
+        self.synopsis = ""
+        self.summarized_upto = 0  # messages [0, summarized_upto) of the history are in the synopsis
+        self.character_name = ""
+        self._lock = threading.Lock()
+        self._pending = None  # type: Optional[Tuple[int, List[Dict]]]  # (offset, history snapshot) awaiting summarization
+        self._pending_end = 0
+        self._generation = 0  # bumped by reset(), so a summary started before it is dropped
+        self._worker = None  # type: Optional[threading.Thread]
+        self.runner = None  # type: Optional[Callable[[], None]]  # runs run_pending() elsewhere (e.g. a job queue) instead of a thread
+
+    def assemble(self, system_prompt: str, history: List[Dict], user_message: str,
+                 context: Optional[str] = None, offset: int = 0) -> List[Dict]:
+        """
+        Build the message list for one chat turn within the token budget
+        
+        Args:
+            context: extra system text, e.g. recalled memories; it goes after the history, just
+                before the new message, so the prompt up to there stays a cacheable prefix across turns
+            offset: absolute position of history[0] when only a tail of the transcript is loaded
+        """
+        used = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.synopsis:
+            synopsis = f"[[[memory of earlier conversation]]]\n{self.synopsis}"
+            used += estimate_tokens(synopsis)
+            messages.append({"role": "system", "content": synopsis})
+        if context:
+            used += estimate_tokens(context)
+
+        floor = max(self.summarized_upto - offset, 0)
+        start = len(history)
+        while start > floor:
+            cost = estimate_tokens(history[start - 1]["content"])
+            if used + cost > self.token_budget and len(history) - start >= self.min_recent:
+                break
+            used += cost
+            start -= 1
+
+        messages.extend(history[start:])
+        if context:
+            messages.append({"role": "system", "content": context})
+        messages.append({"role": "user", "content": user_message})
+
+        if start > floor:
+            self.schedule(history, start, offset)
+        return messages
+
+    def schedule(self, history: List[Dict], end: int, offset: int = 0):
+        """Fold history[:end] (absolute positions offset..offset+end) into the synopsis on a background thread"""
+        with self._lock:
+            if offset + end <= max(self.summarized_upto, self._pending_end):
+                return
+            self._pending = (offset, history[:end])
+            self._pending_end = offset + end
+            if self.runner is None and (self._worker is None or not self._worker.is_alive()):
+                self._worker = threading.Thread(target=self.run_pending, name="chat-summarizer", daemon=True)
+                self._worker.start()
+        if self.runner is not None:
+            self.runner()
+
+    def run_pending(self): # summarize whatever is queued (on the worker thread or the runner)
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    return
+                (offset, snapshot), self._pending = self._pending, None
+                start, synopsis, generation = self.summarized_upto, self.synopsis, self._generation
+            try:
+                updated = self.summarize(synopsis, snapshot[max(start - offset, 0):])
+            except Exception as e:
+                log.error("conversation summary failed", extra={"fields": {"error": str(e)}})
+                with self._lock:
+                    if self._generation == generation:
+                        self._pending_end = self.summarized_upto
+                return
+            with self._lock:
+                if self._generation == generation:  # not reset meanwhile
+                    self.synopsis = updated
+                    self.summarized_upto = offset + len(snapshot)
+
+    def summarize(self, synopsis: str, messages: List[Dict]) -> str: # one LLM call merging messages into the synopsis
+        speaker = {"user": "User", "assistant": self.character_name or "Character"}
+        transcript = "\n".join(f"{speaker.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+        response = self.llm.chat(model=self.model, messages=[
+            {"role": "system", "content": self.SUMMARY_PROMPT.format(name=self.character_name, words=self.summary_words)},
+            {"role": "user", "content": f"Existing synopsis:\n{synopsis or '(empty)'}\n\nNew messages:\n{transcript}"}
+        ])
+        return response['message']['content'].strip()
+
+    def wait(self, timeout: Optional[float] = None): # block until queued summarization finishes
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def reset(self):
+        with self._lock:
+            self.synopsis = ""
+            self.summarized_upto = 0
+            self._pending = None
+            self._pending_end = 0
+            self._generation += 1
+
+    def to_dict(self) -> Dict:
+        return {"synopsis": self.synopsis, "summarized_upto": self.summarized_upto}
+
+    def load(self, data: Optional[Dict]):
+        self.reset()
+        if data:
+            self.synopsis = data.get("synopsis", "")
+            self.summarized_upto = data.get("summarized_upto", 0)
+            self._pending_end = self.summarized_upto
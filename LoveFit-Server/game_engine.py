@@ -1,70 +1,627 @@
-from typing import Dict, List
+from bisect import bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+import gc
+import hashlib
 import json
+import logging
+import math
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+from aggregates import AggregateTable
+from catalogue import DEFAULT_REQUIREMENTS_FILE, load_catalogue
+from progress_store import MemoryProgressStore, ProgressStore
+from rollups import DailyRollup, day_number
+from workout_dedup import WorkoutDedupIndex
+from workout_log import WorkoutEventLog
+from metrics import traced
+
+log = logging.getLogger("lovefit.engine")
+
+METRICS = ("distance", "duration")  # per-workout metrics a requirement can threshold on
+MAX_FUTURE_SECONDS = 86400  # how far ahead of the server clock a workout timestamp may be (device clock skew)
+
+
+def requirement_metrics(req: Dict) -> Iterator[Tuple[str, float]]: # (metric key, threshold) pairs that satisfy a requirement
+    window = req.get("window_days")  # e.g. {"distance": 5000, "window_days": 7} is 5 km over the last 7 days
+    for metric in METRICS:
+        if metric in req:
+            yield (f"{metric}_{window}d" if window else metric), req[metric]
+    if "streak_days" in req:
+        yield "streak_days", req["streak_days"]
+
+
+class RequirementIndex: # requirements grouped by workout type, sorted by threshold per metric
+    def __init__(self, requirements: Dict[str, Dict]):
+        grouped = {}
+        self.windows = set()  # rolling window sizes (days) some requirement reads
+        for story_id, req in requirements.items():
+            if req.get("window_days"):
+                self.windows.add(req["window_days"])
+            for metric, threshold in requirement_metrics(req):
+                grouped.setdefault(req["type"], {}).setdefault(metric, []).append((threshold, story_id))
+
+        # {type: {metric: (sorted thresholds, story ids in the same order)}}
+        self.by_type = {}
+        for workout_type, metrics in grouped.items():
+            self.by_type[workout_type] = {}
+            for metric, entries in metrics.items():
+                entries.sort()
+                self.by_type[workout_type][metric] = ([t for t, _ in entries], [s for _, s in entries])
+
+    def crossed(self, workout_type: str, metric: str, low: Optional[float], high: float) -> List[str]: # stories with low < threshold <= high
+        table = self.by_type.get(workout_type, {}).get(metric)
+        if table is None:
+            return []
+        thresholds, story_ids = table
+        start = 0 if low is None else bisect_right(thresholds, low)
+        end = bisect_right(thresholds, high)
+        return story_ids[start:end]
+
+    def approaching(self, workout_type: str, metric: str, value: float, fraction: float) -> List[str]: # stories with value < threshold <= value / fraction
+        table = self.by_type.get(workout_type, {}).get(metric)
+        if table is None or value <= 0:
+            return []
+        thresholds, story_ids = table
+        return story_ids[bisect_right(thresholds, value):bisect_right(thresholds, value / fraction)]
+
+
+class UserState: # lookups derived from one stored progress record
+    __slots__ = ("record", "unlocked", "dedup", "rollups", "index")
+
+    def __init__(self, record: Dict, index: RequirementIndex):
+        self.record = record
+        self.unlocked = set(record["unlocked_stories"])  # mirrors "unlocked_stories"
+        self.dedup = WorkoutDedupIndex.from_dict(record.get("_dedup"))
+        self.rollups = {  # workout type -> DailyRollup
+            workout_type: DailyRollup.from_dict(data, index.windows)
+            for workout_type, data in record.get("_rollups", {}).items()
+        }
+        self.index = index  # catalogue the rollups track windows for
+
+    def use_index(self, index: RequirementIndex): # catalogue reloaded: track its windows too, keeping unsaved changes
+        for rollup in self.rollups.values():
+            rollup.ensure_windows(index.windows)
+        self.index = index
+
+
+class EngineShard: # one partition of the users: its lock serializes their updates, other shards run in parallel
+    __slots__ = ("lock", "states")
 
-class GameEngine:
     def __init__(self):
-        self.user_progress = {}  # user sports data from 'Health' app
+        self.lock = threading.Lock()
+        self.states = {}  # type: Dict[str, UserState]  # user_id -> UserState, rebuilt when the store hands back a different record
+
+
+class GameEngine:
+    def __init__(self, store: Optional[ProgressStore] = None, near_fraction: float = 0.8, shards: int = 64,
+                 event_log: Optional[WorkoutEventLog] = None, requirements_file: Optional[str] = None):
+        """
+        Args:
+            store: where progress records live (in-process dict by default)
+            near_fraction: share of a requirement that triggers on_near_unlock (0 turns it off)
+            shards: user partitions, each with its own lock; calls for one user are linearizable
+            event_log: optional log of every accepted workout; records can be rebuilt from it (see recover())
+            requirements_file: unlock catalogue (requirements.json next to this module by default)
+        """
+        self.store = store or MemoryProgressStore()  # user sports data from 'Health' app
+        self.event_log = event_log
+        self.requirements_file = str(requirements_file or DEFAULT_REQUIREMENTS_FILE)
+        self.aggregates = AggregateTable()  # best values of every user as columns, for backfills
+        self.aggregates.complete = not self.store.user_ids()
+        self.last_backfill = None  # type: Optional[Dict]
+        self._backfill_lock = threading.Lock()
+        self._backfills_lock = threading.Lock()  # guards the three fields below
+        self._backfills_pending = 0  # started by start_backfill() and not finished yet
+        self._backfill_target = None  # type: Optional[str]  # requirements_version once those have finished
+        self._backfill_failed = False  # one of them raised: unlocks_version stays behind (recover() backfills again)
+        self.shards = [EngineShard() for _ in range(max(1, shards))]
+        self.near_fraction = near_fraction  # share of a requirement that counts as "about to unlock"
+        self.on_near_unlock = None  # optional callable(user_id, story_ids), e.g. PregenScheduler.schedule
+        self.on_unlock = None  # optional callable(user_id, story_ids) for newly unlocked stories (workouts and backfills)
         self.setup_requirements()
+        self.unlocks_version = self.requirements_version  # catalogue every record's unlocks are complete for
     
-    def setup_requirements(self): # define unlock requrement
-        self.requirements = {
-            "story_1": {"type": "running", "distance": 1*1e3}, 
-            "story_2": {"type": "running", "duration": 1*1e3},  
-            "story_3": {"type": "running", "distance": 1.2*1e3},   
-            "story_4": {"type": "running", "duration": 1.2*1e3},  
-        }
+    def setup_requirements(self): # load unlock requirements from the catalogue file
+        self.catalogue_version, requirements = load_catalogue(self.requirements_file)
+        self._set_requirements(requirements)
+    
+    def _set_requirements(self, requirements: Dict[str, Dict]):
+        self.requirement_index = RequirementIndex(requirements)  # first: workouts unlock through the index
+        self.requirements = requirements
+        catalogue = json.dumps(requirements, sort_keys=True, separators=(",", ":"))
+        self.requirements_version = hashlib.sha256(catalogue.encode()).hexdigest()[:16]  # changes with the catalogue only
+    
+    def reload_requirements(self) -> List[str]:
+        """
+        Re-read the catalogue file and swap it in if it changed
+
+        Users who already meet a new or changed requirement are granted it by a
+        backfill on a background thread, so this returns right away.
+        Raises ValueError/OSError on an unreadable catalogue (the current one stays).
+        
+        Returns:
+            ids of the new or changed stories
+        """
+        version, requirements = load_catalogue(self.requirements_file)
+        old = self.requirements
+        changed = [story_id for story_id, req in requirements.items() if old.get(story_id) != req]
+        if not changed and requirements.keys() == old.keys():
+            return []
+        self.catalogue_version = version
+        self._set_requirements(requirements)
+        log.info("requirements catalogue reloaded", extra={"fields": {
+            "version": version, "requirements_version": self.requirements_version, "changed": changed}})
+        if changed:
+            self.start_backfill(changed)
+        return changed
     
     ##### TODO: get recent data for story generation
     ##### TODO: get live data for story generation - motivation
     
-    def process_workout(self, user_id: str, workout_type: str, distance: float, duration: int): # get historical data for story generation
-        if user_id not in self.user_progress:
-            self.user_progress[user_id] = {
+    def _shard(self, user_id: str) -> EngineShard:
+        return self.shards[zlib.crc32(str(user_id).encode('utf-8')) % len(self.shards)]
+    
+    @traced("engine.process_workout")
+    def process_workout(self, user_id: str, workout_type: str, distance: float, duration: int,
+                        workout_id: Optional[str] = None, timestamp: Optional[float] = None): # get historical data for story generation
+        workout = {"type": workout_type, "distance": distance, "duration": duration, "id": workout_id, "timestamp": timestamp}
+        with self._shard(user_id).lock, self.store.transaction():  # no other worker writes this user in between
+            user = self._load_user(user_id)
+            newly_unlocked = self._apply_workout(user_id, user, workout)
+            if newly_unlocked is None:
+                return {
+                    "newly_unlocked": [],
+                    "duplicate": True,
+                    "total_progress": self.public_progress(user)
+                }
+            
+            near = self._near_unlocks(user, workout_type)
+            self._log_workouts(user_id, user, [workout])
+            self._save_user(user_id, user)
+            result = {
+                "newly_unlocked": newly_unlocked,
+                "total_progress": self.public_progress(user)
+            }
+        self._notify_unlock(user_id, newly_unlocked)  # the hooks may queue work; never call them holding a shard lock
+        self._notify_near(user_id, near)
+        return result
+    
+    @traced("engine.process_workouts")
+    def process_workouts(self, user_id: str, workouts: List[Dict]): # apply a backfill in one pass with a single store write
+        newly_unlocked = []
+        errors = []
+        duplicates = []
+        near = []
+        accepted = []
+        parsed = []
+        for index, workout in enumerate(workouts):
+            try:
+                parsed.append((index, self.parse_workout(workout)))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        
+        with self._shard(user_id).lock, self.store.transaction():
+            user = self._load_user(user_id)
+            for index, workout in parsed:
+                unlocked = self._apply_workout(user_id, user, workout)
+                if unlocked is None:
+                    duplicates.append(index)
+                    continue
+                newly_unlocked.extend(unlocked)
+                near.extend(self._near_unlocks(user, workout["type"]))
+                accepted.append(workout)
+            if accepted:
+                self._log_workouts(user_id, user, accepted)
+                self._save_user(user_id, user)
+            total_progress = self.public_progress(user)
+        
+        if accepted:
+            self._notify_unlock(user_id, newly_unlocked)
+            self._notify_near(user_id, near)
+        return {
+            "newly_unlocked": newly_unlocked,
+            "accepted": len(accepted),
+            "duplicates": duplicates,
+            "errors": errors,
+            "total_progress": total_progress
+        }
+    
+    @staticmethod
+    def parse_workout(workout) -> Dict: # validate one workout payload into type/distance/duration/id/timestamp
+        if not isinstance(workout, dict):
+            raise ValueError("workout must be an object")
+        workout_type = workout.get("type")
+        if not isinstance(workout_type, str) or not workout_type:
+            raise ValueError("missing workout type")
+        distance = workout.get("distance", 0)
+        duration = workout.get("duration", 0)
+        for field, value in (("distance", distance), ("duration", duration)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+                raise ValueError(f"invalid {field}: {value!r}")
+        workout_id = workout.get("id")
+        if workout_id is not None and (not isinstance(workout_id, str) or not workout_id):
+            raise ValueError(f"invalid id: {workout_id!r}")
+        timestamp = workout.get("timestamp")  # unix seconds of the workout, defaults to now
+        if timestamp is not None:
+            if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp):
+                raise ValueError(f"invalid timestamp: {timestamp!r}")
+            # a far-future day would move the rollups ahead and expire every real workout after it
+            # (milliseconds since the epoch are the usual culprit)
+            if timestamp < 0 or timestamp > time.time() + MAX_FUTURE_SECONDS:
+                raise ValueError(f"timestamp out of range: {timestamp!r} (unix seconds, not in the future)")
+        return {"type": workout_type, "distance": distance, "duration": duration, "id": workout_id, "timestamp": timestamp}
+    
+    def _load_user(self, user_id: str) -> Dict:
+        user = self.store.get(user_id)
+        if user is None:
+            user = {
                 "total_distance": 0,
                 "total_duration": 0,
                 "unlocked_stories": [],
-                "current_progress": {}
+                "current_progress": {},
+                "_epoch": uuid.uuid4().hex[:8],  # new record, new version namespace (a reset never reuses ETags)
+                "_version": 0
             }
+        return user
+    
+    def _save_user(self, user_id: str, user: Dict):
+        state = self._state(user_id, user)
+        user["_dedup"] = state.dedup.to_dict()
+        user["_rollups"] = {workout_type: rollup.to_dict() for workout_type, rollup in state.rollups.items()}
+        user["_version"] = user.get("_version", 0) + 1
+        self.store.put(user_id, user)
+        self.aggregates.update(user_id, user["current_progress"])
+    
+    @staticmethod
+    def public_progress(user: Dict) -> Dict: # snapshot of the record without engine-internal "_" fields (safe to use after the lock is released)
+        progress = {key: value for key, value in user.items() if not key.startswith("_")}
+        progress["unlocked_stories"] = list(user["unlocked_stories"])
+        progress["current_progress"] = {t: dict(best) for t, best in user["current_progress"].items()}
+        return progress
+    
+    def _apply_workout(self, user_id: str, user: Dict, workout: Dict) -> Optional[List[str]]: # None when the workout id was already applied
+        state = self._state(user_id, user)
+        workout_type, distance, duration = workout["type"], workout["distance"], workout["duration"]
+        timestamp = workout.get("timestamp")
+        if timestamp is None:
+            timestamp = time.time()
+        day = day_number(timestamp)  # anything that can fail runs before the record is touched
+        total_distance, total_duration = user["total_distance"] + distance, user["total_duration"] + duration
+
+        workout_id = workout.get("id")
+        if workout_id is not None:
+            if state.dedup.seen(workout_id):
+                return None
+            state.dedup.add(workout_id, timestamp)
+
+        workout["timestamp"] = timestamp  # pinned, so the event log replays it into the same day
+        user["total_distance"] = total_distance
+        user["total_duration"] = total_duration
+
+        rollup = state.rollups.get(workout_type)
+        if rollup is None:
+            rollup = state.rollups[workout_type] = DailyRollup(state.index.windows)
+        rollup.add(day, distance, duration)
         
-        user = self.user_progress[user_id]
-        user["total_distance"] += distance
-        user["total_duration"] += duration
+        values = [("distance", distance), ("duration", duration), ("streak_days", rollup.streak)]
+        for window in state.index.windows:
+            sums = rollup.window_sums[window]
+            values.append((f"distance_{window}d", sums[0]))
+            values.append((f"duration_{window}d", sums[1]))
         
-        # check lockable stories
+        # best value seen per type/metric; thresholds at or below it were already crossed
+        best = user["current_progress"].setdefault(workout_type, {})
+        unlocked = state.unlocked
+
+        # check lockable stories: only thresholds newly crossed by this workout
         newly_unlocked = []
-        for story_id, req in self.requirements.items():
-            if story_id in user["unlocked_stories"]:
+        for metric, value in values:
+            previous = best.get(metric)
+            if previous is not None and value <= previous:
                 continue
-                
-            if self.check_requirement(req, workout_type, distance, duration):
-                user["unlocked_stories"].append(story_id)
-                newly_unlocked.append(story_id)
-        
-        return {
-            "newly_unlocked": newly_unlocked,
-            "total_progress": user
-        }
+            for story_id in state.index.crossed(workout_type, metric, previous, value):
+                if story_id not in unlocked:
+                    unlocked.add(story_id)
+                    user["unlocked_stories"].append(story_id)
+                    newly_unlocked.append(story_id)
+            best[metric] = value
+        return newly_unlocked
     
-    def check_requirement(self, req, workout_type, distance, duration): # check if required
-        if req["type"] != workout_type:
-            return False
+    def _near_unlocks(self, user: Dict, workout_type: str) -> List[str]: # locked stories of this type newly within near_fraction
+        if self.near_fraction <= 0:  # near-unlock detection turned off
+            return []
+        best = user["current_progress"].get(workout_type, {})
+        notified = user.setdefault("_near", [])
+        near = []
+        for metric, value in best.items():
+            for story_id in self.requirement_index.approaching(workout_type, metric, value, self.near_fraction):
+                if story_id not in notified and story_id not in user["unlocked_stories"]:
+                    notified.append(story_id)
+                    near.append(story_id)
+        return near
+    
+    def _log_workouts(self, user_id: str, user: Dict, workouts: List[Dict]): # append accepted workouts to the event log (shard lock held)
+        if self.event_log is not None:
+            user["_seq"] = self.event_log.append(user_id, workouts)
+    
+    def _notify_near(self, user_id: str, story_ids: List[str]):
+        if story_ids and self.on_near_unlock is not None:
+            try:
+                self.on_near_unlock(user_id, story_ids)
+            except Exception as e:
+                log.error("near-unlock hook failed", extra={"fields": {"user_id": user_id, "error": str(e)}})
+    
+    def _notify_unlock(self, user_id: str, story_ids: List[str]):
+        if story_ids and self.on_unlock is not None:
+            try:
+                self.on_unlock(user_id, story_ids)
+            except Exception as e:
+                log.error("unlock hook failed", extra={"fields": {"user_id": user_id, "error": str(e)}})
+    
+    def _state(self, user_id: str, user: Dict) -> UserState: # call with the user's shard lock held
+        states = self._shard(user_id).states
+        state = states.get(user_id)
+        index = self.requirement_index
+        if state is None or state.record is not user:
+            state = UserState(user, index)
+            states[user_id] = state
+        elif state.index is not index:
+            state.use_index(index)
+        return state
+
+    def content_version(self, user_id: str) -> str: # changes whenever get_available_content() would change
+        with self._shard(user_id).lock:
+            user = self.store.get(user_id)
+            if user is None:
+                return f"none.{self.requirements_version}"
+            epoch, version = user.get('_epoch', ''), user.get('_version', 0)
+        today = day_number(time.time())  # rolling windows and streaks move with the calendar
+        return f"{epoch}.{version}.{today}.{self.requirements_version}"
+    
+    def get_progress(self, user_id: str) -> Optional[Dict]:
+        with self._shard(user_id).lock:
+            user = self.store.get(user_id)
+            return self.public_progress(user) if user is not None else None
+
+    def reset_progress(self, user_id: str):
+        shard = self._shard(user_id)
+        with shard.lock, self.store.transaction():
+            if self.event_log is not None:
+                self.event_log.append_reset(user_id)
+            self.store.delete(user_id)
+            shard.states.pop(user_id, None)
+            self.aggregates.clear(user_id)
+    
+    def workout_events(self, user_id: str) -> List[Dict]: # audit trail: every logged event of one user, oldest first
+        return list(self.event_log.events(user_id=user_id)) if self.event_log is not None else []
+    
+    def snapshot(self) -> Dict:
+        """
+        Snapshot every record into the event log; safe while requests are served (each record is read under its shard lock)
+
+        The header names unlocks_version, not the current catalogue: while a backfill is still
+        granting, some records lack its unlocks, and recover() must backfill again.
+        """
+        def records():
+            for user_id in self.store.user_ids():
+                with self._shard(user_id).lock:
+                    user = self.store.get(user_id)
+                    data = json.dumps(user, ensure_ascii=False) if user is not None else None
+                if data is not None:
+                    yield user_id, data
+        return self.event_log.write_snapshot(records(), self.unlocks_version)
+    
+    def recover(self, rebuild: bool = False) -> Dict:
+        """
+        Bring progress records up to date with the event log; call once at startup, before serving
+
+        Loads the latest snapshot, then replays the log after it. Events a record already
+        contains (its "_seq" is at or past them) are skipped, so records that were persisted
+        elsewhere (SQLite store) or snapshotted while being written are not counted twice.
+        A snapshot taken under another catalogue starts a background unlock backfill.
         
-        if "distance" in req and distance >= req["distance"]:
-            return True
-        if "duration" in req and duration >= req["duration"]:
-            return True
+        Args:
+            rebuild: drop every record and replay the whole log instead, e.g. to re-derive unlocks
+                under a changed requirements catalogue (only correct if the log holds the full history)
+        Returns:
+            {"snapshot_users", "snapshot_seconds", "replayed", "skipped", "seconds"}
+        """
+        collecting = gc.isenabled()
+        gc.disable()  # the replay allocates many long-lived objects; collections meanwhile would only rescan them
+        try:
+            return self._recover(rebuild)
+        finally:
+            if collecting:
+                gc.enable()
+    
+    def _recover(self, rebuild: bool) -> Dict:
+        started = time.perf_counter()
+        header = {} if rebuild else self.event_log.snapshot_header()
+        if rebuild:
+            for user_id in self.store.user_ids():
+                self.store.delete(user_id)
+            self.aggregates = AggregateTable()
+        for shard in self.shards:
+            shard.states.clear()
+
+        loaded = 0
+        if header:
+            for user_id, data in self.event_log.snapshot_records():
+                current = self.store.get(user_id)
+                if current is not None and current.get("_seq", 0) >= json.loads(data).get("_seq", 0):
+                    continue  # the store is already newer (SQLite records outlive the process too)
+                self.store.put_encoded(user_id, data)  # decoded on first access, not here
+                loaded += 1
+        snapshot_seconds = time.perf_counter() - started
+
+        touched = {}  # user_id -> record changed by the replay, saved once at the end
+        replayed = skipped = 0
+        for event in self.event_log.events(header.get("offset", 0)):
+            user_id = event["u"]
+            user = touched[user_id] if user_id in touched else self.store.get(user_id)
+            if user is not None and user.get("_seq", 0) >= event["n"]:
+                skipped += 1
+                continue
+            replayed += 1
+            if event.get("reset"):
+                touched.pop(user_id, None)
+                self.store.delete(user_id)
+                self._shard(user_id).states.pop(user_id, None)
+                continue
+            if user is None:
+                user = self._load_user(user_id)
+            workout_type, distance, duration, workout_id, timestamp = event["w"]
+            self._apply_workout(user_id, user, {"type": workout_type, "distance": distance, "duration": duration,
+                                                "id": workout_id, "timestamp": timestamp})
+            user["_seq"] = event["n"]
+            touched[user_id] = user
+        for user_id, user in touched.items():
+            self._save_user(user_id, user)
+
+        self.aggregates.complete = len(self.aggregates.rows) >= len(self.store.user_ids())
+
+        result = {"snapshot_users": loaded, "snapshot_seconds": round(snapshot_seconds, 3), "replayed": replayed,
+                  "skipped": skipped, "seconds": round(time.perf_counter() - started, 3)}
+        log.info("progress recovered from workout log", extra={"fields": result})
+        self.unlocks_version = header.get("requirements_version", self.requirements_version)
+        if self.unlocks_version != self.requirements_version:
+            self.start_backfill()  # the snapshot's unlocks were evaluated against another catalogue
+        return result
+    
+    def start_backfill(self, story_ids: Optional[List[str]] = None) -> threading.Thread:
+        """Run backfill_unlocks() on a background thread; unlocks_version moves to the current catalogue once every started backfill is done"""
+        with self._backfills_lock:
+            self._backfills_pending += 1
+            self._backfill_target = self.requirements_version
+        thread = threading.Thread(target=self._run_backfill, args=(story_ids,), name="unlock-backfill", daemon=True)
+        thread.start()
+        return thread
+    
+    def _run_backfill(self, story_ids: Optional[List[str]]):
+        completed = False
+        try:
+            self.backfill_unlocks(story_ids)
+            completed = True
+        finally:
+            with self._backfills_lock:
+                self._backfills_pending -= 1
+                self._backfill_failed = self._backfill_failed or not completed
+                if self._backfills_pending == 0:
+                    if not self._backfill_failed:
+                        self.unlocks_version = self._backfill_target
+                    self._backfill_failed = False
+    
+    def backfill_unlocks(self, story_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Grant stories to every user who already meets their requirement
+
+        Each requirement threshold is compared against its aggregate column for all
+        users at once; only the matching users are then visited (under their shard
+        lock, re-checking the record) to record the unlock. Requests keep being served
+        meanwhile. Windows that no requirement tracked before only count from now on.
         
-        return False
+        Args:
+            story_ids: stories to check (default: the whole catalogue)
+        Returns:
+            {"stories", "candidates", "users", "granted", "scan_seconds", "evaluate_seconds", "grant_seconds"}
+        """
+        with self._backfill_lock:  # reloads in quick succession backfill one after another
+            started = time.perf_counter()
+            if not self.aggregates.complete:
+                self._scan_aggregates()
+            scanned = time.perf_counter()
+
+            requirements = self.requirements
+            story_ids = [s for s in (story_ids or list(requirements)) if s in requirements]
+            rows, stories = [], []
+            for i, story_id in enumerate(story_ids):
+                req = requirements[story_id]
+                for metric, threshold in requirement_metrics(req):
+                    matched = self.aggregates.matching(req["type"], metric, threshold)
+                    rows.append(matched)
+                    stories.append(np.full(len(matched), i, dtype=np.int64))
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+            stories = np.concatenate(stories) if stories else np.empty(0, dtype=np.int64)
+            order = np.lexsort((stories, rows))  # grouped by user
+            rows, stories = rows[order].tolist(), stories[order].tolist()
+            evaluated = time.perf_counter()
+
+            user_ids = self.aggregates.user_ids
+            granted = users = visited = 0
+            start = 0
+            while start < len(rows):
+                end = start
+                while end < len(rows) and rows[end] == rows[start]:
+                    end += 1
+                user_id = user_ids[rows[start]]
+                new = self._grant(user_id, [story_ids[i] for i in sorted(set(stories[start:end]))])
+                self._notify_unlock(user_id, new)
+                granted += len(new)
+                users += bool(new)
+                start = end
+                visited += 1
+                if visited % 1000 == 0:
+                    time.sleep(0)  # let request threads have the GIL
+            finished = time.perf_counter()
+
+        self.last_backfill = {"stories": len(story_ids), "candidates": len(rows), "users": users, "granted": granted,
+                              "scan_seconds": round(scanned - started, 3), "evaluate_seconds": round(evaluated - scanned, 3),
+                              "grant_seconds": round(finished - evaluated, 3)}
+        log.info("unlock backfill finished", extra={"fields": self.last_backfill})
+        return self.last_backfill
+    
+    def _scan_aggregates(self): # fill the aggregate columns from every stored record (after a restart)
+        for user_id in self.store.user_ids():
+            with self._shard(user_id).lock:
+                user = self.store.get(user_id)
+                if user is not None:
+                    self.aggregates.update(user_id, user["current_progress"])
+        self.aggregates.complete = True
     
+    def _grant(self, user_id: str, story_ids: List[str]) -> List[str]: # unlock stories the user's record still qualifies for
+        with self._shard(user_id).lock, self.store.transaction():
+            user = self.store.get(user_id)
+            if user is None:
+                return []
+            state = self._state(user_id, user)
+            new = []
+            for story_id in story_ids:
+                req = self.requirements.get(story_id)
+                if story_id in state.unlocked or req is None:
+                    continue
+                best = user["current_progress"].get(req["type"], {})
+                if any(best.get(metric, -1) >= threshold for metric, threshold in requirement_metrics(req)):
+                    state.unlocked.add(story_id)
+                    user["unlocked_stories"].append(story_id)
+                    new.append(story_id)
+            if new:
+                self._save_user(user_id, user)
+        return new
+    
+    @traced("engine.get_available_content")
     def get_available_content(self, user_id): # get user's unlocked stories
-        if user_id not in self.user_progress:
-            return {"unlocked_stories": [], "locked_stories": list(self.requirements.keys())}
-        
-        user = self.user_progress[user_id]
-        locked = [s for s in self.requirements.keys() if s not in user["unlocked_stories"]]
+        with self._shard(user_id).lock:
+            user = self.store.get(user_id)
+            if user is None:
+                return {"unlocked_stories": [], "locked_stories": list(self.requirements.keys()), "windows": {}}
+            
+            state = self._state(user_id, user)
+            locked = [s for s in self.requirements.keys() if s not in state.unlocked]
+            
+            today = day_number(time.time())
+            windows = {}
+            for workout_type, rollup in state.rollups.items():
+                windows[workout_type] = {f"{w}d": rollup.window(w, today) for w in state.index.windows}
+                windows[workout_type]["streak_days"] = rollup.current_streak(today)
+            unlocked_stories = list(user["unlocked_stories"])
         
         return {
-            "unlocked_stories": user["unlocked_stories"],
+            "unlocked_stories": unlocked_stories,
             "locked_stories": locked,
-            "requirements": self.requirements
+            "windows": windows  # the requirements catalogue is served separately (/api/requirements)
         }
\ No newline at end of file
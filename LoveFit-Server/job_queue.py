@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+log = logging.getLogger("lovefit.jobs")
+
+JOB_DURATION = REGISTRY.histogram("lovefit_job_duration_seconds", "Job run time by kind and final status",
+                                  ("kind", "status"))
+
+PRIORITY_INTERACTIVE = 10  # user is waiting on the result (chat, story turns)
+PRIORITY_BACKGROUND = 0  # summaries, pre-generation
+
+TERMINAL = ("done", "failed", "cancelled")
+
+
+class Job: # handle passed to job handlers
+    __slots__ = ("id", "kind", "payload", "priority", "_queue", "_checked", "_cancelled")
+
+    def __init__(self, queue: "JobQueue", job_id: str, kind: str, payload: Dict, priority: int):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self._queue = queue
+        self._checked = 0.0
+        self._cancelled = False
+
+    def cancelled(self) -> bool:
+        """True once cancel() was called; long handlers check this between steps (e.g. per token)"""
+        if not self._cancelled and self.id in self._queue.cancel_requested:
+            self._cancelled = True
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked > 0.5:  # another process may have cancelled it
+            self._checked = now
+            self._cancelled = self._queue.cancel_flag(self.id)
+        return self._cancelled
+
+
+class JobQueue:
+    """
+    SQLite-backed priority job queue with an in-process worker pool
+
+    Jobs survive restarts and can be shared by several server processes using
+    the same database file (claims are atomic). Handlers are registered per job
+    kind and receive a Job; their return value is stored as the JSON result.
+    Interactive jobs always run first, and background jobs never take more than
+    `max_background` workers and only start while `background_gate()` allows it
+    (e.g. the LLM backend is idle), so a backlog of background work cannot delay
+    a user who is waiting on a reply.
+    """
+
+    _CREATE = """CREATE TABLE IF NOT EXISTS jobs (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT UNIQUE NOT NULL,
+        kind TEXT NOT NULL,
+        owner TEXT,
+        priority INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        cancel INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL
+    )"""
+    _INDEX = "CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, priority DESC, seq)"
+    _INSERT = ("INSERT INTO jobs (id, kind, owner, priority, payload, status, created) "
+               "VALUES (?, ?, ?, ?, ?, 'queued', ?)")
+    _NEXT = ("SELECT id, kind, payload, priority FROM jobs WHERE status = 'queued' AND priority >= ? "
+             "ORDER BY priority DESC, seq LIMIT 1")
+    _CLAIM = "UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'"
+    _FINISH = "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?"
+    _SELECT = ("SELECT id, kind, owner, priority, status, result, error, created, started, finished "
+               "FROM jobs WHERE id = ?")
+
+    def __init__(self, path: str = ":memory:", workers: int = 4, max_background: Optional[int] = None,
+                 background_gate: Optional[Callable[[], bool]] = None, poll_interval: float = 0.5,
+                 retention: float = 3600.0, stale_after: float = 900.0):
+        """
+        Args:
+            path: SQLite database file (":memory:" keeps jobs in this process only)
+            workers: worker threads in this process
+            max_background: workers that may run background jobs at once (default: workers - 1)
+            background_gate: called before starting a background job; False defers it
+            poll_interval: how often idle workers look for jobs queued by other processes
+            retention: seconds finished jobs stay queryable
+            stale_after: running jobs older than this at startup are re-queued (crashed worker)
+        """
+        self.path = path
+        self.workers = workers
+        self.max_background = max(1, workers - 1) if max_background is None else max_background
+        self.background_gate = background_gate
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.handlers = {}  # type: Dict[str, Callable[[Job], object]]
+        self.cancel_requested = set()  # job ids cancelled in this process while running
+        self.running_background = 0
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._threads = []  # type: List[threading.Thread]
+        self._closed = False
+        self._last_prune = 0.0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self._CREATE)
+        self.conn.execute(self._INDEX)
+        self.conn.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running' AND started < ?",
+                          (time.time() - stale_after,))
+
+    def register(self, kind: str, handler: Callable[[Job], object]):
+        self.handlers[kind] = handler
+
+    def start(self):
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind: str, payload: Dict, priority: int = PRIORITY_BACKGROUND,
+               owner: Optional[str] = None) -> str:
+        """Queue a job and return its id"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._db_lock:
+            self.conn.execute(self._INSERT, (job_id, kind, owner, priority,
+                                             json.dumps(payload, ensure_ascii=False), time.time()))
+        with self._cond:
+            self._cond.notify_all()  # idle workers and long-poll waiters share the condition
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._db_lock:
+            row = self.conn.execute(self._SELECT, (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "owner", "priority", "status", "result", "error", "created", "started", "finished")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def wait(self, job_id: str, timeout: float = 30.0) -> Optional[Dict]:
+        """Block until the job finishes or `timeout` passes (long polling); returns its current state"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in TERMINAL or remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(remaining, self.poll_interval))
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job now, or ask a running one to stop; False if it already finished"""
+        with self._db_lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id))
+            if cursor.rowcount:
+                cancelled = True
+            else:
+                cursor = self.conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'", (job_id,))
+                cancelled = bool(cursor.rowcount)
+                if cancelled:
+                    self.cancel_requested.add(job_id)
+        with self._cond:
+            self._cond.notify_all()
+        return cancelled
+
+    def cancel_flag(self, job_id: str) -> bool:
+        with self._db_lock:
+            row = self.conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _claim(self) -> Optional[Job]:
+        min_priority = PRIORITY_INTERACTIVE
+        with self._cond:
+            if self.running_background < self.max_background and \
+                    (self.background_gate is None or self.background_gate()):
+                min_priority = PRIORITY_BACKGROUND
+        with self._db_lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(self._NEXT, (min_priority,)).fetchone()
+                if row is not None:
+                    self.conn.execute(self._CLAIM, (time.time(), row[0]))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, kind, payload, priority = row
+        if priority < PRIORITY_INTERACTIVE:
+            with self._cond:
+                self.running_background += 1
+        return Job(self, job_id, kind, json.loads(payload), priority)
+
+    def _work(self):
+        while not self._closed:
+            job = self._claim()
+            if job is None:
+                self._prune()
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+            try:
+                self._run(job)
+            finally:
+                if job.priority < PRIORITY_INTERACTIVE:
+                    with self._cond:
+                        self.running_background -= 1
+                with self._cond:
+                    self._cond.notify_all()  # wake waiters and workers held back by the background limit
+
+    def _run(self, job: Job):
+        status, result, error = "done", None, None
+        started = time.perf_counter()
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise ValueError(f"No handler for job kind: {job.kind}")
+            result = json.dumps(handler(job), ensure_ascii=False)
+            if job.cancelled():
+                status = "cancelled"
+        except Exception as e:
+            status, error = "failed", str(e)
+            log.error("job failed", extra={"fields": {"kind": job.kind, "job_id": job.id, "error": str(e)}})
+        JOB_DURATION.observe(time.perf_counter() - started, kind=job.kind, status=status)
+        with self._db_lock:
+            self.conn.execute(self._FINISH, (status, result, error, time.time(), job.id))
+        self.cancel_requested.discard(job.id)
+
+    def _prune(self): # drop finished jobs past retention, at most once a minute
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        with self._db_lock:
+            self.conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+                              (now - self.retention,))
+
+    def stats(self) -> Dict:
+        with self._db_lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"jobs": dict(rows), "running_background": self.running_background, "workers": len(self._threads),
+                "pid": os.getpid()}
+
+    def close(self):
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
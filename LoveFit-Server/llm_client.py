@@ -0,0 +1,272 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import ollama
+
+from metrics import LLM_QUEUE_WAIT, LLM_REQUESTS, current_trace, observe_llm_response
+
+
+class LLMBusyError(RuntimeError): # raised instead of queueing past the backpressure limit
+    pass
+
+
+class _CallMetrics: # timing of one chat call, reported to metrics and the request trace when it ends
+    __slots__ = ("mode", "started", "first_token", "finished", "trace")
+
+    def __init__(self, mode: str, started: float):
+        self.mode = mode
+        self.started = started
+        self.first_token = None
+        self.finished = False
+        self.trace = current_trace()  # streams are consumed on other threads, so keep the request's trace
+
+    def chunk(self, chunk):
+        if self.first_token is None and chunk['message']['content']:
+            self.first_token = time.perf_counter()
+        if chunk.get('done'):
+            self.done(chunk)
+
+    def done(self, response):
+        if self.finished:
+            return
+        self.finished = True
+        observe_llm_response(response, self.mode, self.started, self.first_token)
+        if self.trace is not None:
+            attrs = {"tokens": response.get('eval_count')}
+            if self.first_token is not None:
+                attrs["ttft_ms"] = round((self.first_token - self.started) * 1e3, 3)
+            self.trace.add(f"llm.{self.mode}", self.started, time.perf_counter() - self.started, attrs)
+
+    def failed(self, outcome: str = "error"):
+        if not self.finished:
+            self.finished = True
+            LLM_REQUESTS.inc(mode=self.mode, outcome=outcome)
+
+
+class _SlotStream: # chunk iterator that hands its concurrency slot back exactly once
+    def __init__(self, chunks, release, call: _CallMetrics):
+        self.chunks = chunks
+        self._release = release
+        self.call = call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Dict:
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+        except BaseException:
+            self.call.failed()
+            self.close()
+            raise
+        self.call.chunk(chunk)
+        return chunk
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict:
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.close()
+            raise
+        except BaseException:
+            self.call.failed()
+            self.close()
+            raise
+        self.call.chunk(chunk)
+        return chunk
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            self.call.failed("cancelled")  # no-op when the final chunk was seen
+            release()
+
+    def __del__(self):
+        self.close()
+
+
+class LLMBackend:
+    """
+    Chat-completion backend shared by every AICharacter
+
+    chat()/achat() return the full response dict when stream=False and an
+    (async) iterator of chunks when stream=True, mirroring ollama.chat.
+    """
+
+    def chat(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        raise NotImplementedError
+
+    async def achat(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        raise NotImplementedError
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]: # one embedding vector per text
+        raise NotImplementedError
+
+    def idle(self) -> bool: # True when a generation could start right now without waiting
+        return True
+
+
+class OllamaBackend(LLMBackend):
+    def __init__(self, host: Optional[str] = None, max_concurrency: int = 2, max_queue: int = 16,
+                 timeout: float = 120.0, queue_timeout: float = 30.0,
+                 keep_alive: Optional[str] = "30m", options: Optional[Dict] = None):
+        """
+        Pooled Ollama client with a concurrency cap and a bounded wait queue
+
+        Args:
+            host: Ollama server URL (defaults to OLLAMA_HOST / localhost)
+            max_concurrency: generations allowed to run on the model at once
+            max_queue: callers allowed to wait for a slot before LLMBusyError
+            timeout: HTTP timeout for one generation
+            queue_timeout: max seconds a caller waits for a slot
+            keep_alive: how long Ollama keeps the model (and its prompt cache) loaded
+            options: sampling/context options sent with every call; keeping num_ctx
+                constant avoids model reloads that would drop the cached persona prefix
+        """
+        self.host = host
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self.client = ollama.Client(host=host, timeout=timeout)  # one keep-alive connection pool
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient (httpx pools are loop-bound)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._waiters = ThreadPoolExecutor(max_workers=max_queue, thread_name_prefix="llm-slot")  # async callers block here, not on the loop
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def idle(self) -> bool:
+        return self.waiting == 0 and self.in_flight < self.max_concurrency
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                raise LLMBusyError(f"LLM queue full ({self.waiting} waiting)")
+            self.waiting += 1
+
+    def _acquired(self, ok: bool):
+        with self._lock:
+            self.waiting -= 1
+            if ok:
+                self.in_flight += 1
+        if not ok:
+            raise LLMBusyError(f"no LLM slot within {self.queue_timeout}s")
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _try_acquire(self) -> bool: # fast path: a free slot needs no queue entry
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def _acquire(self):
+        if self._try_acquire():
+            return
+        self._enqueue()
+        self._acquired(self._slots.acquire(timeout=self.queue_timeout))
+
+    async def _aacquire(self):
+        if self._try_acquire():
+            return
+        self._enqueue()
+        pending = self._waiters.submit(self._slots.acquire, True, self.queue_timeout)
+        try:
+            ok = await asyncio.wrap_future(pending)
+        except asyncio.CancelledError:
+            # the waiter thread may still win a slot after we gave up; hand it straight back
+            pending.add_done_callback(lambda f: f.result() and self._slots.release())
+            with self._lock:
+                self.waiting -= 1
+            raise
+        self._acquired(ok)
+
+    def _with_defaults(self, kwargs: Dict) -> Dict: # pin keep_alive/options so consecutive turns hit a warm cache
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+        if self.options:
+            kwargs["options"] = {**self.options, **(kwargs.get("options") or {})}
+        return kwargs
+
+    def chat(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        kwargs = self._with_defaults(kwargs)
+        queued = time.perf_counter()
+        self._acquire()
+        call = _CallMetrics("stream" if stream else "chat", time.perf_counter())
+        LLM_QUEUE_WAIT.observe(call.started - queued)
+        try:
+            response = self.client.chat(model=model, messages=messages, stream=stream, **kwargs)
+        except BaseException:
+            call.failed()
+            self._release()
+            raise
+        if stream:
+            return _SlotStream(iter(response), self._release, call)  # slot held until the stream ends or is dropped
+        self._release()
+        call.done(response)
+        return response
+
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        # embeddings are short and cheap, so they skip the generation slots
+        return self.client.embed(model=model, input=texts, keep_alive=self.keep_alive)['embeddings']
+
+    def _async_client(self) -> "ollama.AsyncClient":
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = ollama.AsyncClient(host=self.host, timeout=self.timeout)
+        return client
+
+    async def achat(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        kwargs = self._with_defaults(kwargs)
+        queued = time.perf_counter()
+        await self._aacquire()
+        call = _CallMetrics("stream" if stream else "chat", time.perf_counter())
+        LLM_QUEUE_WAIT.observe(call.started - queued)
+        try:
+            response = await self._async_client().chat(model=model, messages=messages, stream=stream, **kwargs)
+        except BaseException:
+            call.failed()
+            self._release()
+            raise
+        if stream:
+            return _SlotStream(response, self._release, call)
+        self._release()
+        call.done(response)
+        return response
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def default_backend() -> LLMBackend: # process-wide backend, configured from the environment
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = OllamaBackend(
+                host=os.environ.get("OLLAMA_HOST"),
+                max_concurrency=int(os.environ.get("LOVEFIT_LLM_CONCURRENCY", "2")),
+                max_queue=int(os.environ.get("LOVEFIT_LLM_QUEUE", "16")),
+                keep_alive=os.environ.get("LOVEFIT_LLM_KEEP_ALIVE", "30m"),
+                options={"num_ctx": int(os.environ.get("LOVEFIT_LLM_NUM_CTX", "8192"))},
+            )
+        return _default_backend
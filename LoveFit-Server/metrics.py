@@ -0,0 +1,440 @@
+# Observability without extra dependencies: Prometheus metrics, per-request trace spans,
+# a sampling profiler and structured (JSON) logging for the "lovefit.*" loggers.
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}  # label values -> value (or histogram state)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Current value; with `fn` it is read at scrape time (fn returns a number or {label values: number})"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), fn: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                return []  # a broken source must not break the scrape
+            with self._lock:
+                self._values = value if isinstance(value, dict) else {(): value}
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        slot = bisect_left(self.buckets, value)  # first bucket with value <= bound
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][slot] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text exposition format (GET /metrics)"""
+
+    def __init__(self):
+        self.metrics = {}  # type: Dict[str, Metric]
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:  # module reloaded: keep the live series
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), fn: Optional[Callable] = None) -> Gauge:
+        gauge = self.register(Gauge(name, help, labels, fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_LATENCY = REGISTRY.histogram("lovefit_http_request_duration_seconds",
+                                  "HTTP request latency until the response is fully sent",
+                                  ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("lovefit_http_requests_in_flight", "HTTP requests being served")
+LLM_REQUESTS = REGISTRY.counter("lovefit_llm_requests_total", "Model calls by mode and outcome", ("mode", "outcome"))
+LLM_QUEUE_WAIT = REGISTRY.histogram("lovefit_llm_queue_wait_seconds", "Time spent waiting for a generation slot")
+LLM_TTFT = REGISTRY.histogram("lovefit_llm_time_to_first_token_seconds",
+                              "Time from sending a chat request to the first content token", ("mode",))
+LLM_DURATION = REGISTRY.histogram("lovefit_llm_generation_seconds", "Wall time of a whole chat call", ("mode",))
+LLM_PROMPT_TOKENS = REGISTRY.counter("lovefit_llm_prompt_tokens_total", "Prompt tokens evaluated by the model")
+LLM_GENERATED_TOKENS = REGISTRY.counter("lovefit_llm_generated_tokens_total", "Tokens generated by the model")
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram("lovefit_llm_tokens_per_second", "Generation speed reported by the model",
+                                           buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500))
+PERSIST_WRITE = REGISTRY.histogram("lovefit_persist_write_seconds", "Durable write latency by target", ("target",))
+CACHE_LOOKUPS = REGISTRY.counter("lovefit_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+def observe_llm_response(response, mode: str, started: float, first_token: Optional[float]):
+    """Record one finished chat call; `response` is the final (done) chunk or the whole reply"""
+    get = getattr(response, "get", None)
+    stats = {k: get(k) for k in ("prompt_eval_count", "eval_count", "eval_duration")} if get else {}
+    if first_token is not None:
+        LLM_TTFT.observe(first_token - started, mode=mode)
+    LLM_DURATION.observe(time.perf_counter() - started, mode=mode)
+    LLM_REQUESTS.inc(mode=mode, outcome="ok")
+    if stats.get("prompt_eval_count"):
+        LLM_PROMPT_TOKENS.inc(stats["prompt_eval_count"])
+    if stats.get("eval_count"):
+        LLM_GENERATED_TOKENS.inc(stats["eval_count"])
+        if stats.get("eval_duration"):
+            LLM_TOKENS_PER_SECOND.observe(stats["eval_count"] / (stats["eval_duration"] / 1e9))
+
+
+##### tracing: per-request spans, enabled by the X-Trace header or LOVEFIT_TRACE_SAMPLE
+
+TRACE_SAMPLE_RATE = float(os.environ.get("LOVEFIT_TRACE_SAMPLE", "0"))
+_current_trace = contextvars.ContextVar("lovefit_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []  # type: List[Tuple[str, float, float, Dict]]  # (name, start offset, duration, attributes)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started: float, duration: float, attrs: Dict):
+        with self._lock:
+            self.spans.append((name, started - self.started, duration, attrs))
+
+    def server_timing(self) -> str: # Server-Timing header value (shown in browser dev tools)
+        with self._lock:
+            spans = list(self.spans)
+        return ", ".join(f"{name.replace(' ', '_')};dur={duration * 1e3:.2f}" for name, _, duration, _ in spans)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1e3, 3),
+            "spans": [{"name": name, "start_ms": round(start * 1e3, 3), "duration_ms": round(duration * 1e3, 3), **attrs}
+                      for name, start, duration, attrs in spans],
+        }
+
+
+def should_trace(header: Optional[str]) -> bool:
+    if header:
+        return header.strip().lower() not in ("0", "false", "no")
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def start_trace(name: str, trace_id: Optional[str] = None) -> Tuple[Trace, contextvars.Token]:
+    trace = Trace(name, trace_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token, status: Optional[int] = None):
+    """Detach the request's trace and log it"""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is not None:
+        logging.getLogger("lovefit.trace").info("trace", extra={"fields": dict(trace.to_dict(), status=status)})
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a span of the current request's trace (a no-op when the request is not traced)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs  # callers may add attributes while the span is open
+    finally:
+        trace.add(name, started, time.perf_counter() - started, attrs)
+
+
+def traced(name: str): # decorator form of span()
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+##### sampling profiler
+
+_IDLE_FILES = ("threading.py", "selectors.py", "socketserver.py", "queue.py", "socket.py", "ssl.py")
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: samples every thread's stack every `interval` seconds
+
+    Cheap enough to switch on in production for a while (POST /api/debug/profiler).
+    Results are folded stacks ("outer;inner;leaf count"), the input format of
+    flamegraph.pl and speedscope. Threads parked in waits are skipped by default.
+    """
+
+    def __init__(self, interval: float = 0.005, skip_idle: bool = True):
+        self.interval = interval
+        self.skip_idle = skip_idle
+        self.samples = Tally()  # folded stack -> count
+        self.started = None  # type: Optional[float]
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None):
+        with self._lock:
+            if interval:
+                self.interval = interval
+            if self.running:
+                return
+            self._stop.clear()
+            self.started = time.time()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=1.0)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                if self.skip_idle and frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(names)))
+            del frames
+            with self._lock:
+                self.samples.update(stacks)
+
+    def folded(self) -> str:
+        with self._lock:
+            items = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def top(self, limit: int = 20) -> List[Dict]: # functions ranked by samples where they were the leaf (self time)
+        leaves = Tally()
+        with self._lock:
+            for stack, count in self.samples.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            total = sum(self.samples.values())
+        return [{"function": fn, "samples": n, "share": round(n / total, 4)} for fn, n in leaves.most_common(limit)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = sum(self.samples.values())
+        return {"running": self.running, "interval": self.interval, "samples": total, "started": self.started}
+
+
+PROFILER = SamplingProfiler()
+
+
+##### structured logging
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, the record's `fields` and the current trace id"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        trace = _current_trace.get()
+        if trace is not None and "trace_id" not in data:
+            data["trace_id"] = trace.id
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter): # human-readable variant for local development
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, ensure_ascii=False, default=str)}" for k, v in fields.items())
+        return line
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """
+    Send the "lovefit.*" loggers to stderr
+
+    Args:
+        level: DEBUG/INFO/WARNING/... (default LOVEFIT_LOG_LEVEL or INFO)
+        fmt: "json" or "text" (default LOVEFIT_LOG_FORMAT or json)
+    """
+    level = (level or os.environ.get("LOVEFIT_LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.environ.get("LOVEFIT_LOG_FORMAT", "json")
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "text":
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger("lovefit")
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
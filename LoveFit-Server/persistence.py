@@ -0,0 +1,107 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from metrics import PERSIST_WRITE
+
+log = logging.getLogger("lovefit.persistence")
+
+
+def atomic_write_json(path: str, data, indent: Optional[int] = None):
+    """Write JSON to a temp file in the same directory, fsync, then rename over `path`"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class WriteBehindWriter:
+    """
+    Debounced background writer shared by every AICharacter
+
+    submit() snapshots the data and returns immediately. Repeated submits for the
+    same path within `delay` seconds coalesce into one atomic write on the writer
+    thread, so hot paths never pay for serialization or disk I/O.
+    """
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.pending = {}  # path -> (data, indent, due time, sequence)
+        self.written = {}  # path -> sequence of the last snapshot on disk
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # orders writes from the thread and from flush()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def submit(self, path: str, data: Dict, indent: Optional[int] = None):
+        snapshot = copy.deepcopy(data)  # caller keeps mutating its own dict
+        with self._cond:
+            due = self.pending[path][2] if path in self.pending else time.monotonic() + self.delay
+            self._sequence += 1
+            self.pending[path] = (snapshot, indent, due, self._sequence)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending:
+                    self._cond.wait()
+                path, item = min(self.pending.items(), key=lambda entry: entry[1][2])
+                wait = item[2] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                del self.pending[path]
+            self._write(path, item)
+
+    def _write(self, path: str, item):
+        data, indent, _, sequence = item
+        with self._io_lock:
+            if self.written.get(path, 0) > sequence:
+                return  # a newer snapshot already landed via flush()
+            try:
+                with PERSIST_WRITE.time(target="json"):
+                    atomic_write_json(path, data, indent)
+                self.written[path] = sequence
+            except OSError as e:
+                log.error("write-behind write failed", extra={"fields": {"path": path, "error": str(e)}})
+
+    def flush(self, paths: Optional[Iterable[str]] = None):
+        """Write pending data now (all of it, or only `paths`)"""
+        with self._cond:
+            selected = list(self.pending) if paths is None else [p for p in paths if p in self.pending]
+            items = [(path, self.pending.pop(path)) for path in selected]
+        for path, item in items:
+            self._write(path, item)
+        with self._io_lock:
+            pass  # let a write already taken by the thread finish
+
+
+_default_writer = None
+_default_lock = threading.Lock()
+
+
+def default_writer() -> WriteBehindWriter: # process-wide writer, flushed at interpreter exit
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = WriteBehindWriter()
+            atexit.register(_default_writer.flush)
+        return _default_writer
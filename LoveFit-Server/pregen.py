@@ -0,0 +1,195 @@
+import json
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from job_queue import PRIORITY_BACKGROUND, Job, JobQueue
+from persistence import WriteBehindWriter, default_writer
+from session_registry import CharacterSessionRegistry
+
+log = logging.getLogger("lovefit.pregen")
+_FILE_NAME = re.compile(r"^[A-Za-z0-9_@-][A-Za-z0-9_.@-]{0,63}$")  # storyline ids become file names
+
+
+class PregenScheduler:
+    """
+    Generates story openings in the background before users unlock them
+
+    GameEngine calls schedule() when a user reaches `near_fraction` of a
+    requirement that names a "storyline". An opening depends only on the shared
+    character definition, not on the user, so each storyline is generated once
+    for everyone: a single worker thread waits until the LLM backend is idle,
+    generates the opening and stores it in
+    <sessions_dir>/.pregen/<character_id>/<storyline_id>.json, so the unlock
+    response of every user can include finished text instead of waiting on the
+    model. With a JobQueue the generations run as background "pregen" jobs instead.
+    """
+
+    def __init__(self, sessions: CharacterSessionRegistry, requirements: Dict[str, Dict], character_id: str,
+                 writer: Optional[WriteBehindWriter] = None, idle_poll: float = 0.5, max_pending: int = 1000,
+                 jobs: Optional[JobQueue] = None):
+        """
+        Args:
+            sessions: registry providing the shared character definition
+            requirements: GameEngine.requirements (story id -> requirement with optional "storyline")
+            character_id: character whose storylines are pre-generated
+            writer: write-behind persister (defaults to the process-wide one)
+            idle_poll: seconds between checks for free model capacity
+            max_pending: queued generations beyond which new requests are dropped
+            jobs: run generations on this queue (registers the "pregen" handler)
+        """
+        self.sessions = sessions
+        self.requirements = requirements
+        self.character_id = character_id
+        self.writer = writer or default_writer()
+        self.idle_poll = idle_poll
+        self.max_pending = max_pending
+        self.directory = sessions.sessions_dir / ".pregen" / character_id  # "." never starts a user id
+        # storyline_id -> (user_id, story_id) that asked first, FIFO; kept until generated, so it is never queued twice
+        self.pending = OrderedDict()  # type: OrderedDict
+        self.openings = self._load()  # type: Dict[str, Dict]  # storyline_id -> {storyline, opening, generated_at}
+        self._version = self._digest(self.openings)
+        self._lock = threading.Lock()  # guards openings and _version
+        self.generated = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+        self._thread = None  # type: Optional[threading.Thread]
+        self.jobs = jobs
+        if jobs is not None:
+            jobs.register("pregen", self._run_job)
+
+    def _path(self, storyline_id: str) -> Path:
+        return self.directory / f"{storyline_id}.json"
+
+    def _load(self) -> Dict[str, Dict]:
+        openings = {}
+        if self.directory.is_dir():
+            for path in self.directory.glob("*.json"):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        openings[path.stem] = json.load(f)
+                except (OSError, ValueError) as e:
+                    log.error("unreadable story opening", extra={"fields": {"path": str(path), "error": str(e)}})
+        return openings
+
+    @staticmethod
+    def _digest(openings: Dict[str, Dict]) -> int: # same openings on disk give the same version, across restarts and workers
+        return zlib.crc32(json.dumps(sorted((s, o["generated_at"]) for s, o in openings.items())).encode('utf-8'))
+
+    def _known(self, storyline_id: str) -> bool: # generated here, or by another worker sharing sessions_dir
+        with self._lock:
+            if storyline_id in self.openings:
+                return True
+        path = self._path(storyline_id)
+        if not path.exists():
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                opening = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._store(storyline_id, opening)
+        return True
+
+    def _store(self, storyline_id: str, opening: Dict):
+        with self._lock:
+            if storyline_id in self.openings:
+                return
+            openings = dict(self.openings)  # replaced, never mutated: ready() hands out the current dict
+            openings[storyline_id] = opening
+            self.openings, self._version = openings, self._digest(openings)
+
+    def schedule(self, user_id: str, story_ids: List[str]):
+        """Queue openings for stories a user is about to unlock (GameEngine.on_near_unlock)"""
+        for story_id in story_ids:
+            storyline_id = self.requirements.get(story_id, {}).get("storyline")
+            if not storyline_id or not _FILE_NAME.match(storyline_id) or self._known(storyline_id):
+                continue
+            with self._cond:
+                if storyline_id in self.pending or len(self.pending) >= self.max_pending:
+                    continue
+                self.pending[storyline_id] = (user_id, story_id)
+                if self.jobs is not None:
+                    self.jobs.submit("pregen", {"user_id": user_id, "story_id": story_id}, PRIORITY_BACKGROUND, user_id)
+        with self._cond:
+            if self.jobs is None and self.pending and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="story-pregen", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending:
+                    self._cond.wait()
+            while not self.sessions.llm.idle():  # interactive requests first
+                time.sleep(self.idle_poll)
+            with self._cond:
+                if not self.pending:
+                    continue
+                storyline_id, (user_id, story_id) = next(iter(self.pending.items()))
+            try:
+                self._generate(user_id, story_id)
+            finally:
+                with self._cond:
+                    self.pending.pop(storyline_id, None)
+
+    def _run_job(self, job: Job):
+        user_id, story_id = job.payload["user_id"], job.payload["story_id"]
+        storyline_id = self.requirements.get(story_id, {}).get("storyline")
+        try:
+            self._generate(user_id, story_id)
+        finally:
+            with self._cond:
+                self.pending.pop(storyline_id, None)
+        return {"story_id": story_id, "ready": story_id in self.ready()}
+    
+    def _generate(self, user_id: str, story_id: str):
+        storyline_id = self.requirements.get(story_id, {}).get("storyline")
+        if not storyline_id or not _FILE_NAME.match(storyline_id):  # dropped from the catalogue since it was queued
+            return
+        if self._known(storyline_id):  # another user's request got there first
+            return
+        try:
+            # only the persona and storyline definitions go into the prompt: no user session is loaded
+            # or locked, so the user's own chat never waits on it
+            opening = self.sessions.definition(self.character_id).generate_story_opening(storyline_id)
+        except Exception as e:
+            self.failed += 1
+            log.error("story pre-generation failed",
+                      extra={"fields": {"user_id": user_id, "story_id": story_id, "error": str(e)}})
+            return
+        if opening is None:
+            return
+
+        opening = {
+            "storyline": storyline_id,
+            "opening": opening,
+            "generated_at": datetime.now().isoformat()
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._store(storyline_id, opening)
+        self.generated += 1
+        self.writer.submit(str(self._path(storyline_id)), opening)
+
+    def ready(self) -> Dict[str, Dict]:
+        """Pregenerated openings by story id, story_id -> {storyline, opening, generated_at}"""
+        with self._lock:
+            openings = self.openings
+        return {story_id: openings[r["storyline"]] for story_id, r in self.requirements.items()
+                if r.get("storyline") in openings}
+
+    def version(self) -> int:
+        """Changes whenever ready() may have changed (part of the available-content ETag)"""
+        with self._lock:
+            return self._version
+
+    def stats(self) -> Dict:
+        return {"pending": len(self.pending), "generated": self.generated, "failed": self.failed,
+                "openings": len(self.openings)}
@@ -0,0 +1,278 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, List, Optional
+
+from metrics import PERSIST_WRITE
+
+log = logging.getLogger("lovefit.progress_store")
+
+
+class ProgressStore: # storage interface behind GameEngine's per-user progress records
+    def get(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def put(self, user_id: str, record: Dict):
+        raise NotImplementedError
+
+    def delete(self, user_id: str):
+        raise NotImplementedError
+
+    def put_encoded(self, user_id: str, data: str): # store a record given as JSON text (bulk loads)
+        self.put(user_id, json.loads(data))
+
+    def user_ids(self) -> List[str]: # every user with a record
+        raise NotImplementedError
+
+    def transaction(self) -> ContextManager:
+        """
+        Scope of one read-modify-write: get() returns the current record and the put()/delete()
+        calls inside take effect together, without another writer (another worker process
+        included) changing the same records in between. Nothing is written if the block raises.
+        """
+        return nullcontext()
+
+    def flush(self): # push buffered writes to durable storage
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class MemoryProgressStore(ProgressStore): # in-process dict, lost on restart
+    def __init__(self):
+        self.records = {}  # user_id -> record, or its JSON text until first read (see put_encoded)
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        record = self.records.get(user_id)
+        if isinstance(record, str):  # decoded on first use, so a bulk load costs no parsing
+            record = self.records[user_id] = json.loads(record)
+        return record
+
+    def put(self, user_id: str, record: Dict):
+        self.records[user_id] = record
+
+    def delete(self, user_id: str):
+        self.records.pop(user_id, None)
+
+    def put_encoded(self, user_id: str, data: str):
+        self.records[user_id] = data
+
+    def user_ids(self) -> List[str]:
+        return list(self.records)
+
+
+class SQLiteProgressStore(ProgressStore):
+    # fixed SQL strings so sqlite3's statement cache keeps them prepared
+    _CREATE = """CREATE TABLE IF NOT EXISTS user_progress (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    )"""
+    _SELECT = "SELECT data, version FROM user_progress WHERE user_id = ?"
+    _VERSION = "SELECT version FROM user_progress WHERE user_id = ?"
+    _UPSERT = ("INSERT INTO user_progress (user_id, data, updated_at, version) VALUES (?, ?, ?, 1) "
+               "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at, "
+               "version = user_progress.version + 1")
+    _DELETE = "DELETE FROM user_progress WHERE user_id = ?"
+
+    def __init__(self, path: str, batch_size: int = 32, flush_interval: float = 0.5, timeout: float = 30.0,
+                 cache_size: int = 100000):
+        """
+        SQLite (WAL) backed progress store, shared by every worker process using the same file
+
+        Writes made inside transaction() (every GameEngine update) are committed when the
+        block ends, under SQLite's write lock, so workers never overwrite each other's
+        updates. Writes outside it (bulk loads such as GameEngine.recover) are buffered
+        and committed in batches; use those from a single writer only.
+
+        SQLite has one writer at a time and this store one connection, so transactions run
+        one after another under a process-wide lock: GameEngine's shards still keep a user's
+        calls in order, but their writes do not run in parallel with this store (the memory
+        store has no such lock). Scale writes with more worker processes instead.
+
+        Args:
+            path: database file, shared by every worker process
+            batch_size: buffered writes that force an immediate commit
+            flush_interval: max seconds a buffered write stays uncommitted
+            timeout: max seconds to wait for another worker's write transaction
+            cache_size: decoded records kept in memory, least recently used dropped first
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # user_id -> [decoded record, row version (None: unknown), generation it was last checked in]
+        self.pending = {}  # user_id -> record JSON encoded at put() time, or None for a delete
+        self.generation = 0  # bumped whenever another connection has committed: cached rows need a version check
+        self.lock = threading.RLock()
+        self._touched = None  # type: Optional[set]  # users read or written by the open transaction()
+
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self._CREATE)
+        if "version" not in [row[1] for row in self.conn.execute("PRAGMA table_info(user_progress)")]:
+            self.conn.execute("ALTER TABLE user_progress ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self.data_version = self._data_version()
+
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="progress-flusher", daemon=True)
+        self._flusher.start()
+
+    def _data_version(self) -> int: # changes whenever another connection commits
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync_cache(self): # another worker wrote since our last look: re-check cached rows before using them
+        version = self._data_version()
+        if version != self.data_version:
+            self.data_version = version
+            self.generation += 1
+
+    def _cache(self, user_id: str, entry: List): # remember a decoded record, dropping the least recently used beyond cache_size
+        self.cache[user_id] = entry
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        with self.lock:
+            if self._touched is not None:
+                self._touched.add(user_id)
+            if user_id in self.pending:  # our own buffered write is the newest state
+                if self.pending[user_id] is None:
+                    return None
+                entry = self.cache.get(user_id)
+                if entry is None:  # written by put_encoded(), or dropped from the cache since
+                    entry = [json.loads(self.pending[user_id]), None, self.generation]
+                self._cache(user_id, entry)
+                return entry[0]
+            self._sync_cache()
+            entry = self.cache.get(user_id)
+            if entry is not None and entry[2] != self.generation:
+                row = self.conn.execute(self._VERSION, (user_id,)).fetchone()
+                if row is not None and row[0] == entry[1]:
+                    entry[2] = self.generation  # unchanged by the other worker
+                else:
+                    entry = None
+            if entry is not None:
+                self.cache.move_to_end(user_id)
+                return entry[0]
+
+            row = self.conn.execute(self._SELECT, (user_id,)).fetchone()
+            if row is None:
+                self.cache.pop(user_id, None)
+                return None
+            record = json.loads(row[0])
+            self._cache(user_id, [record, row[1], self.generation])
+            return record
+
+    def _write(self, user_id: str, data: Optional[str]) -> Optional[int]: # inside transaction(): write now, return the row version
+        if data is None:
+            self.conn.execute(self._DELETE, (user_id,))
+            return None
+        self.conn.execute(self._UPSERT, (user_id, data, time.time()))
+        return self.conn.execute(self._VERSION, (user_id,)).fetchone()[0]
+
+    def put(self, user_id: str, record: Dict):
+        # encode now: the flusher thread must not serialize a record the engine may be mutating
+        data = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            if self._touched is not None:
+                self._touched.add(user_id)
+                self._cache(user_id, [record, self._write(user_id, data), self.generation])
+                return
+            self._cache(user_id, [record, None, self.generation])
+            self.pending[user_id] = data
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def delete(self, user_id: str):
+        with self.lock:
+            self.cache.pop(user_id, None)
+            if self._touched is not None:
+                self._write(user_id, None)
+                return
+            self.pending[user_id] = None
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def put_encoded(self, user_id: str, data: str):
+        with self.lock:
+            self.cache.pop(user_id, None)  # decoded from the row on the next get()
+            if self._touched is not None:
+                self._write(user_id, data)
+                return
+            self.pending[user_id] = data
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def user_ids(self) -> List[str]:
+        with self.lock:
+            self.flush()
+            return [row[0] for row in self.conn.execute("SELECT user_id FROM user_progress")]
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:  # one transaction per connection: threads of this process (every engine shard) take turns
+            if self._touched is not None:  # nested: part of the enclosing transaction
+                yield
+                return
+            self.flush()
+            self.conn.execute("BEGIN IMMEDIATE")  # takes the database write lock, so get() below reads the latest rows
+            started = time.perf_counter()
+            self._touched = set()
+            try:
+                yield
+                self.conn.execute("COMMIT")
+            except BaseException:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                for user_id in self._touched:  # the caller may have changed these records in place
+                    self.cache.pop(user_id, None)
+                raise
+            finally:
+                self._touched = None
+            PERSIST_WRITE.observe(time.perf_counter() - started, target="progress_db")
+
+    def flush(self): # commit every buffered write in a single transaction
+        with self.lock:
+            if not self.pending or self._touched is not None:
+                return
+            now = time.time()
+            upserts = [(user_id, data, now) for user_id, data in self.pending.items() if data is not None]
+            deletes = [(user_id,) for user_id, data in self.pending.items() if data is None]
+
+            started = time.perf_counter()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if upserts:
+                    self.conn.executemany(self._UPSERT, upserts)
+                if deletes:
+                    self.conn.executemany(self._DELETE, deletes)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            PERSIST_WRITE.observe(time.perf_counter() - started, target="progress_db")
+            self.pending.clear()
+            # our own commit does not bump data_version; the cached copies keep an unknown row
+            # version, so they are re-read once another worker has written
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.error("progress flush failed", extra={"fields": {"error": str(e)}})
+
+    def close(self):
+        self._closed.set()
+        with self.lock:
+            self.flush()
+            self.conn.close()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import CACHE_LOOKUPS
+from persistence import atomic_write_json
+
+log = logging.getLogger("lovefit.response_cache")
+
+
+def cache_key(model: str, messages: List[Dict], options: Optional[Dict] = None) -> str:
+    """Content address of one generation: sha256 over model, full message list and sampling options"""
+    payload = json.dumps([model, messages, options or {}], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Opt-in cache of model replies for identical prompts
+
+    Story openings, canned first actions and greetings with empty history produce
+    byte-identical prompts across users; serving them from here keeps those calls
+    off the model server. Entries live in an in-memory LRU and, when `directory`
+    is set, in one JSON file per key shared by every worker. Both tiers expire
+    entries after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 6 * 3600, directory: Optional[str] = None,
+                 prune_every: int = 1024):
+        """
+        Args:
+            max_entries: replies kept in memory
+            ttl: seconds a reply may be served after it was generated
+            directory: optional on-disk tier
+            prune_every: puts between background sweeps of expired disk entries
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = Path(directory) if directory else None
+        self.prune_every = prune_every
+        self.entries = OrderedDict()  # type: OrderedDict  # key -> (created, content), oldest first
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(cache="response", result="hit")
+                    return entry[1]
+                del self.entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache="response", result="miss")
+                return None
+            self.disk_hits += 1
+            CACHE_LOOKUPS.inc(cache="response", result="disk_hit")
+            self._remember(key, entry)
+        return entry[1]
+
+    def _read_disk(self, key: str, now: float):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - data["created"] >= self.ttl:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return data["created"], data["content"]
+
+    def _remember(self, key: str, entry): # insert into the memory tier (call with _lock held)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key: str, content: str):
+        entry = (time.time(), content)
+        with self._lock:
+            self._remember(key, entry)
+            self._puts += 1
+            sweep = self.directory is not None and self._puts % self.prune_every == 0
+        if self.directory is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_json(str(path), {"created": entry[0], "content": content})
+        except OSError as e:
+            log.error("response cache write failed", extra={"fields": {"path": str(path), "error": str(e)}})
+        if sweep:
+            threading.Thread(target=self.prune, name="response-cache-prune", daemon=True).start()
+
+    def prune(self) -> int:
+        """Delete expired disk entries; returns how many were removed"""
+        if self.directory is None or not self.directory.exists():
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for path in self.directory.glob("*/*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
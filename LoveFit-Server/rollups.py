@@ -0,0 +1,177 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+FIELDS = ("distance", "duration", "count")
+
+
+def day_number(timestamp: float) -> int: # UTC calendar day ordinal of a unix timestamp
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).date().toordinal()
+
+
+class DailyRollup:
+    """
+    Per-user, per-workout-type ring buffer of daily buckets
+
+    Rolling window sums (e.g. the last 7 days) and the current streak are kept up
+    to date as workouts arrive and days roll over, so reads are O(1). Days older
+    than `capacity` are overwritten in place, which bounds memory per user.
+    """
+
+    def __init__(self, windows: Iterable[int] = (), capacity: int = 35):
+        self.windows = sorted(set(windows))
+        self.capacity = max([capacity] + self.windows)
+        self.buckets = [0] * (3 * self.capacity)  # distance, duration, count of a day at 3 * (day % capacity), one flat list
+        self.last_day = None  # type: Optional[int]  # newest day the ring has rolled to
+        self.window_sums = {w: [0, 0, 0] for w in self.windows}
+        self.last_active_day = None  # type: Optional[int]
+        self.streak = 0  # consecutive active days ending at last_active_day
+
+    def _bucket(self, day: int) -> int: # offset of the day's [distance, duration, count] in `buckets`
+        return 3 * (day % self.capacity)
+
+    def advance(self, day: int): # roll the ring forward to `day`, expiring buckets leaving each window
+        if self.last_day is None:
+            self.last_day = day
+            return
+        if day <= self.last_day:
+            return
+        buckets = self.buckets
+        if day - self.last_day >= self.capacity:
+            self.buckets = [0] * (3 * self.capacity)
+            self.window_sums = {w: [0, 0, 0] for w in self.windows}
+        else:
+            capacity = self.capacity
+            for new_day in range(self.last_day + 1, day + 1):  # most days of most users are empty: skip those
+                for w, sums in self.window_sums.items():
+                    leaving = 3 * ((new_day - w) % capacity)
+                    if buckets[leaving + 2]:
+                        for i in range(3):
+                            sums[i] -= buckets[leaving + i]
+                new = 3 * (new_day % capacity)
+                if buckets[new + 2]:
+                    buckets[new:new + 3] = (0, 0, 0)
+        self.last_day = day
+
+    def add(self, day: int, distance: float, duration: float):
+        self.advance(day)
+        if day <= self.last_day - self.capacity:
+            return  # older than the ring keeps
+
+        bucket, buckets = self._bucket(day), self.buckets
+        newly_active = buckets[bucket + 2] == 0
+        buckets[bucket] += distance
+        buckets[bucket + 1] += duration
+        buckets[bucket + 2] += 1
+        for w, sums in self.window_sums.items():
+            if day > self.last_day - w:
+                sums[0] += distance
+                sums[1] += duration
+                sums[2] += 1
+
+        if not newly_active:
+            return
+        if self.last_active_day is None or day > self.last_active_day + 1:
+            self.streak = 1
+            self.last_active_day = day
+        elif day == self.last_active_day + 1:
+            self.streak += 1
+            self.last_active_day = day
+        else:
+            self._recount_streak()  # a backfilled day may bridge a gap
+
+    def _recount_streak(self):
+        streak = 0
+        day = self.last_active_day
+        while streak < self.capacity and day > self.last_day - self.capacity and self.buckets[self._bucket(day) + 2] > 0:
+            streak += 1
+            day -= 1
+        self.streak = streak
+
+    def window(self, days: int, today: Optional[int] = None) -> Dict[str, float]: # O(1) read of a tracked window
+        if today is not None:
+            self.advance(today)
+        return dict(zip(FIELDS, self.window_sums[days]))
+
+    def current_streak(self, today: Optional[int] = None) -> int:
+        if self.last_active_day is None:
+            return 0
+        if today is not None and today > self.last_active_day + 1:
+            return 0  # broken: no workout yesterday or today
+        return self.streak
+
+    def ensure_windows(self, windows: Iterable[int]): # start tracking new window sizes from the existing buckets
+        missing = sorted(set(windows) - set(self.window_sums))
+        if not missing:
+            return
+        if max(missing) > self.capacity:
+            grown = DailyRollup(self.windows + missing, max(missing))
+            grown.load_buckets(self)
+            self.__dict__.update(grown.__dict__)
+            return
+        self.windows = sorted(self.windows + missing)
+        for w in missing:
+            self.window_sums[w] = self._sum_days(w)
+
+    def _sum_days(self, days: int) -> List[float]:
+        sums = [0, 0, 0]
+        if self.last_day is None:
+            return sums
+        for day in range(self.last_day - days + 1, self.last_day + 1):
+            bucket = self._bucket(day)
+            for i in range(3):
+                sums[i] += self.buckets[bucket + i]
+        return sums
+
+    def load_buckets(self, other: "DailyRollup"): # copy another rollup's live days into this ring
+        if other.last_day is not None:
+            for day in range(other.last_day - min(other.capacity, self.capacity) + 1, other.last_day + 1):
+                bucket, source = self._bucket(day), other._bucket(day)
+                self.buckets[bucket:bucket + 3] = other.buckets[source:source + 3]
+            self.last_day = other.last_day
+        self.last_active_day = other.last_active_day
+        self.streak = other.streak
+        self.window_sums = {w: self._sum_days(w) for w in self.windows}
+
+    def to_dict(self) -> Dict: # active days only, as [day, distance, duration, count]; window sums are recomputed on load
+        days = []
+        if self.last_day is not None:
+            buckets, capacity = self.buckets, self.capacity
+            for day in range(self.last_day - capacity + 1, self.last_day + 1):
+                bucket = 3 * (day % capacity)
+                if buckets[bucket + 2]:
+                    days.append([day, buckets[bucket], buckets[bucket + 1], buckets[bucket + 2]])
+        return {
+            "capacity": self.capacity,
+            "windows": list(self.windows),
+            "last_day": self.last_day,
+            "days": days,
+            "last_active_day": self.last_active_day,
+            "streak": self.streak,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict], windows: Iterable[int] = ()) -> "DailyRollup":
+        if not data:
+            return cls(windows)
+        if "days" in data:
+            rollup = cls(data["windows"], data["capacity"])
+            last_day = data["last_day"]
+            for day, distance, duration, count in data["days"]:  # window sums from the active days alone
+                bucket = rollup._bucket(day)
+                rollup.buckets[bucket:bucket + 3] = (distance, duration, count)
+                for w, sums in rollup.window_sums.items():
+                    if day > last_day - w:
+                        sums[0] += distance
+                        sums[1] += duration
+                        sums[2] += count
+            rollup.last_day = last_day
+        else:  # records written with the whole ring and its window sums
+            rollup = cls(capacity=data["capacity"])
+            rollup.buckets = [value for bucket in data["buckets"] for value in bucket]
+            rollup.windows = sorted(int(w) for w in data["window_sums"])
+            rollup.last_day = data["last_day"]
+            rollup.window_sums = {w: rollup._sum_days(w) for w in rollup.windows}
+        rollup.last_active_day = data["last_active_day"]
+        rollup.streak = data["streak"]
+        rollup.ensure_windows(windows)
+        return rollup
@@ -0,0 +1,305 @@
+# Shared server components, configured from the environment.
+# Both the Flask app (app.py) and the ASGI app (asgi_app.py) serve requests from the objects built here.
+from catalogue import CatalogueWatcher
+from game_engine import GameEngine
+from job_queue import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, JobQueue
+from metrics import CACHE_LOOKUPS, PROFILER, REGISTRY, configure_logging
+from persistence import default_writer
+from pregen import PregenScheduler
+from progress_store import MemoryProgressStore, SQLiteProgressStore
+from response_cache import ResponseCache
+from session_registry import CharacterSessionRegistry
+from workout_log import WorkoutEventLog
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import atexit
+import json
+import os
+import threading
+
+# LOVEFIT_LOG_LEVEL=DEBUG also logs every workout; LOVEFIT_LOG_FORMAT=text for local development
+configure_logging()
+
+# LOVEFIT_PROGRESS_DB=progress.db shares progress across restarts and gunicorn workers
+progress_db = os.environ.get("LOVEFIT_PROGRESS_DB")
+progress_store = SQLiteProgressStore(progress_db) if progress_db else MemoryProgressStore()
+
+# LOVEFIT_WORKOUT_LOG=dir appends every accepted workout to dir/workouts.jsonl and snapshots progress there
+# every LOVEFIT_SNAPSHOT_EVERY events; startup rebuilds progress from the snapshot plus the log tail.
+# One process per log directory. LOVEFIT_WORKOUT_LOG_REBUILD=1 replays the whole log instead (new catalogue)
+workout_log_dir = os.environ.get("LOVEFIT_WORKOUT_LOG")
+workout_log = WorkoutEventLog(workout_log_dir, snapshot_every=int(os.environ.get("LOVEFIT_SNAPSHOT_EVERY", "100000"))
+                              ) if workout_log_dir else None
+
+# users are spread over LOVEFIT_ENGINE_SHARDS locks: different users update in parallel, one user's calls never interleave
+# (with LOVEFIT_PROGRESS_DB the store commits one transaction at a time, so updates of different shards queue up there)
+game_engine = GameEngine(progress_store, near_fraction=float(os.environ.get("LOVEFIT_PREGEN_FRACTION", "0.8")),
+                         shards=int(os.environ.get("LOVEFIT_ENGINE_SHARDS", "64")), event_log=workout_log,
+                         requirements_file=os.environ.get("LOVEFIT_REQUIREMENTS_FILE"))
+if workout_log is not None:
+    game_engine.recover(rebuild=bool(os.environ.get("LOVEFIT_WORKOUT_LOG_REBUILD")))
+    workout_log.start_snapshots(game_engine.snapshot)
+
+# LOVEFIT_RESPONSE_CACHE=1 reuses replies to byte-identical prompts (story openings, first greetings);
+# LOVEFIT_RESPONSE_CACHE_DIR adds a disk tier shared by all workers
+response_cache = None
+if os.environ.get("LOVEFIT_RESPONSE_CACHE") or os.environ.get("LOVEFIT_RESPONSE_CACHE_DIR"):
+    response_cache = ResponseCache(
+        ttl=float(os.environ.get("LOVEFIT_RESPONSE_CACHE_TTL", str(6 * 3600))),
+        directory=os.environ.get("LOVEFIT_RESPONSE_CACHE_DIR")
+    )
+
+# one AICharacter session per (user, character), loaded on demand and evicted LRU
+default_character_file = Path(os.environ.get("LOVEFIT_CHARACTER_FILE", "luna_character.json"))
+default_character = default_character_file.stem
+sessions = CharacterSessionRegistry(
+    character_dir=os.environ.get("LOVEFIT_CHARACTER_DIR", str(default_character_file.parent)),
+    sessions_dir=os.environ.get("LOVEFIT_SESSIONS_DIR", "sessions"),
+    model=os.environ.get("LOVEFIT_MODEL", "gemma3"),
+    max_sessions=int(os.environ.get("LOVEFIT_MAX_SESSIONS", "1000")),
+    max_bytes=int(os.environ.get("LOVEFIT_SESSION_MEMORY_MB", "256")) * 2 ** 20,
+    # LOVEFIT_MEMORY_DIR enables embedding-based long-term memory (needs numpy + a local embedding model)
+    memory_dir=os.environ.get("LOVEFIT_MEMORY_DIR"),
+    embed_model=os.environ.get("LOVEFIT_EMBED_MODEL", "nomic-embed-text"),
+    response_cache=response_cache
+)
+
+# LLM work that should not hold a request thread: queued chat/story jobs, summaries, pre-generation.
+# LOVEFIT_JOBS_DB=jobs.db keeps jobs across restarts and lets several workers share the queue
+jobs = JobQueue(
+    os.environ.get("LOVEFIT_JOBS_DB", ":memory:"),
+    workers=int(os.environ.get("LOVEFIT_JOB_WORKERS", "4")),
+    background_gate=sessions.llm.idle
+)
+
+def run_chat_job(job):
+    with sessions.session(job.payload["user_id"], job.payload["character"]) as character:
+        parts = []
+        stream = character.chat_stream(job.payload["message"])
+        for token in stream:
+            if job.cancelled():
+                stream.close()  # drops the model stream and skips saving the half reply
+                break
+            parts.append(token)
+    return {"response": "".join(parts)}
+
+def run_story_job(job):
+    with sessions.session(job.payload["user_id"], job.payload["character"]) as character:
+        result = None
+        stream = character.advance_story_stream(job.payload["action"])
+        for item in stream:
+            if job.cancelled():
+                stream.close()
+                break
+            if isinstance(item, dict):
+                result = item
+    if result is not None and "error" in result:
+        raise RuntimeError(result["error"])  # recorded as a failed job, so clients can retry it
+    return result
+
+def run_summary_job(job): # fold old chat turns into the synopsis; the session lock is not needed for this
+    with sessions.session(job.payload["user_id"], job.payload["character"]) as character:
+        memory = character.memory
+    memory.run_pending()
+
+def run_unlock_job(job): # open the storylines of the user's unlocked stories in their character session
+    with sessions.session(job.payload["user_id"], job.payload["character"]) as character:
+        return {"unlocked": [s for s in job.payload["storylines"] if character.unlock_storyline(s)]}
+
+jobs.register("chat", run_chat_job)
+jobs.register("story", run_story_job)
+jobs.register("summarize", run_summary_job)
+jobs.register("unlock", run_unlock_job)
+sessions.summary_runner = lambda user_id, character_id: jobs.submit(
+    "summarize", {"user_id": user_id, "character": character_id}, PRIORITY_BACKGROUND, user_id)
+
+# pre-generate story openings on idle model capacity once a user is close to unlocking them
+# (LOVEFIT_PREGEN_FRACTION=0 turns it off)
+pregen = PregenScheduler(sessions, game_engine.requirements, default_character, jobs=jobs)
+if game_engine.near_fraction > 0:
+    game_engine.on_near_unlock = pregen.schedule
+
+def open_storylines(user_id: str, story_ids): # GameEngine.on_unlock: storylines stay locked in the session until earned
+    requirements = game_engine.requirements
+    if not any(requirements.get(s, {}).get("storyline") for s in story_ids):
+        return
+    progress = game_engine.get_progress(user_id) or {}
+    # every unlocked story, not only the new ones: also opens storylines earned before this hook existed
+    storylines = sorted({requirements[s]["storyline"] for s in progress.get("unlocked_stories", [])
+                         if requirements.get(s, {}).get("storyline")})
+    jobs.submit("unlock", {"user_id": user_id, "character": default_character, "storylines": storylines},
+                PRIORITY_INTERACTIVE, user_id)
+
+game_engine.on_unlock = open_storylines
+
+def reload_requirements(): # catalogue file changed: swap it in; users who already qualify get new stories in the background
+    game_engine.reload_requirements()
+    pregen.requirements = game_engine.requirements
+
+# the unlock catalogue (LOVEFIT_REQUIREMENTS_FILE, default requirements.json) is re-read when edited,
+# checked every LOVEFIT_REQUIREMENTS_POLL seconds (0 turns it off). LOVEFIT_REQUIREMENTS_BACKFILL=1 re-grants
+# the whole catalogue at startup, for catalogue edits made while the server was down
+requirements_poll = float(os.environ.get("LOVEFIT_REQUIREMENTS_POLL", "5"))
+catalogue_watcher = CatalogueWatcher(game_engine.requirements_file, reload_requirements,
+                                     requirements_poll) if requirements_poll > 0 else None
+if os.environ.get("LOVEFIT_REQUIREMENTS_BACKFILL"):
+    game_engine.start_backfill()
+jobs.start()
+
+# gauges read from component state whenever /metrics is scraped
+REGISTRY.gauge("lovefit_sessions", "Character sessions held in memory", fn=lambda: len(sessions.sessions))
+REGISTRY.gauge("lovefit_session_bytes", "Estimated memory held by character sessions", fn=lambda: sessions.total_bytes)
+REGISTRY.gauge("lovefit_llm_in_flight", "Generations running on the model", fn=lambda: getattr(sessions.llm, "in_flight", 0))
+REGISTRY.gauge("lovefit_llm_waiting", "Callers waiting for a generation slot", fn=lambda: getattr(sessions.llm, "waiting", 0))
+REGISTRY.gauge("lovefit_jobs", "Jobs in the queue database by status", ("status",),
+               fn=lambda: {(status,): n for status, n in jobs.stats()["jobs"].items()})
+REGISTRY.gauge("lovefit_pregen_pending", "Story openings waiting to be pre-generated", fn=lambda: len(pregen.pending))
+REGISTRY.gauge("lovefit_write_behind_pending", "Files waiting for a write-behind flush",
+               fn=lambda: len(default_writer().pending))
+if response_cache is not None:
+    REGISTRY.gauge("lovefit_response_cache_entries", "Replies in the in-memory response cache",
+                   fn=lambda: len(response_cache.entries))
+
+# LOVEFIT_PROFILE=1 samples stacks from startup; otherwise toggle it with POST /api/debug/profiler
+if os.environ.get("LOVEFIT_PROFILE"):
+    PROFILER.start(float(os.environ.get("LOVEFIT_PROFILE_INTERVAL", "0.005")))
+
+ENDPOINTS = {
+    "test": "/api/test",
+    "submit_workout": "/api/user-progress",
+    "submit_workout_batch": "/api/user-progress/batch",
+    "get_content": "/api/available-content/<user_id>",
+    "requirements": "/api/requirements",
+    "chat_stream": "/api/character/chat/stream",
+    "story_stream": "/api/character/story/stream",
+    "submit_job": "/api/jobs",
+    "job": "/api/jobs/<job_id>",
+    "metrics": "/metrics"
+}
+
+def resolve_user_id(payload=None, header: Optional[str] = None) -> str: # caller identity: body/query "user_id", then X-User-Id header
+    user_id = (payload.get('user_id') if hasattr(payload, 'get') else None) or header or "test_user"
+    sessions.check_user_id(user_id)
+    return user_id
+
+def resolve_session(payload, header: Optional[str] = None) -> Tuple[str, str]: # (user_id, character_id) of a character request
+    character_id = payload.get('character') or default_character
+    sessions.character_file(character_id)
+    return resolve_user_id(payload, header), character_id
+
+def available_content(user_id: str) -> Dict: # unlocked/locked stories plus any pregenerated openings
+    sessions.check_user_id(user_id)
+    content = game_engine.get_available_content(user_id)
+    ready = pregen.ready()
+    content["pregenerated"] = {s: ready[s] for s in content["unlocked_stories"] if s in ready}
+    return content
+
+_content_cache = OrderedDict()  # type: OrderedDict  # user_id -> (etag, serialized available content), LRU
+_content_cache_size = int(os.environ.get("LOVEFIT_CONTENT_CACHE_SIZE", "10000"))
+_content_lock = threading.Lock()
+
+def available_content_response(user_id: str) -> Tuple[str, bytes]:
+    """(strong ETag, JSON body) of a user's available content; the body is rebuilt only when the ETag changes"""
+    sessions.check_user_id(user_id)
+    etag = f'"{game_engine.content_version(user_id)}.{pregen.version()}"'
+    with _content_lock:
+        cached = _content_cache.get(user_id)
+        if cached is not None and cached[0] == etag:
+            _content_cache.move_to_end(user_id)
+            CACHE_LOOKUPS.inc(cache="content", result="hit")
+            return cached
+    CACHE_LOOKUPS.inc(cache="content", result="miss")
+    body = json.dumps(available_content(user_id), ensure_ascii=False).encode('utf-8')
+    with _content_lock:
+        _content_cache[user_id] = (etag, body)
+        _content_cache.move_to_end(user_id)
+        while len(_content_cache) > _content_cache_size:
+            _content_cache.popitem(last=False)
+    return etag, body
+
+_requirements_body = (None, b"")  # (catalogue version, serialized catalogue)
+
+def requirements_response() -> Tuple[str, bytes]: # (ETag, JSON body) of the requirements catalogue
+    global _requirements_body
+    version = game_engine.requirements_version
+    if _requirements_body[0] != version:
+        _requirements_body = (version, json.dumps(game_engine.requirements, ensure_ascii=False).encode('utf-8'))
+    return f'"{version}"', _requirements_body[1]
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool: # If-None-Match check (weak comparison, as RFC 9110 asks)
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().replace("W/", "", 1) == etag for tag in if_none_match.split(","))
+
+def reset_user(user_id: str): # debug: forget a user's progress (pregenerated openings are shared, so they stay)
+    game_engine.reset_progress(user_id)
+
+def status_report(user_id: str) -> Dict: # debug: progress, requirements and component stats
+    return {
+        "user_progress": game_engine.get_progress(user_id) or "User not available.",
+        "requirements": game_engine.requirements,
+        "catalogue": {"version": game_engine.catalogue_version, "requirements_version": game_engine.requirements_version,
+                      "unlocks_version": game_engine.unlocks_version,
+                      "aggregates": game_engine.aggregates.stats(), "last_backfill": game_engine.last_backfill},
+        "sessions": sessions.stats(),
+        "pregen": pregen.stats(),
+        "jobs": jobs.stats(),
+        "response_cache": response_cache.stats() if response_cache else None,
+        "workout_log": workout_log.stats() if workout_log else None
+    }
+
+def workout_audit(user_id: str) -> Dict: # debug: a user's logged workouts next to the progress derived from them
+    sessions.check_user_id(user_id)
+    return {
+        "user_id": user_id,
+        "enabled": workout_log is not None,
+        "events": game_engine.workout_events(user_id),
+        "user_progress": game_engine.get_progress(user_id)
+    }
+
+def profiler_control(payload) -> Dict:
+    """
+    Debug: switch the sampling profiler on or off
+
+    Args:
+        payload: {"enabled": bool, "interval": seconds between samples, "reset": drop collected samples}
+    """
+    if payload.get("reset"):
+        PROFILER.reset()
+    if "enabled" in payload:
+        if payload["enabled"]:
+            PROFILER.start(float(payload.get("interval") or 0) or None)
+        else:
+            PROFILER.stop()
+    return profiler_report()
+
+def profiler_report() -> Dict:
+    return dict(PROFILER.stats(), top=PROFILER.top())
+
+def sse_event(event: str, data) -> str: # one Server-Sent Events frame
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+_shut_down = False
+
+def shutdown():
+    """Stop workers and write out everything still buffered (sessions, progress, write-behind files)"""
+    global _shut_down
+    if _shut_down:  # runs from the ASGI lifespan and again at exit
+        return
+    _shut_down = True
+    PROFILER.stop()
+    if catalogue_watcher is not None:
+        catalogue_watcher.close()
+    jobs.close()
+    sessions.close()
+    if workout_log is not None:
+        if workout_log.snapshot_due():  # makes the next startup replay a short tail
+            game_engine.snapshot()
+        workout_log.close()
+    progress_store.close()
+    default_writer().flush()
+
+atexit.register(shutdown)
@@ -0,0 +1,277 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from character_agent import AICharacter
+from llm_client import LLMBackend, default_backend
+from persistence import WriteBehindWriter, default_writer
+from metrics import CACHE_LOOKUPS, span
+from response_cache import ResponseCache
+
+log = logging.getLogger("lovefit.sessions")
+
+_ID = re.compile(r"^[A-Za-z0-9_@-][A-Za-z0-9_.@-]{0,63}$")  # ids become path components
+
+
+class InvalidIdError(ValueError): # user/character id that cannot be used as a path component
+    pass
+
+
+class UnknownCharacterError(LookupError): # no definition file for the character id
+    pass
+
+
+def estimate_session_bytes(character: AICharacter) -> int: # rough resident size of one loaded session
+    size = 16384  # object graph, persona prompt, open file handles
+    size += sum(2 * len(m["content"]) + 240 for m in character.chat_history)
+    size += 2 * len(character.memory.synopsis)
+    size += 160 * len(character.story_progress)
+    if character.long_term_memory is not None:
+        size += sum(2 * len(r.get("text", "")) + 320 for r in character.long_term_memory.records)
+    return size
+
+
+class _Session:
+    __slots__ = ("key", "character", "lock", "refs", "size")
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+        self.character = None  # type: Optional[AICharacter]
+        self.lock = threading.Lock()  # one request at a time per (user, character)
+        self.refs = 0  # in-flight requests; pinned sessions are never evicted
+        self.size = 0
+
+
+class CharacterSessionRegistry:
+    """
+    Per-(user, character) AICharacter sessions with lazy loading and LRU eviction
+
+    Character definitions (<character_dir>/<character_id>.json) are shared; each
+    user gets their own story state, chat log and long-term memory under
+    <sessions_dir>/<user_id>/. Only recently used sessions stay in RAM: when the
+    session count or their estimated size exceeds the limits, the least recently
+    used idle session is flushed to disk and dropped.
+    """
+
+    def __init__(self, character_dir: str = ".", sessions_dir: str = "sessions", model: str = "gemma3",
+                 llm: Optional[LLMBackend] = None, writer: Optional[WriteBehindWriter] = None,
+                 max_sessions: int = 1000, max_bytes: int = 256 * 2 ** 20,
+                 memory_dir: Optional[str] = None, embed_model: str = "nomic-embed-text",
+                 response_cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            character_dir: where shared character definition files live
+            sessions_dir: root of per-user state files and chat logs
+            model: llm model for every session
+            llm: shared LLM backend (defaults to the process-wide pooled Ollama client)
+            writer: write-behind persister (defaults to the process-wide one)
+            max_sessions: loaded sessions kept in memory
+            max_bytes: estimated memory budget for loaded sessions
+            memory_dir: enables per-session long-term memory under <memory_dir>/<user_id>/<character_id>
+            embed_model: embedding model for long-term memory
+            response_cache: reply cache shared by every session (None disables it)
+        """
+        self.character_dir = Path(character_dir)
+        self.sessions_dir = Path(sessions_dir)
+        self.model = model
+        self.llm = llm or default_backend()
+        self.writer = writer or default_writer()
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.memory_dir = memory_dir
+        self.embed_model = embed_model
+        self.response_cache = response_cache
+        self.summary_runner = None  # type: Optional[Callable[[str, str], None]]  # (user_id, character_id) -> queue a summary job
+        self.sessions = OrderedDict()  # type: OrderedDict  # (user_id, character_id) -> _Session, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._closing = {}  # type: Dict[Tuple[str, str], _Session]  # evicted, still flushing
+        self._definitions = {}  # type: Dict[str, Tuple[float, AICharacter]]  # character_id -> (file mtime, definition)
+        self._lock = threading.Lock()
+
+    def character_file(self, character_id: str) -> Path:
+        """Definition file of a character; InvalidIdError / UnknownCharacterError otherwise"""
+        if not _ID.match(character_id):
+            raise InvalidIdError(f"Invalid character id: {character_id!r}")
+        path = self.character_dir / f"{character_id}.json"
+        if not path.exists():
+            raise UnknownCharacterError(f"Unknown character: {character_id}")
+        return path
+
+    def definition(self, character_id: str) -> AICharacter:
+        """
+        Shared AICharacter built from the definition file alone, reloaded when the file changes
+
+        No user state, chat log or memory: only for read-only work on the persona and
+        storylines (e.g. pre-generating story openings), never for a user's chat or story.
+        """
+        character_file = self.character_file(character_id)
+        mtime = character_file.stat().st_mtime
+        with self._lock:
+            cached = self._definitions.get(character_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        character = AICharacter(
+            character_file=str(character_file), model=self.model, llm=self.llm,
+            state_file=str(self.sessions_dir / f"{character_id}.definition.state.json"),  # never written
+            writer=self.writer, response_cache=self.response_cache
+        )
+        with self._lock:
+            self._definitions[character_id] = (mtime, character)
+        return character
+
+    def check_user_id(self, user_id: str):
+        if not _ID.match(user_id):
+            raise InvalidIdError(f"Invalid user id: {user_id!r}")
+
+    @contextmanager
+    def session(self, user_id: str, character_id: str) -> Iterator[AICharacter]:
+        """
+        Use the (user, character) session, loading it on first access
+
+        The session is pinned and locked for the duration of the block, so
+        concurrent requests of one user are serialized and never see it evicted.
+        """
+        self.check_user_id(user_id)
+        character_file = self.character_file(character_id)
+        key = (user_id, character_id)
+        with self._lock:
+            entry = self.sessions.get(key)
+            if entry is None:
+                entry = self.sessions[key] = _Session(key)
+            else:
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache="session", result="hit")
+            self.sessions.move_to_end(key)
+            entry.refs += 1
+            closing = self._closing.get(key)
+
+        size = 0
+        try:
+            with entry.lock:
+                if entry.character is None:
+                    if closing is not None:
+                        with closing.lock:
+                            pass  # wait until the evicted copy is on disk
+                    with span("session.load", user_id=user_id):
+                        entry.character = self._load(user_id, character_id, character_file)
+                try:
+                    yield entry.character
+                finally:
+                    size = estimate_session_bytes(entry.character)
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if self.sessions.get(key) is entry:
+                    if entry.character is None:  # load failed
+                        if not entry.refs:
+                            del self.sessions[key]
+                    else:
+                        self.total_bytes += size - entry.size
+                        entry.size = size
+                victims = self._select_victims()
+            for victim in victims:
+                self._close(victim)
+
+    def _load(self, user_id: str, character_id: str, character_file: Path) -> AICharacter:
+        user_dir = self.sessions_dir / user_id
+        user_dir.mkdir(parents=True, exist_ok=True)
+        state_file = user_dir / f"{character_id}.state.json"
+        long_term_memory = None
+        if self.memory_dir:
+            from vector_memory import LongTermMemory
+            long_term_memory = LongTermMemory(
+                str(Path(self.memory_dir) / user_id / character_id), self.llm, embed_model=self.embed_model
+            )
+
+        character = AICharacter(
+            character_file=str(character_file), model=self.model, llm=self.llm,
+            long_term_memory=long_term_memory, state_file=str(state_file), writer=self.writer,
+            response_cache=self.response_cache
+        )
+        if not state_file.exists():
+            # progress embedded in a legacy definition file belongs to nobody in particular
+            character.reset_story_progress()
+        character.attach_chat_log(str(user_dir / f"{character_id}.chat.jsonl"))
+        if self.summary_runner is not None:
+            runner = self.summary_runner
+            character.memory.runner = lambda: runner(user_id, character_id)
+        with self._lock:
+            self.loads += 1
+        CACHE_LOOKUPS.inc(cache="session", result="miss")
+        return character
+
+    def _select_victims(self):
+        """Unlink least recently used idle sessions until back under the limits (call with _lock held)"""
+        victims = []
+        for key, entry in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+                break
+            if entry.refs or entry.character is None:
+                continue
+            del self.sessions[key]
+            self.total_bytes -= entry.size
+            self._closing[key] = entry
+            self.evictions += 1
+            victims.append(entry)
+        return victims
+
+    def _close(self, entry: _Session):
+        with entry.lock:
+            try:
+                entry.character.close()
+            except Exception as e:
+                log.error("session save failed", extra={"fields": {"session": "/".join(entry.key), "error": str(e)}})
+        with self._lock:
+            if self._closing.get(entry.key) is entry:
+                del self._closing[entry.key]
+
+    def evict(self, user_id: str, character_id: str) -> bool:
+        """Flush and unload one idle session; False if it is not loaded or in use"""
+        with self._lock:
+            entry = self.sessions.get((user_id, character_id))
+            if entry is None or entry.refs or entry.character is None:
+                return False
+            del self.sessions[entry.key]
+            self.total_bytes -= entry.size
+            self._closing[entry.key] = entry
+            self.evictions += 1
+        self._close(entry)
+        return True
+
+    def flush(self):
+        """Write out every loaded session without unloading it"""
+        with self._lock:
+            entries = list(self.sessions.values())
+        for entry in entries:
+            with entry.lock:
+                if entry.character is not None:
+                    entry.character.flush()
+
+    def close(self):
+        """Flush and unload everything (process shutdown)"""
+        with self._lock:
+            entries = list(self.sessions.values())
+            self.sessions.clear()
+            self.total_bytes = 0
+        for entry in entries:
+            if entry.character is not None:
+                self._close(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "bytes": self.total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
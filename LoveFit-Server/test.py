@@ -71,15 +71,18 @@ def story_mode(character: AICharacter):
             return
         
         print("\n请选择要开始的故事线:")
-        unlocked = [s for s in storylines if s['unlocked']]
         
-        for i, story in enumerate(unlocked, 1):
-            print(f"{i}. {story['title']}")
+        for i, story in enumerate(storylines, 1):
+            print(f"{i}. {story['title']}" + ("" if story['unlocked'] else " 🔒"))
         
         try:
             choice = int(input("\n请输入编号: ").strip())
-            if 1 <= choice <= len(unlocked):
-                selected = unlocked[choice - 1]
+            if 1 <= choice <= len(storylines):
+                selected = storylines[choice - 1]
+                if not selected['unlocked']:
+                    # 命令行里没有运动数据，锁定的故事线直接解锁（服务端由运动进度解锁）
+                    character.unlock_storyline(selected['id'])
+                    print(f"🔓 已解锁: {selected['title']}")
                 intro = character.start_storyline(selected['id'])
                 print("\n" + intro)
             else:
@@ -175,18 +178,18 @@ def modify_character(character: AICharacter):
 
 def save_history(character: AICharacter):
     """保存对话历史"""
-    filename = input("\n请输入保存文件名 (默认: chat_history.json): ").strip()
+    filename = input("\n请输入保存文件名 (默认: chat_history.jsonl): ").strip()
     if not filename:
-        filename = "chat_history.json"
+        filename = "chat_history.jsonl"
     
     character.save_chat_history(filename)
 
 
 def load_history(character: AICharacter):
     """加载对话历史"""
-    filename = input("\n请输入文件名 (默认: chat_history.json): ").strip()
+    filename = input("\n请输入文件名 (默认: chat_history.jsonl): ").strip()
     if not filename:
-        filename = "chat_history.json"
+        filename = "chat_history.jsonl"
     
     character.load_chat_history(filename)
 
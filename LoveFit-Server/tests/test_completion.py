@@ -0,0 +1,33 @@
+import pytest
+
+from completion import AMBIGUOUS, COMPLETE, INCOMPLETE, CompletionJudge
+
+
+@pytest.fixture
+def judge():
+    return CompletionJudge([{}])
+
+
+@pytest.mark.parametrize("action, verdict", [
+    ("I finished the workout", COMPLETE),
+    ("finishing the last lap now", COMPLETE),
+    ("done!", COMPLETE),
+    ("Now I'm done", COMPLETE),
+    ("我完成了任务", COMPLETE),
+    ("特别顺利地完成了", COMPLETE),
+    ("没想到我居然完成了", COMPLETE),
+    ("I made an entry in the log", INCOMPLETE),
+    ("I abandoned the quest", INCOMPLETE),
+    ("I'm trying to open the door", AMBIGUOUS),
+    ("I didn't finish", AMBIGUOUS),
+    ("我没完成", AMBIGUOUS),
+    ("还没有完成", AMBIGUOUS),
+])
+def test_classify(judge, action, verdict):
+    assert judge.classify(0, action) == verdict
+
+
+def test_chapter_keywords_inflect():
+    judge = CompletionJudge([{"completion_keywords": ["stop"]}])
+    assert judge.classify(0, "the rain stopped") == COMPLETE
+    assert judge.classify(0, "a bus stopover") == INCOMPLETE
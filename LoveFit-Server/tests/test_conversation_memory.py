@@ -0,0 +1,51 @@
+import threading
+
+from conversation_memory import ConversationMemory
+
+
+class BlockingLLM: # summarization backend that holds each call until released
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def chat(self, model, messages):
+        self.started.set()
+        assert self.release.wait(5)
+        return {"message": {"content": "old synopsis"}}
+
+
+def history(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+def test_reset_during_first_summary_drops_it():
+    llm = BlockingLLM()
+    memory = ConversationMemory(llm, "model")
+    memory.schedule(history(4), 4)
+    assert llm.started.wait(5)
+
+    memory.reset()  # e.g. clear_chat_history while the first summary is running
+    llm.release.set()
+    memory.wait(5)
+
+    assert memory.synopsis == ""
+    assert memory.summarized_upto == 0
+    messages = memory.assemble("system", history(2), "hello")
+    assert [m["content"] for m in messages[1:3]] == ["message 0", "message 1"]
+
+
+def test_summary_commits_without_reset():
+    llm = BlockingLLM()
+    llm.release.set()
+    memory = ConversationMemory(llm, "model")
+    memory.schedule(history(4), 4)
+    memory.wait(5)
+
+    assert memory.synopsis == "old synopsis"
+    assert memory.summarized_upto == 4
+
+
+def test_recalled_context_follows_history():
+    memory = ConversationMemory(BlockingLLM(), "model")
+    messages = memory.assemble("system", history(2), "hello", context="[[[related memories]]]")
+    assert [m["content"] for m in messages] == ["system", "message 0", "message 1", "[[[related memories]]]", "hello"]
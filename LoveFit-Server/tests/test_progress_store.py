@@ -0,0 +1,31 @@
+from progress_store import SQLiteProgressStore
+
+
+def record(n):
+    return {"current_progress": {}, "unlocked_stories": [], "n": n}
+
+
+def test_cache_keeps_the_most_recently_used_records(tmp_path):
+    store = SQLiteProgressStore(str(tmp_path / "progress.db"), cache_size=3)
+    try:
+        for n in range(5):
+            with store.transaction():
+                store.put(f"u{n}", record(n))
+        assert list(store.cache) == ["u2", "u3", "u4"]
+
+        store.get("u2")  # used again: u3 is now the oldest
+        assert store.get("u0")["n"] == 0  # dropped from the cache, read back from the database
+        assert list(store.cache) == ["u4", "u2", "u0"]
+    finally:
+        store.close()
+
+
+def test_buffered_write_survives_eviction(tmp_path):
+    store = SQLiteProgressStore(str(tmp_path / "progress.db"), cache_size=1, batch_size=100, flush_interval=60)
+    try:
+        store.put("a", record(1))  # buffered, not committed yet
+        store.put("b", record(2))
+        assert "a" not in store.cache
+        assert store.get("a")["n"] == 1
+    finally:
+        store.close()
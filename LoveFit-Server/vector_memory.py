@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llm_client import LLMBackend
+
+log = logging.getLogger("lovefit.memory")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _save_npy(path: Path, array: np.ndarray): # atomic: temp file + rename
+    tmp = path.with_name(path.stem + ".tmp.npy")
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+class VectorIndex:
+    """
+    On-disk inner-product index over L2-normalised float32 vectors
+
+    Vectors are appended as raw float32 rows to vectors.f32 and searched through a
+    read-only memory map, so loading is O(1) and adding never rewrites the file.
+    Once enough rows exist an IVF coarse quantizer is trained: a query then only
+    scans the `nprobe` nearest clusters plus the rows added since the last build.
+    """
+
+    def __init__(self, directory: Path, dim: int, nprobe: int = 8):
+        self.directory = directory
+        self.dim = dim
+        self.nprobe = nprobe
+        self.path = directory / "vectors.f32"
+        self.count = self.path.stat().st_size // (4 * dim) if self.path.exists() else 0
+        self._map = None  # type: Optional[np.ndarray]
+        self.centroids = None  # type: Optional[np.ndarray]  # (nlist, dim)
+        self.list_offsets = None  # type: Optional[np.ndarray]  # (nlist + 1,) into list_members
+        self.list_members = None  # type: Optional[np.ndarray]  # row ids grouped by cluster
+        self.ivf_count = 0  # rows covered by the IVF lists
+        if (directory / "centroids.npy").exists():
+            self.centroids = np.load(directory / "centroids.npy")
+            self.list_offsets = np.load(directory / "list_offsets.npy")
+            self.list_members = np.load(directory / "list_members.npy", mmap_mode="r")
+            self.ivf_count = int(self.list_offsets[-1])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def vectors(self) -> np.ndarray: # memory map over every stored row
+        if self._map is None or len(self._map) != self.count:
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.count, self.dim)) \
+                if self.count else np.zeros((0, self.dim), dtype=np.float32)
+        return self._map
+
+    def add(self, vector: np.ndarray):
+        with open(self.path, "ab") as f:
+            f.write(normalize(vector).reshape(self.dim).tobytes())
+        self.count += 1
+
+    def truncate(self, count: int): # drop rows past `count` (torn writes after a crash)
+        if count < self.count:
+            os.truncate(self.path, count * 4 * self.dim)
+            self.count = count
+            self._map = None
+
+    def build_ivf(self, nlist: int = 256, iterations: int = 10, sample: int = 20000, seed: int = 0):
+        """Train k-means centroids on a sample of the rows and bucket every row"""
+        data = self.vectors()
+        n = len(data)
+        nlist = max(1, min(nlist, n // 39))
+        rng = np.random.default_rng(seed)
+        train = np.asarray(data[np.sort(rng.choice(n, size=min(n, sample), replace=False))])
+        centroids = train[rng.choice(len(train), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = train[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+
+        assign = np.concatenate([
+            np.argmax(np.asarray(data[i:i + 65536]) @ centroids.T, axis=1) for i in range(0, n, 65536)
+        ])
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+        _save_npy(self.directory / "list_members.npy", order)
+        _save_npy(self.directory / "centroids.npy", centroids)
+        _save_npy(self.directory / "list_offsets.npy", offsets)
+        self.centroids, self.list_members, self.list_offsets = centroids, order, offsets
+        self.ivf_count = n
+
+    def search(self, query: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """Return up to k (row id, cosine similarity) pairs, best first"""
+        if self.count == 0:
+            return []
+        data = self.vectors()
+        query = normalize(query).reshape(self.dim)
+        ids, scores = [], []
+
+        flat_from = 0
+        if self.centroids is not None and self.ivf_count <= self.count:
+            probes = np.argsort(self.centroids @ query)[::-1][:self.nprobe]
+            rows = np.sort(np.concatenate([self.list_members[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes]))
+            ids.append(rows)
+            scores.append(np.asarray(data[rows]) @ query)
+            flat_from = self.ivf_count
+        if flat_from < self.count:
+            ids.append(np.arange(flat_from, self.count))
+            scores.append(np.asarray(data[flat_from:]) @ query)
+
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+class LongTermMemory:
+    """
+    Embedding-backed recall of past chat exchanges and story events for one user/character
+
+    Texts are appended to records.jsonl and their embeddings to a VectorIndex in
+    the same directory (row i of the index is line i of the records). Everything
+    runs locally: embeddings come from the Ollama embedding model, search is NumPy.
+    """
+
+    def __init__(self, directory: str, llm: LLMBackend, embed_model: str = "nomic-embed-text",
+                 ivf_threshold: int = 20000):
+        """
+        Args:
+            directory: where records.jsonl and the index files are stored
+            llm: backend providing embed()
+            embed_model: local embedding model name
+            ivf_threshold: un-clustered rows that trigger an IVF (re)build
+        """
+        self.directory = Path(directory)
+        self.llm = llm
+        self.embed_model = embed_model
+        self.ivf_threshold = ivf_threshold
+        self.records = []  # type: List[Dict]
+        self.index = None  # type: Optional[VectorIndex]
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        meta_file = self.directory / "meta.json"
+        if not meta_file.exists():
+            return
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.index = VectorIndex(self.directory, meta["dim"])
+        records_file = self.directory / "records.jsonl"
+        torn = False
+        if records_file.exists():
+            with open(records_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        torn = True  # partial last line
+                        break
+                    self.records.append(json.loads(line))
+
+        # a crash between the two appends leaves one side longer; keep the common prefix
+        count = min(len(self.records), len(self.index))
+        self.index.truncate(count)
+        if torn or len(self.records) > count:
+            self.records = self.records[:count]
+            with open(records_file, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in self.records)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.llm.embed(self.embed_model, texts), dtype=np.float32)
+
+    def remember(self, text: str, kind: str = "chat", meta: Optional[Dict] = None):
+        """Embed and store one memory (blocking: hot paths use remember_async)"""
+        vector = self._embed([text])[0]
+        record = {"text": text, "kind": kind, **(meta or {})}
+        with self._lock:
+            if self.index is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(self.directory / "meta.json", 'w', encoding='utf-8') as f:
+                    json.dump({"dim": len(vector), "embed_model": self.embed_model}, f)
+                self.index = VectorIndex(self.directory, len(vector))
+            self.index.add(vector)
+            with open(self.directory / "records.jsonl", 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.records.append(record)
+            if len(self.index) - self.index.ivf_count >= self.ivf_threshold:
+                self.index.build_ivf()
+
+    def remember_async(self, text: str, kind: str = "chat", meta: Optional[Dict] = None):
+        threading.Thread(target=self._remember_quietly, args=(text, kind, meta), daemon=True).start()
+
+    def _remember_quietly(self, text: str, kind: str, meta: Optional[Dict]):
+        try:
+            self.remember(text, kind, meta)
+        except Exception as e:
+            log.error("long-term memory write failed", extra={"fields": {"error": str(e)}})
+
+    def recall(self, query: str, k: int = 4, min_score: float = 0.3) -> List[Dict]:
+        """Top-k stored memories most similar to the query"""
+        if self.index is None or len(self.index) == 0:
+            return []
+        vector = self._embed([query])[0]
+        with self._lock:
+            hits = self.index.search(vector, k)
+            return [dict(self.records[i], score=score) for i, score in hits if score >= min_score]
@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import math
+import struct
+from typing import Dict, List, Optional
+
+DAY = 86400
+
+
+def key_digest(key: str, hashes: int) -> bytes: # 32 bits per hash position; a longer digest serves smaller filters too
+    return hashlib.shake_128(key.encode("utf-8")).digest(4 * hashes)
+
+
+class BloomFilter: # fixed-size bit array, k independent 32-bit hash positions from one shake_128 digest
+    def __init__(self, size_bits: int = 32768, hashes: int = 7, bits: Optional[bytearray] = None):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size_bits + 7) // 8)
+        self._unpack = struct.Struct(f"<{hashes}I").unpack_from
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter": # smallest filter holding `capacity` keys at `error_rate`
+        size_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        return cls(size_bits, max(1, round(size_bits / capacity * math.log(2))))
+
+    def _positions(self, digest: bytes):
+        # independent positions: double hashing (h1 + i * h2) measured ~4x over the target rate on small filters
+        return [h % self.size_bits for h in self._unpack(digest)]
+
+    def add(self, key: str):
+        for pos in self._positions(key_digest(key, self.hashes)):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_digest(key_digest(key, self.hashes))
+
+    def contains_digest(self, digest: bytes) -> bool: # membership from a key_digest() of at least `hashes` positions
+        bits, size_bits = self.bits, self.size_bits
+        for h in self._unpack(digest):  # a new id usually fails on the first clear bit
+            pos = h % size_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def encode(self) -> str:
+        return base64.b64encode(bytes(self.bits)).decode("ascii")
+
+    @classmethod
+    def decode(cls, data: str, size_bits: int, hashes: int) -> "BloomFilter":
+        return cls(size_bits, hashes, bytearray(base64.b64decode(data)))
+
+
+class WorkoutDedupIndex:
+    """
+    Bounded per-user index of seen workout IDs (HealthKit sample UUIDs)
+
+    IDs of workouts within `horizon` seconds of the newest workout seen are kept
+    exactly (up to `max_exact` of them). Older IDs, and the oldest ones beyond
+    `max_exact`, move into Bloom filters sized for the IDs actually retired, each
+    layer twice the capacity of the last at half the error rate. Every ID not
+    held exactly is checked against the filters, whatever its timestamp (a
+    retry may arrive stamped with the server's clock), so a new workout is
+    rejected by mistake at a rate below `error_rate` however long the history,
+    and a user who never retires an ID carries no filter at all.
+
+    Layers stop growing at `max_layers`: from then on a full layer drops the
+    oldest one, so memory stays bounded and only the oldest retired IDs (over
+    (2 ** max_layers - 1) * initial_capacity of them) are forgotten.
+
+    The horizon follows workout timestamps, not the clock, so replaying the
+    same workouts always rebuilds the same index.
+    """
+
+    def __init__(self, horizon: float = 30 * DAY, max_exact: int = 1024, error_rate: float = 1e-4,
+                 initial_capacity: int = 16, max_layers: int = 8):
+        self.horizon = horizon
+        self.max_exact = max_exact
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.max_layers = max_layers
+        self.exact = {}  # type: Dict[str, int]  # id -> timestamp (rounded up) of every workout not yet retired
+        self.newest = None  # type: Optional[float]  # latest workout timestamp seen
+        self.retired = []  # type: List[BloomFilter]  # oldest first
+        self.retired_counts = []  # type: List[int]
+        self._pruned_at = None  # type: Optional[float]  # `newest` at the last horizon scan
+
+    def seen(self, workout_id: str) -> bool:
+        if workout_id in self.exact:
+            return True
+        if not self.retired:
+            return False
+        digest = key_digest(workout_id, max(layer.hashes for layer in self.retired))  # hashed once for every layer
+        return any(layer.contains_digest(digest) for layer in self.retired)  # an id retired earlier, bar error_rate
+
+    def add(self, workout_id: str, timestamp: float):
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+        if timestamp < self.newest - self.horizon:  # backfilled history goes straight to the filters
+            self._retire(workout_id)
+            return
+        self.exact[workout_id] = math.ceil(timestamp)
+        if self._pruned_at is None or self.newest - self._pruned_at >= DAY:
+            self._prune()
+        if len(self.exact) > self.max_exact:  # retire the oldest eighth in one pass rather than one id per add
+            for workout_id in sorted(self.exact, key=self.exact.get)[:len(self.exact) - self.max_exact * 7 // 8]:
+                del self.exact[workout_id]
+                self._retire(workout_id)
+
+    def _prune(self): # retire ids that fell behind the horizon (at most once per day of workout time)
+        self._pruned_at = self.newest
+        cutoff = self.newest - self.horizon
+        for workout_id in [workout_id for workout_id, ts in self.exact.items() if ts < cutoff]:
+            del self.exact[workout_id]
+            self._retire(workout_id)
+
+    def _capacity(self, layer: int) -> int: # ids the layer-th filter is sized for
+        return self.initial_capacity << min(layer, self.max_layers - 1)
+
+    def _retire(self, workout_id: str):
+        if not self.retired or self.retired_counts[-1] >= self._capacity(len(self.retired) - 1):
+            layer = min(len(self.retired), self.max_layers - 1)
+            if len(self.retired) >= self.max_layers:  # full: forget the oldest ids rather than grow
+                del self.retired[0], self.retired_counts[0]
+            self.retired.append(BloomFilter.for_capacity(self._capacity(layer), self.error_rate / 2 ** (layer + 1)))
+            self.retired_counts.append(0)
+        self.retired[-1].add(workout_id)
+        self.retired_counts[-1] += 1
+
+    def to_dict(self) -> Dict:
+        data = {"exact": dict(self.exact), "newest": self.newest}
+        if self.retired:
+            data["retired"] = [
+                {"bits": layer.encode(), "size_bits": layer.size_bits, "hashes": layer.hashes, "count": count}
+                for layer, count in zip(self.retired, self.retired_counts)
+            ]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict], **kwargs) -> "WorkoutDedupIndex":
+        index = cls(**kwargs)
+        if not data:
+            return index
+        index.exact = dict(data.get("exact", {}))
+        index.newest = data.get("newest")
+        for layer in data.get("retired", []):
+            index.retired.append(BloomFilter.decode(layer["bits"], layer["size_bits"], layer["hashes"]))
+            index.retired_counts.append(layer["count"])
+        return index
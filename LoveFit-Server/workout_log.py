@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from metrics import PERSIST_WRITE
+
+log = logging.getLogger("lovefit.workout_log")
+
+
+class WorkoutEventLog:
+    """
+    Append-only JSONL log of every accepted workout, with periodic snapshots
+
+    One event per line, in the order the engine applied them:
+        {"n": 17, "u": "alice", "w": ["running", 5000, 1800, "hk-uuid", 1760000000.0]}  # workout
+        {"n": 18, "u": "alice", "reset": true}                                          # progress reset
+    "n" is a sequence number; "w" is [type, distance, duration, id, timestamp].
+
+    Progress records are a fold over this log. A snapshot (snapshot.jsonl: a JSON
+    header line, then one `"user_id"<TAB>{record}` line per user; JSON escapes tabs
+    inside strings) stores every record together with the log offset it was started at, so startup loads the snapshot
+    and replays only the tail. Records remember the sequence number of the last
+    event applied to them ("_seq"), which lets a snapshot be taken while requests
+    keep writing: replay skips events a snapshotted record already contains.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 100000, snapshot_interval: float = 60.0):
+        """
+        Args:
+            directory: holds workouts.jsonl and snapshot.jsonl
+            snapshot_every: new events that make a snapshot due
+            snapshot_interval: seconds between checks of the background snapshotter
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "workouts.jsonl")
+        self.snapshot_path = os.path.join(directory, "snapshot.jsonl")
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()  # one snapshot at a time
+        self.seq = self._recover()  # last sequence number in the log
+        self._log = open(self.path, 'ab')
+        self.snapshot_seq = self.snapshot_header().get("seq", 0)
+        self._closed = threading.Event()
+        self._snapshotter = None  # type: Optional[threading.Thread]
+
+    def _recover(self) -> int:
+        """Cut a torn final line left by a crash and return the last sequence number"""
+        if not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+            return 0
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+        end = tail.rfind(b"\n") + 1
+        if end < len(tail):
+            os.truncate(self.path, size - len(tail) + end)
+        lines = tail[:end].splitlines()
+        return json.loads(lines[-1])["n"] if lines else 0
+
+    def append(self, user_id: str, workouts: Iterable[Dict]) -> int:
+        """Log accepted workouts of one user in one write; returns the sequence number of the last"""
+        with self._lock:
+            started = time.perf_counter()
+            lines = []
+            for w in workouts:
+                self.seq += 1
+                lines.append(json.dumps({"n": self.seq, "u": user_id, "w": [
+                    w["type"], w["distance"], w["duration"], w.get("id"), w["timestamp"]]}, ensure_ascii=False))
+            if not lines:
+                return self.seq
+            self._log.write(("\n".join(lines) + "\n").encode('utf-8'))
+            self._log.flush()
+            PERSIST_WRITE.observe(time.perf_counter() - started, target="workout_log")
+            return self.seq
+
+    def append_reset(self, user_id: str) -> int:
+        with self._lock:
+            self.seq += 1
+            self._log.write((json.dumps({"n": self.seq, "u": user_id, "reset": True}, ensure_ascii=False) + "\n")
+                            .encode('utf-8'))
+            self._log.flush()
+            return self.seq
+
+    def position(self) -> Tuple[int, int]: # (byte offset, sequence number) of the end of the log
+        with self._lock:
+            self._log.flush()
+            return self._log.tell(), self.seq
+
+    def events(self, offset: int = 0, user_id: Optional[str] = None) -> Iterator[Dict]:
+        """Events from byte `offset` on (optionally one user's), in log order"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # being written right now
+                event = json.loads(line)
+                if user_id is None or event["u"] == user_id:
+                    yield event
+
+    def snapshot_header(self) -> Dict: # {"offset", "seq", "requirements_version", "users", "created"}, or {} without a snapshot
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return {}
+
+    def snapshot_records(self) -> Iterator[Tuple[str, str]]: # (user_id, record JSON), left encoded for lazy loading
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                user_id, data = line.rstrip("\n").split("\t", 1)
+                yield json.loads(user_id), data
+
+    def write_snapshot(self, records: Iterable[Tuple[str, str]], requirements_version: str) -> Dict:
+        """
+        Write a new snapshot and atomically replace the previous one
+
+        Args:
+            records: (user_id, record JSON) pairs; each record must include every event
+                up to the moment it is read, which is after the offset recorded here
+            requirements_version: catalogue the records' unlocks were evaluated against
+        Returns:
+            the snapshot header
+        """
+        with self._snapshot_lock:
+            return self._write_snapshot(records, requirements_version)
+
+    def _write_snapshot(self, records: Iterable[Tuple[str, str]], requirements_version: str) -> Dict:
+        offset, seq = self.position()  # before reading any record, so the tail replay covers the rest
+        started = time.perf_counter()
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".jsonl", dir=os.path.dirname(self.snapshot_path))
+        users = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b" " * 256 + b"\n")  # header placeholder, filled in once the user count is known
+                for user_id, data in records:
+                    f.write(f'{json.dumps(user_id, ensure_ascii=False)}\t{data}\n'.encode('utf-8'))
+                    users += 1
+                header = json.dumps({"offset": offset, "seq": seq, "requirements_version": requirements_version,
+                                     "users": users, "created": time.time()}).encode('utf-8')
+                f.seek(0)
+                f.write(header.ljust(256))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.snapshot_seq = seq
+        PERSIST_WRITE.observe(time.perf_counter() - started, target="workout_snapshot")
+        log.info("workout snapshot written", extra={"fields": {
+            "users": users, "seq": seq, "seconds": round(time.perf_counter() - started, 3)}})
+        return self.snapshot_header()
+
+    def snapshot_due(self) -> bool:
+        return self.seq - self.snapshot_seq >= self.snapshot_every
+
+    def start_snapshots(self, take: Callable[[], object]):
+        """Call `take` (e.g. GameEngine.snapshot) from a background thread whenever a snapshot is due"""
+        def run():
+            while not self._closed.wait(self.snapshot_interval):
+                if self.snapshot_due():
+                    try:
+                        take()
+                    except Exception as e:
+                        log.error("workout snapshot failed", extra={"fields": {"error": str(e)}})
+        self._snapshotter = threading.Thread(target=run, name="workout-snapshots", daemon=True)
+        self._snapshotter.start()
+
+    def stats(self) -> Dict:
+        return {"seq": self.seq, "bytes": os.path.getsize(self.path), "snapshot_seq": self.snapshot_seq}
+
+    def close(self):
+        self._closed.set()
+        if self._snapshotter is not None:
+            self._snapshotter.join(timeout=5)
+        with self._lock:
+            self._log.close()
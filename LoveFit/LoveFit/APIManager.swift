@@ -11,18 +11,24 @@ import Foundation
 class APIManager: ObservableObject {
     private let baseURL = "http://10.228.17.21:5001/api" // important: 确保手机和电脑在同一WiFi
     
-    func submitWorkoutData(type: String, distance: Double, duration: Int, completion: @escaping (Result<[String: Any], Error>) -> Void) {
+    func submitWorkoutData(type: String, distance: Double, duration: Int, workoutId: String? = nil, timestamp: Double? = nil, completion: @escaping (Result<[String: Any], Error>) -> Void) {
         guard let url = URL(string: "\(baseURL)/user-progress") else { return }
         
         var request = URLRequest(url: url)
         request.httpMethod = "POST"
         request.setValue("application/json", forHTTPHeaderField: "Content-Type")
         
-        let body: [String: Any] = [
+        var body: [String: Any] = [
             "type": type,
             "distance": distance,
             "duration": duration
         ]
+        if let workoutId = workoutId {
+            body["id"] = workoutId // HealthKit UUID，服务端据此去重，重试不会重复计数
+        }
+        if let timestamp = timestamp {
+            body["timestamp"] = timestamp // 运动结束时间，用于按天/周统计和连续打卡
+        }
         
         request.httpBody = try? JSONSerialization.data(withJSONObject: body)
         
@@ -38,4 +44,26 @@ class APIManager: ObservableObject {
             }
         }.resume()
     }
+    
+    // 批量提交（HealthKit 首次同步），一次请求代替逐条上传
+    func submitWorkoutBatch(workouts: [[String: Any]], completion: @escaping (Result<[String: Any], Error>) -> Void) {
+        guard let url = URL(string: "\(baseURL)/user-progress/batch") else { return }
+        
+        var request = URLRequest(url: url)
+        request.httpMethod = "POST"
+        request.setValue("application/json", forHTTPHeaderField: "Content-Type")
+        request.httpBody = try? JSONSerialization.data(withJSONObject: workouts)
+        
+        URLSession.shared.dataTask(with: request) { data, response, error in
+            if let error = error {
+                completion(.failure(error))
+                return
+            }
+            
+            if let data = data,
+               let json = try? JSONSerialization.jsonObject(with: data) as? [String: Any] {
+                completion(.success(json))
+            }
+        }.resume()
+    }
 }
@@ -155,7 +155,9 @@ struct ContentView: View {
             apiManager.submitWorkoutData(
                 type: type,
                 distance: distance,
-                duration: duration
+                duration: duration,
+                workoutId: workout.uuid.uuidString,
+                timestamp: workout.endDate.timeIntervalSince1970
             ) { result in
                 processedCount += 1
                 